@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from telemetry import ANSWER_CACHE
+
+logger = logging.getLogger(__name__)
+
+def normalize_question(question: str) -> str:
+    """Normalize a question for exact-match keys."""
+    return " ".join(question.lower().split())
+
+class AnswerCache:
+    """Semantic answer cache: matches questions by embedding similarity, with TTL and LRU eviction.
+
+    Each entry owns a row of a preallocated matrix of unit-length question embeddings, so
+    a lookup is one matrix-vector product instead of a Python loop over the entries.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 600, max_items: int = 256):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.generation = 0  # clear() 时递增，防止旧的生成结果写回缓存
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._entries = OrderedDict()  # (scope, 问题) -> {"answer", "slot"}，按 LRU 排序
+        self._free = list(range(self.max_items))
+        self._slot_keys: List = [None] * self.max_items
+        self._scopes = np.full(self.max_items, None, dtype=object)
+        self._created = np.full(self.max_items, np.inf)  # 空闲行永不过期
+        self._has_vector = np.zeros(self.max_items, dtype=bool)
+        self._vectors = None  # (max_items, 维度) 的单位向量矩阵，第一次写入时按维度分配
+
+    def lookup(self, question: str, embedding: Optional[Sequence[float]], scope: str = "") -> Optional[str]:
+        """Return a cached answer for the question or a semantically similar one.
+
+        Without an embedding (lexical fast path) only the exact question matches. Only
+        answers stored under the same scope (e.g. the searched shards) are considered.
+        """
+        key = (scope, normalize_question(question))
+        query = self._unit(embedding) if embedding is not None else None
+        with self._lock:
+            self._expire(time.time())
+
+            best_key = key if key in self._entries else None
+            if best_key is None and query is not None and self._vectors is not None and len(query) == self._vectors.shape[1]:
+                scores = self._vectors @ query
+                scores[~(self._has_vector & (self._scopes == scope))] = -np.inf
+                slot = int(np.argmax(scores))
+                if scores[slot] >= self.similarity_threshold:
+                    best_key = self._slot_keys[slot]
+
+            if best_key is None:
+                self.misses += 1
+                ANSWER_CACHE.inc(result="miss")
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            ANSWER_CACHE.inc(result="hit")
+            return self._entries[best_key]['answer']
+
+    def store(self, question: str, embedding: Optional[Sequence[float]], answer: str, generation: int, scope: str = ""):
+        """Cache an answer unless the cache was cleared after its generation started."""
+        vector = self._unit(embedding) if embedding is not None else None
+        with self._lock:
+            if generation != self.generation or self.max_items <= 0:
+                return
+            key = (scope, normalize_question(question))
+            if key in self._entries:
+                self._remove(key)
+            elif not self._free:
+                self._remove(next(iter(self._entries)))  # 淘汰最久未使用的条目
+
+            slot = self._free.pop()
+            self._slot_keys[slot] = key
+            self._scopes[slot] = scope
+            self._created[slot] = time.time()
+            if vector is not None:
+                if self._vectors is None or self._vectors.shape[1] != len(vector):
+                    # 嵌入维度变了（换了模型），旧向量无法比较
+                    self._vectors = np.zeros((self.max_items, len(vector)), dtype=np.float32)
+                    self._has_vector[:] = False
+                self._vectors[slot] = vector
+                self._has_vector[slot] = True
+            self._entries[key] = {"answer": answer, "slot": slot}
+
+    def clear(self):
+        """Drop all cached answers, e.g. after the collection changed."""
+        with self._lock:
+            self._reset()
+            self.generation += 1
+        logger.info("Answer cache cleared")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "items": len(self._entries)}
+
+    def _expire(self, now: float):
+        for slot in np.flatnonzero(now - self._created > self.ttl_seconds):
+            self._remove(self._slot_keys[slot])
+
+    def _remove(self, key):
+        slot = self._entries.pop(key)['slot']
+        self._slot_keys[slot] = None
+        self._scopes[slot] = None
+        self._created[slot] = np.inf
+        self._has_vector[slot] = False
+        self._free.append(slot)
+
+    @staticmethod
+    def _unit(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class _Flight:
+    """Events produced so far by one in-flight request."""
+
+    def __init__(self):
+        self.events: List = []
+        self.done = False
+        self.condition = threading.Condition()
+
+class RequestCoalescer:
+    """Run one producer per key and replay its events to every concurrent subscriber.
+
+    The producer runs in a background thread, so a subscriber disconnecting does not
+    stop the stream for the others.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, key: str, producer: Callable[[], Iterator]) -> Iterator:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                # 复制 contextvars，生产者线程的日志沿用发起请求的 trace ID
+                threading.Thread(target=contextvars.copy_context().run, args=(self._run, key, flight, producer),
+                                 daemon=True).start()
+            else:
+                logger.info(f"Joining in-flight request: {key[:50]}")
+        return self._replay(flight)
+
+    def _run(self, key: str, flight: _Flight, producer: Callable[[], Iterator]):
+        try:
+            for event in producer():
+                with flight.condition:
+                    flight.events.append(event)
+                    flight.condition.notify_all()
+        except Exception as e:
+            logger.error(f"Error in coalesced request: {str(e)}")
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    @staticmethod
+    def _replay(flight: _Flight) -> Iterator:
+        idx = 0
+        while True:
+            with flight.condition:
+                while idx >= len(flight.events) and not flight.done:
+                    flight.condition.wait()
+                events = flight.events[idx:]
+                idx += len(events)
+                finished = flight.done and idx >= len(flight.events)
+            yield from events
+            if finished:
+                return
+
+class AsyncRequestCoalescer:
+    """asyncio counterpart of RequestCoalescer for the ASGI serving path."""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._tasks = set()  # 事件循环只持有任务的弱引用，这里保留强引用直到任务结束
+
+    def subscribe(self, key: str, producer: Callable[[], AsyncIterator]) -> AsyncIterator:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.condition = asyncio.Condition()
+            self._flights[key] = flight
+            task = asyncio.ensure_future(self._run(key, flight, producer))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            logger.info(f"Joining in-flight request: {key[:50]}")
+        return self._replay(flight)
+
+    async def _run(self, key: str, flight: _Flight, producer: Callable[[], AsyncIterator]):
+        try:
+            async for event in producer():
+                async with flight.condition:
+                    flight.events.append(event)
+                    flight.condition.notify_all()
+        except Exception as e:
+            logger.error(f"Error in coalesced request: {str(e)}")
+        finally:
+            self._flights.pop(key, None)
+            async with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+
+    @staticmethod
+    async def _replay(flight: _Flight) -> AsyncIterator:
+        idx = 0
+        while True:
+            async with flight.condition:
+                await flight.condition.wait_for(lambda: idx < len(flight.events) or flight.done)
+                events = flight.events[idx:]
+                idx += len(events)
+                finished = flight.done and idx >= len(flight.events)
+            for event in events:
+                yield event
+            if finished:
+                return
@@ -1,71 +1,143 @@
-from flask import Flask, request, jsonify, render_template, Response
-from ops_agent import OpsAgent
-import json
-import logging
-from logging.handlers import RotatingFileHandler
-import yaml
+from flask import Flask, request, jsonify, render_template, Response, g
+from ops_agent import READ_ONLY_MESSAGE, get_agent, parse_batch_concurrency
+from ingest_jobs import get_job_manager
+from settings import get_config, get_role
+from shards import ShardBusyError, parse_shard_list, validate_shard_name
+from telemetry import CONTENT_TYPE, REGISTRY, REQUESTS, REQUEST_SECONDS, bind_trace, configure_logging, new_trace_id
+import time
 
-# 加载配置文件
-with open("config/config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-
-app = Flask(__name__)
-
-# Configure logging
-handler = RotatingFileHandler('logs/app.log', maxBytes=10000, backupCount=1)
-handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-app.logger.addHandler(handler)
-app.logger.setLevel(logging.INFO)
-
-# Initialize the agent
-agent = OpsAgent(
-    wiki_domain=config["wiki"]["domain"],
-    wiki_username=config["wiki"]["username"],
-    wiki_password=config["wiki"]["password"],
-    persist_directory=config["vector_db"]["persist_directory"]
-)
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/init', methods=['POST'])
-def init():
-    if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 415
+def create_app() -> Flask:
+    """Build the Flask app; the agent is created lazily on the first request that needs it."""
+    app = Flask(__name__)
     
-    data = request.get_json()
-    page_id = data.get('page_id')
-    if not page_id:
-        return jsonify({"error": "Missing 'page_id' in request"}), 400
+    # Configure logging：日志带 trace ID，文件按大小轮转
+    configure_logging(get_config().get("logging"))
     
-    try:
-        agent.initialize(page_id)
-        return jsonify({"message": "Vector database initialized successfully"})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-@app.route('/query', methods=['GET'])
-def query():
-    question = request.args.get('question')
-    if not question:
-        return jsonify({"error": "Missing 'question' parameter"}), 400
+    @app.before_request
+    def start_trace():
+        g.trace_id = new_trace_id(request.headers.get('X-Request-ID'))
+        g.started = time.perf_counter()
+    
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or "unknown"
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.started, endpoint=endpoint)
+        response.headers['X-Trace-ID'] = g.trace_id
+        return response
+    
+    @app.route('/')
+    def index():
+        return render_template('index.html')
     
-    try:
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+    
+    @app.route('/init', methods=['POST'])
+    def init():
+        if get_role() == "reader":
+            return jsonify({"error": READ_ONLY_MESSAGE}), 409
+        if not request.is_json:
+            return jsonify({"error": "Request must be JSON"}), 415
+        
+        data = request.get_json()
+        page_id = data.get('page_id')
+        if not page_id:
+            return jsonify({"error": "Missing 'page_id' in request"}), 400
+        shard = data.get('shard')
+        if shard is not None:
+            try:
+                validate_shard_name(shard)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        
+        # 抓取和入库在后台任务中执行，前端通过 /init/<job_id> 轮询进度
+        job = get_job_manager().submit(page_id, incremental=not data.get('full', False), shard=shard)
+        return jsonify(dict(job.to_dict(), message="Initialization started")), 202
+    
+    @app.route('/init/<job_id>', methods=['GET'])
+    def init_status(job_id):
+        job = get_job_manager().get(job_id)
+        if job is None:
+            return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+        return jsonify(job.to_dict())
+    
+    @app.route('/init/<job_id>', methods=['DELETE'])
+    def init_cancel(job_id):
+        job = get_job_manager().cancel(job_id)
+        if job is None:
+            return jsonify({"error": f"Unknown job '{job_id}'"}), 404
+        return jsonify(job.to_dict())
+    
+    @app.route('/shards', methods=['GET'])
+    def shards():
+        return jsonify({"shards": get_agent().list_shards()})
+    
+    @app.route('/shards/<name>', methods=['DELETE'])
+    def drop_shard(name):
+        if get_role() == "reader":
+            return jsonify({"error": READ_ONLY_MESSAGE}), 409
+        try:
+            dropped = get_agent().drop_shard(name)
+        except ShardBusyError as e:
+            return jsonify({"error": str(e)}), 409
+        if not dropped:
+            return jsonify({"error": f"Unknown shard '{name}'"}), 404
+        return jsonify({"message": f"Shard '{name}' dropped"})
+    
+    @app.route('/query', methods=['GET'])
+    def query():
+        question = request.args.get('question')
+        if not question:
+            return jsonify({"error": "Missing 'question' parameter"}), 400
+        try:
+            # 可选的 shards=a,b 只检索这些分片
+            shards = get_agent().vector_db.select_shards(parse_shard_list(request.args.get('shards')))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        try:
+            # 响应体在视图返回后才被迭代，需要把 trace ID 带进生成器
+            return Response(
+                bind_trace(get_agent().stream_query(question, shards), g.trace_id),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
+        except Exception as e:
+            app.logger.error(f"Error in query endpoint: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/query/batch', methods=['POST'])
+    def query_batch():
+        if not request.is_json:
+            return jsonify({"error": "Request must be JSON"}), 415
+        
+        data = request.get_json()
+        questions = data.get('questions')
+        if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+            return jsonify({"error": "'questions' must be a non-empty list of strings"}), 400
+        max_questions = get_config().get("batch", {}).get("max_questions", 500)
+        if len(questions) > max_questions:
+            return jsonify({"error": f"At most {max_questions} questions per batch"}), 400
+        try:
+            concurrency = parse_batch_concurrency(data.get('concurrency'))
+            shards = get_agent().vector_db.select_shards(parse_shard_list(data.get('shards')))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # 每个问题完成后立即输出一行 JSON，顺序为完成顺序，按 index 对应原问题
         return Response(
-            agent.stream_query(question),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no'
-            }
+            bind_trace(get_agent().stream_batch(questions, concurrency, shards), g.trace_id),
+            mimetype='application/x-ndjson',
+            headers={'X-Accel-Buffering': 'no'}
         )
-    except Exception as e:
-        logger.error(f"Error in query endpoint: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    
+    return app
 
 if __name__ == "__main__":
-    app.run(host=config["app"]["host"], port=config["app"]["port"], debug=config["app"]["debug"]) 
\ No newline at end of file
+    config = get_config()
+    create_app().run(host=config["app"]["host"], port=config["app"]["port"], debug=config["app"]["debug"])
@@ -0,0 +1,179 @@
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+from ops_agent import READ_ONLY_MESSAGE, get_agent, parse_batch_concurrency
+from ingest_jobs import get_job_manager
+from settings import get_config, get_role
+from shards import ShardBusyError, parse_shard_list, validate_shard_name
+from siliconflow_client import API_BASE, AsyncSiliconFlowClient
+from telemetry import CONTENT_TYPE, REGISTRY, REQUESTS, REQUEST_SECONDS, configure_logging, new_trace_id
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class TraceMiddleware:
+    """Give every HTTP request a trace ID and record its status and latency.
+
+    The trace ID is set before the route runs, so the streaming response body, which
+    runs in a task copied from the route's context, logs with the same ID.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        headers = dict(scope["headers"])
+        trace_id = new_trace_id(headers.get(b"x-request-id", b"").decode("latin-1"))
+        started = time.perf_counter()
+        
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                endpoint = getattr(scope.get("endpoint"), "__name__", "unknown")
+                REQUESTS.inc(endpoint=endpoint, status=message["status"])
+                REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode("latin-1"))]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_trace)
+
+def create_app() -> Starlette:
+    """Build the ASGI app; the agent is created lazily and the HTTP client lives for the app's lifespan."""
+    config = get_config()
+    configure_logging(config.get("logging"))
+    templates = Jinja2Templates(directory="templates")
+    state = {}
+    
+    async def index(request):
+        return templates.TemplateResponse(request, "index.html")
+    
+    async def metrics(request):
+        return Response(REGISTRY.render(), headers={"Content-Type": CONTENT_TYPE})
+    
+    async def init(request):
+        if get_role() == "reader":
+            return JSONResponse({"error": READ_ONLY_MESSAGE}, status_code=409)
+        if request.headers.get("content-type", "").split(";")[0] != "application/json":
+            return JSONResponse({"error": "Request must be JSON"}, status_code=415)
+        
+        data = await request.json()
+        page_id = data.get('page_id')
+        if not page_id:
+            return JSONResponse({"error": "Missing 'page_id' in request"}, status_code=400)
+        shard = data.get('shard')
+        if shard is not None:
+            try:
+                validate_shard_name(shard)
+            except ValueError as e:
+                return JSONResponse({"error": str(e)}, status_code=400)
+        
+        # 抓取和入库在后台任务中执行，前端通过 /init/{job_id} 轮询进度
+        manager = await run_in_threadpool(get_job_manager)
+        job = manager.submit(page_id, incremental=not data.get('full', False), shard=shard)
+        return JSONResponse(dict(job.to_dict(), message="Initialization started"), status_code=202)
+    
+    async def init_job(request):
+        manager = await run_in_threadpool(get_job_manager)
+        job_id = request.path_params['job_id']
+        job = manager.cancel(job_id) if request.method == 'DELETE' else manager.get(job_id)
+        if job is None:
+            return JSONResponse({"error": f"Unknown job '{job_id}'"}, status_code=404)
+        return JSONResponse(job.to_dict())
+    
+    async def shards(request):
+        agent = await run_in_threadpool(get_agent)
+        return JSONResponse({"shards": agent.list_shards()})
+    
+    async def drop_shard(request):
+        if get_role() == "reader":
+            return JSONResponse({"error": READ_ONLY_MESSAGE}, status_code=409)
+        agent = await run_in_threadpool(get_agent)
+        name = request.path_params['name']
+        try:
+            dropped = await run_in_threadpool(agent.drop_shard, name)
+        except ShardBusyError as e:
+            return JSONResponse({"error": str(e)}, status_code=409)
+        if not dropped:
+            return JSONResponse({"error": f"Unknown shard '{name}'"}, status_code=404)
+        return JSONResponse({"message": f"Shard '{name}' dropped"})
+    
+    async def query(request):
+        question = request.query_params.get('question')
+        if not question:
+            return JSONResponse({"error": "Missing 'question' parameter"}, status_code=400)
+        
+        agent = await run_in_threadpool(get_agent)
+        try:
+            # 可选的 shards=a,b 只检索这些分片
+            shards = agent.vector_db.select_shards(parse_shard_list(request.query_params.get('shards')))
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        return StreamingResponse(
+            agent.astream_query(question, state["client"], shards),
+            media_type='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+    
+    async def query_batch(request):
+        if request.headers.get("content-type", "").split(";")[0] != "application/json":
+            return JSONResponse({"error": "Request must be JSON"}, status_code=415)
+        
+        data = await request.json()
+        questions = data.get('questions')
+        if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+            return JSONResponse({"error": "'questions' must be a non-empty list of strings"}, status_code=400)
+        max_questions = config.get("batch", {}).get("max_questions", 500)
+        if len(questions) > max_questions:
+            return JSONResponse({"error": f"At most {max_questions} questions per batch"}, status_code=400)
+        
+        # 批量接口用同步客户端，生成器由 StreamingResponse 放到线程池中迭代
+        agent = await run_in_threadpool(get_agent)
+        try:
+            concurrency = parse_batch_concurrency(data.get('concurrency'))
+            shards = agent.vector_db.select_shards(parse_shard_list(data.get('shards')))
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        return StreamingResponse(
+            agent.stream_batch(questions, concurrency, shards),
+            media_type='application/x-ndjson',
+            headers={'X-Accel-Buffering': 'no'}
+        )
+    
+    @asynccontextmanager
+    async def lifespan(app):
+        state["client"] = AsyncSiliconFlowClient(
+            config["siliconflow"]["api_key"],
+            max_connections=config.get("asgi", {}).get("max_connections", 200),
+            max_retries=config["siliconflow"].get("max_retries", 3),
+            initial_concurrency=config["siliconflow"].get("initial_concurrency", 8),
+            max_concurrency=config["siliconflow"].get("max_concurrency", 32),
+            base_url=config["siliconflow"].get("base_url", API_BASE)
+        )
+        yield
+        await state["client"].aclose()
+    
+    return Starlette(
+        routes=[
+            Route('/', index),
+            Route('/metrics', metrics, methods=['GET']),
+            Route('/init', init, methods=['POST']),
+            Route('/init/{job_id}', init_job, methods=['GET', 'DELETE']),
+            Route('/shards', shards, methods=['GET']),
+            Route('/shards/{name}', drop_shard, methods=['DELETE']),
+            Route('/query', query, methods=['GET']),
+            Route('/query/batch', query_batch, methods=['POST']),
+        ],
+        middleware=[Middleware(TraceMiddleware)],
+        lifespan=lifespan
+    )
@@ -0,0 +1,92 @@
+"""Micro-benchmark for HTML-to-text extraction.
+
+Compares the original BeautifulSoup extraction with the lxml and html.parser engines of
+html_extract on synthetic Confluence storage-format pages, then measures throughput of
+cleaning many pages in a process pool.
+
+    python benchmarks/bench_html_extract.py --sections 200 --pages 64 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_extract import extract_text, _has_lxml  # noqa: E402
+
+WORDS = "服务 重启 集群 节点 告警 日志 磁盘 网络 部署 回滚 service restart cluster node alert disk".split()
+
+def make_page(sections: int, seed: int = 0) -> str:
+    """Build a storage-format page with headings, paragraphs, tables, lists and code macros."""
+    rng = random.Random(seed)
+    words = lambda n: " ".join(rng.choice(WORDS) for _ in range(n))  # noqa: E731
+    parts = []
+    for idx in range(sections):
+        parts.append(f"<h2>{idx}. {words(4)}</h2>")
+        parts.append(f"<p>{words(40)} <strong>{words(3)}</strong> {words(20)}</p>")
+        rows = "".join(
+            f"<tr><td>host-{idx}-{row}</td><td>10.0.{idx % 256}.{row}</td><td><p>{words(6)}</p></td></tr>"
+            for row in range(8)
+        )
+        parts.append(f"<table><tbody><tr><th>主机</th><th>IP</th><th>说明</th></tr>{rows}</tbody></table>")
+        parts.append(f"<ul>{''.join(f'<li>{words(8)}</li>' for _ in range(4))}</ul>")
+        parts.append(
+            '<ac:structured-macro ac:name="code"><ac:parameter ac:name="language">bash</ac:parameter>'
+            f"<ac:plain-text-body><![CDATA[kubectl rollout restart deploy/app-{idx} -n prod\n"
+            f"  kubectl get pods -l app=app-{idx} | grep -v Running]]></ac:plain-text-body></ac:structured-macro>"
+        )
+    return "".join(parts)
+
+def time_engine(engine: str, page: str, repeat: int) -> float:
+    """Best-of-repeat seconds per extraction."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_text(page, engine)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def time_pool(engine: str, pages, processes: int) -> float:
+    """Seconds to extract all pages, serially or in a warmed-up process pool."""
+    if processes <= 1:
+        start = time.perf_counter()
+        for page in pages:
+            extract_text(page, engine)
+        return time.perf_counter() - start
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(extract_text, ["<p>warm-up</p>"] * processes * 2, [engine] * processes * 2))
+        start = time.perf_counter()
+        list(pool.map(extract_text, pages, [engine] * len(pages)))
+        return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", type=int, default=200, help="sections per synthetic page")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=64, help="pages for the process pool run")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    page = make_page(args.sections)
+    engines = ["bs4", "html.parser"] + (["lxml"] if _has_lxml() else [])
+    print(f"Page size: {len(page) / 1024:.0f} KB, {args.sections} sections")
+
+    baseline = None
+    for engine in engines:
+        seconds = time_engine(engine, page, args.repeat)
+        baseline = baseline or seconds
+        print(f"{engine:>12}: {seconds * 1000:8.1f} ms/page  {baseline / seconds:5.1f}x")
+
+    engine = engines[-1]
+    pages = [make_page(args.sections, seed) for seed in range(args.pages)]
+    serial = time_pool(engine, pages, 1)
+    pooled = time_pool(engine, pages, args.processes)
+    print(f"{args.pages} pages with {engine}: serial {serial:.2f}s, "
+          f"{args.processes} processes {pooled:.2f}s ({serial / pooled:.1f}x)")
+
+if __name__ == "__main__":
+    main()
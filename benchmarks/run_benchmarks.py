@@ -0,0 +1,227 @@
+"""End-to-end benchmarks against the local stand-in servers.
+
+Starts benchmarks/stub_servers.py in-process, points a temporary config at it and
+measures:
+
+    ingest   full ingestion of the stub corpus through OpsAgent.initialize (pages/s, chunks/s)
+    query    sequential OpsAgent.stream_query calls (latency and time-to-first-token p50/p95/p99)
+    sse      concurrent /query streams against the Flask app at increasing concurrency
+    stages   mean time per instrumented stage, from the telemetry histograms
+
+Results are written as JSON so runs can be compared:
+
+    python benchmarks/run_benchmarks.py --pages 300 --queries 50 --concurrency 1,8,32
+    python benchmarks/run_benchmarks.py --output benchmarks/results/baseline.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import yaml  # noqa: E402
+from stub_servers import ROOT_ID, StubServer, add_stub_arguments, stub_config_from_args  # noqa: E402
+
+QUESTION_WORDS = ["如何", "重启", "集群", "节点", "告警", "磁盘", "回滚", "部署", "service", "cluster", "restart", "disk"]
+
+def percentiles(values: List[float]) -> Dict:
+    """p50/p95/p99, mean and max of a list of seconds, in milliseconds."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]  # noqa: E731
+    return {
+        "count": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 2),
+        "p50_ms": round(1000 * pick(0.50), 2),
+        "p95_ms": round(1000 * pick(0.95), 2),
+        "p99_ms": round(1000 * pick(0.99), 2),
+        "max_ms": round(1000 * ordered[-1], 2)
+    }
+
+def question(idx: int) -> str:
+    """Distinct questions, so neither the answer cache nor request coalescing hides upstream work."""
+    words = [QUESTION_WORDS[(idx * 7 + k) % len(QUESTION_WORDS)] for k in range(4)]
+    return f"{' '.join(words)} 第{idx}次"
+
+def write_config(directory: str, stub_url: str, args) -> str:
+    """Write a config pointing at the stub servers and return its path."""
+    with open(os.path.join(REPO_DIR, "config", "config.example.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    config["wiki"].update(domain=stub_url, username="bench", password="bench", requests_per_second=None)
+    config["vector_db"]["persist_directory"] = os.path.join(directory, "db")
+    config["vector_db"]["backend"] = args.backend
+    config["siliconflow"].update(api_key="bench", base_url=f"{stub_url}/v1")
+    config["answer_cache"]["enabled"] = False
+    config["logging"] = {"level": args.log_level, "file": os.path.join(directory, "bench.log")}
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    return path
+
+def bench_ingest(agent) -> Dict:
+    started = time.perf_counter()
+    stats = agent.initialize(ROOT_ID, incremental=False)
+    elapsed = time.perf_counter() - started
+    return dict(
+        stats,
+        seconds=round(elapsed, 3),
+        pages_per_second=round(stats["pages_written"] / elapsed, 2),
+        chunks_per_second=round(stats["chunks_embedded"] / elapsed, 1)
+    )
+
+def bench_queries(agent, count: int) -> Dict:
+    latencies, ttfts, errors = [], [], 0
+    for idx in range(count):
+        started = time.perf_counter()
+        first_token = None
+        for event in agent.stream_query(question(idx)):
+            if first_token is None and '"delta"' in event:
+                first_token = time.perf_counter()
+            if '"error"' in event:
+                errors += 1
+        latencies.append(time.perf_counter() - started)
+        if first_token is not None:
+            ttfts.append(first_token - started)
+    return {"errors": errors, "latency": percentiles(latencies), "ttft": percentiles(ttfts)}
+
+def bench_sse(base_url: str, concurrency: int, requests_per_client: int, offset: int) -> Dict:
+    """Run `concurrency` clients that each stream `requests_per_client` answers from /query."""
+    import requests
+
+    results = {"latencies": [], "ttfts": [], "errors": 0}
+    lock = threading.Lock()
+
+    def client(client_idx: int):
+        session = requests.Session()
+        for request_idx in range(requests_per_client):
+            q = question(offset + client_idx * requests_per_client + request_idx)
+            started = time.perf_counter()
+            first_token, failed = None, False
+            try:
+                with session.get(f"{base_url}/query", params={"question": q}, stream=True, timeout=120) as response:
+                    failed = response.status_code != 200
+                    for line in response.iter_lines():
+                        if first_token is None and b'"delta"' in line:
+                            first_token = time.perf_counter()
+                        if b'"error"' in line:
+                            failed = True
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - started
+            with lock:
+                results["latencies"].append(elapsed)
+                if first_token is not None:
+                    results["ttfts"].append(first_token - started)
+                results["errors"] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(idx,)) for idx in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = concurrency * requests_per_client
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": results["errors"],
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 2),
+        "latency": percentiles(results["latencies"]),
+        "ttft": percentiles(results["ttfts"])
+    }
+
+def serve_flask(app):
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-flask", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def stage_summary() -> Dict:
+    from telemetry import STAGE_SECONDS
+
+    return {
+        key[0]: {"count": value["count"], "mean_ms": round(1000 * value["sum"] / value["count"], 3)}
+        for key, value in sorted(STAGE_SECONDS.snapshot().items()) if value["count"]
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=30, help="sequential stream_query calls")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated SSE client counts")
+    parser.add_argument("--requests-per-client", type=int, default=3)
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "numpy"])
+    parser.add_argument("--skip", default="", help="comma-separated benchmarks to skip: ingest,query,sse")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--workdir", default=None, help="reuse a directory (and its index) from an earlier run, e.g. with --skip ingest")
+    parser.add_argument("--output", default=None, help="JSON results path (default benchmarks/results/<time>.json)")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    skip = set(filter(None, args.skip.split(",")))
+
+    stub = StubServer(stub_config_from_args(args)).start()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="om-agent-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # 必须在导入 ops_agent 之前设置，settings 只加载一次配置
+    os.environ["OM_AGENT_CONFIG"] = write_config(workdir, stub.url, args)
+
+    from app import create_app
+    from ops_agent import get_agent
+
+    app = create_app()  # 同时按 logging 配置初始化日志
+    agent = get_agent()
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "workdir": workdir
+    }
+
+    if "ingest" not in skip:
+        results["ingest"] = bench_ingest(agent)
+        print(f"ingest: {results['ingest']['pages_per_second']} pages/s, {results['ingest']['chunks_per_second']} chunks/s")
+    if "query" not in skip:
+        results["query"] = bench_queries(agent, args.queries)
+        print(f"query: p50 {results['query']['latency'].get('p50_ms')} ms, "
+              f"p95 {results['query']['latency'].get('p95_ms')} ms, ttft p50 {results['query']['ttft'].get('p50_ms')} ms")
+    if "sse" not in skip:
+        server, base_url = serve_flask(app)
+        results["sse"] = []
+        offset = args.queries
+        for concurrency in [int(value) for value in args.concurrency.split(",") if value]:
+            level = bench_sse(base_url, concurrency, args.requests_per_client, offset)
+            offset += level["requests"]
+            results["sse"].append(level)
+            print(f"sse x{concurrency}: {level['requests_per_second']} req/s, {level['errors']} errors, "
+                  f"ttft p95 {level['ttft'].get('p95_ms')} ms")
+        server.shutdown()
+    results["stages"] = stage_summary()
+    stub.stop()
+
+    output = args.output or os.path.join(BENCH_DIR, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
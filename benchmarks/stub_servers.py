@@ -0,0 +1,268 @@
+"""Local stand-ins for the Confluence REST API and the SiliconFlow embeddings/chat APIs.
+
+One threaded HTTP server answers both:
+
+    GET  /rest/api/content/<id>          page with body.storage and version
+    GET  /rest/api/content/search        CQL 'ancestor=<root>' search, paginated
+    POST /v1/embeddings                  deterministic hashed bag-of-words vectors
+    POST /v1/chat/completions            streamed (SSE) or complete answers
+
+Point wiki.domain at the server URL and siliconflow.base_url at <url>/v1. Latency,
+token rate, error rate and corpus size are configurable, so ingestion and query paths
+can be measured without the real services:
+
+    python benchmarks/stub_servers.py --port 9000 --pages 500 --latency-ms 30 --token-rate 80
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_html_extract import WORDS, make_page  # noqa: E402
+from lexical_index import tokenize  # noqa: E402
+
+ROOT_ID = "100000"
+_throttle_lock = threading.Lock()
+
+class StubConfig:
+    """Behaviour of the stand-in servers."""
+
+    def __init__(self, pages: int = 200, sections: int = 20, latency_ms: float = 20.0, embed_ms_per_text: float = 0.5,
+                 ttft_ms: float = 200.0, token_rate: float = 100.0, answer_tokens: int = 150, error_rate: float = 0.0,
+                 dim: int = 1024, search_limit: int = 50, version: int = 1, seed: int = 0,
+                 embed_error_rate: float = 0.0, failing_pages: str = "", empty_pages: str = "",
+                 throttled_requests: int = 0):
+        self.pages = pages  # 根页面之外的子页面数
+        self.sections = sections  # 每个页面的章节数，决定页面大小
+        self.latency_ms = latency_ms  # 每个请求的基础延迟
+        self.embed_ms_per_text = embed_ms_per_text
+        self.ttft_ms = ttft_ms  # 对话接口返回第一个 token 前的延迟
+        self.token_rate = token_rate  # 流式输出速度（token/s），0 表示不限速
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate  # 以该概率返回 503（wiki）或 429/503（SiliconFlow）
+        self.dim = dim
+        self.search_limit = search_limit  # 服务端截断 CQL 搜索的 limit，用来覆盖分页逻辑
+        self.version = version  # 所有页面的版本号，调大可模拟整站更新
+        self.seed = seed
+        self.embed_error_rate = embed_error_rate  # 只作用于 embeddings 接口的额外失败率
+        self.failing_pages = failing_pages  # 逗号分隔的页面 ID，获取正文时总是返回 503
+        self.empty_pages = empty_pages  # 逗号分隔的页面 ID，正文为空
+        self.throttled_requests = throttled_requests  # 接下来的 N 个 SiliconFlow 请求返回 429
+
+class StubServer:
+    """Run the stand-in endpoints on a background thread."""
+
+    def __init__(self, config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        handler = type("BoundStubHandler", (_StubHandler,), {"stub": self.config})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="stub-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@lru_cache(maxsize=4096)
+def _page_html(page_id: str, sections: int, seed: int) -> str:
+    return make_page(sections, seed=seed * 1000003 + int(page_id))
+
+def embed_text(text: str, dim: int):
+    """Hashed bag-of-words embedding, so texts sharing words get similar vectors."""
+    vector = [0.0] * dim
+    for token in tokenize(text):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % dim] += 1.0 if value & (1 << 63) else -1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stub: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass  # 压测时不输出访问日志
+
+    # ---- Confluence ----
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self._sleep(self.stub.latency_ms)
+        if self._maybe_fail((503,)):
+            return
+        if url.path == "/rest/api/content/search":
+            self._search(parse_qs(url.query))
+            return
+        match = re.fullmatch(r"/rest/api/content/(\d+)", url.path)
+        if not match or not self._exists(match.group(1)):
+            self._json(404, {"message": "No content found"})
+            return
+        if match.group(1) in self.stub.failing_pages.split(","):
+            self._json(503, {"message": "Injected failure"})
+            return
+        self._json(200, self._content(match.group(1), with_body="body" in url.query))
+
+    def _exists(self, page_id: str) -> bool:
+        return 0 <= int(page_id) - int(ROOT_ID) <= self.stub.pages
+
+    def _content(self, page_id: str, with_body: bool) -> dict:
+        item = {
+            "id": page_id,
+            "type": "page",
+            "title": f"Runbook {page_id}",
+            "version": {"number": self.stub.version, "when": "2024-01-01T00:00:00.000Z"}
+        }
+        if with_body:
+            html = "" if page_id in self.stub.empty_pages.split(",") else _page_html(page_id, self.stub.sections, self.stub.seed)
+            item["body"] = {"storage": {"value": html, "representation": "storage"}}
+        return item
+
+    def _search(self, query: dict):
+        match = re.search(r"ancestor\s*=\s*(\d+)", query.get("cql", [""])[0])
+        if not match or match.group(1) != ROOT_ID:
+            self._json(200, {"results": [], "start": 0, "limit": 0, "size": 0, "_links": {}})
+            return
+        start = int(query.get("start", ["0"])[0])
+        limit = min(int(query.get("limit", ["25"])[0]), self.stub.search_limit)
+        ids = [str(int(ROOT_ID) + idx) for idx in range(1 + start, 1 + min(start + limit, self.stub.pages))]
+        links = {"next": f"/rest/api/content/search?start={start + len(ids)}"} if start + len(ids) < self.stub.pages else {}
+        self._json(200, {
+            "results": [self._content(page_id, with_body=False) for page_id in ids],
+            "start": start, "limit": limit, "size": len(ids), "_links": links
+        })
+
+    # ---- SiliconFlow ----
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        path = urlparse(self.path).path
+        if path == "/v1/embeddings":
+            texts = payload.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            self._sleep(self.stub.latency_ms + self.stub.embed_ms_per_text * len(texts))
+            if self._throttle() or self._maybe_fail((429, 503)) or self._maybe_fail((429,), self.stub.embed_error_rate):
+                return
+            self._json(200, {
+                "object": "list",
+                "model": payload.get("model"),
+                "data": [{"object": "embedding", "index": idx, "embedding": embed_text(text, self.stub.dim)}
+                         for idx, text in enumerate(texts)]
+            })
+        elif path == "/v1/chat/completions":
+            self._sleep(self.stub.latency_ms)
+            if self._throttle() or self._maybe_fail((429, 503)):
+                return
+            self._chat(payload)
+        else:
+            self._json(404, {"message": "Not found"})
+
+    def _chat(self, payload: dict):
+        question = payload.get("messages", [{}])[-1].get("content", "")
+        rng = random.Random(zlib.crc32(question.encode("utf-8")) ^ self.stub.seed)
+        tokens = [rng.choice(WORDS) + " " for _ in range(self.stub.answer_tokens)]
+        self._sleep(self.stub.ttft_ms)
+        if not payload.get("stream"):
+            self._sleep(1000.0 * len(tokens) / self.stub.token_rate if self.stub.token_rate else 0)
+            self._json(200, {"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}}]})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / self.stub.token_rate if self.stub.token_rate else 0
+        try:
+            for token in tokens:
+                chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if interval:
+                    time.sleep(interval)
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    # ---- helpers ----
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _maybe_fail(self, statuses, rate: float = None) -> bool:
+        rate = self.stub.error_rate if rate is None else rate
+        if rate and random.random() < rate:
+            self._json(random.choice(statuses), {"message": "Injected failure"})
+            return True
+        return False
+
+    def _throttle(self) -> bool:
+        with _throttle_lock:
+            if self.stub.throttled_requests <= 0:
+                return False
+            self.stub.throttled_requests -= 1
+        self._json(429, {"message": "Injected throttle"})
+        return True
+
+    @staticmethod
+    def _sleep(ms: float):
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """Command-line options shared by this script and the benchmark runner."""
+    defaults = StubConfig()
+    for name, value in vars(defaults).items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+
+def stub_config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(**{name: getattr(args, name) for name in vars(StubConfig())})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer(stub_config_from_args(args), host=args.host, port=args.port)
+    print(f"Stub servers on {server.url} (root page {ROOT_ID}, {args.pages} child pages)")
+    print(f"  wiki.domain: {server.url}\n  siliconflow.base_url: {server.url}/v1")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import logging
+import math
+from typing import Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+class ContextBuilder:
+    """Pack retrieved passages into a token budget, dropping near-duplicates and ordering by MMR."""
+
+    def __init__(self, encoder, max_tokens: int = 3000, mmr_lambda: float = 0.7, dedup_threshold: float = 0.85):
+        self.encoder = encoder
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda  # 1.0 只看相关性，0.0 只看多样性
+        self.dedup_threshold = dedup_threshold
+
+    def build(self, query_embedding: Sequence[float], passages: List[Dict], limit: int) -> List[Dict]:
+        """Select up to `limit` passages that fit the token budget.
+
+        Returns the selected passages in MMR order, each with a 'tokens' count; the last
+        one may be truncated to fill the remaining budget.
+        """
+        candidates = self._deduplicate(passages)
+        ordered = self._mmr(query_embedding, candidates, limit)
+
+        selected = []
+        remaining = self.max_tokens
+        for passage in ordered:
+            tokens = self.encoder.encode(self.format(passage))
+            if len(tokens) > remaining:
+                # 预算只剩很少时截断意义不大，直接结束
+                if remaining >= 64:
+                    passage = dict(passage, text=self.encoder.decode(tokens[:remaining]), truncated=True)
+                    selected.append(dict(passage, tokens=remaining))
+                break
+            selected.append(dict(passage, tokens=len(tokens)))
+            remaining -= len(tokens)
+
+        logger.info(
+            f"Context: {len(selected)} of {len(passages)} passages, "
+            f"{self.max_tokens - remaining} / {self.max_tokens} tokens"
+        )
+        return selected
+
+    def render(self, passages: List[Dict]) -> str:
+        """Join selected passages into the context string."""
+        return "\n\n".join(
+            passage['text'] if passage.get('truncated') else self.format(passage)
+            for passage in passages
+        )
+
+    @staticmethod
+    def format(passage: Dict) -> str:
+        title = passage.get('metadata', {}).get('title')
+        return f"[{title}]\n{passage['text']}" if title else passage['text']
+
+    def _deduplicate(self, passages: List[Dict]) -> List[Dict]:
+        """Drop passages whose token shingles mostly overlap a better-ranked passage."""
+        kept = []
+        kept_shingles = []
+        for passage in passages:
+            shingles = self._shingles(passage['text'])
+            if any(self._jaccard(shingles, other) >= self.dedup_threshold for other in kept_shingles):
+                continue
+            kept.append(passage)
+            kept_shingles.append(shingles)
+        return kept
+
+    def _mmr(self, query_embedding: Sequence[float], passages: List[Dict], limit: int) -> List[Dict]:
+        """Order passages by maximal marginal relevance."""
+        if query_embedding is None or not passages or any(passage.get('embedding') is None for passage in passages):
+            # 没有 embedding 时退回检索顺序
+            return passages[:limit]
+
+        relevance = [self._cosine(query_embedding, passage['embedding']) for passage in passages]
+        redundancy = [0.0] * len(passages)  # 与已选 passage 的最大相似度
+        remaining = list(range(len(passages)))
+        chosen = []
+        while remaining and len(chosen) < limit:
+            best = max(remaining, key=lambda idx: self.mmr_lambda * relevance[idx] - (1 - self.mmr_lambda) * redundancy[idx])
+            chosen.append(best)
+            remaining.remove(best)
+            for idx in remaining:
+                similarity = self._cosine(passages[idx]['embedding'], passages[best]['embedding'])
+                redundancy[idx] = max(redundancy[idx], similarity)
+        return [passages[idx] for idx in chosen]
+
+    def _shingles(self, text: str, size: int = 3) -> set:
+        tokens = self.encoder.encode(text)
+        return {tuple(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))}
+
+    @staticmethod
+    def _jaccard(a: set, b: set) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    @staticmethod
+    def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return dot / norm if norm else 0.0
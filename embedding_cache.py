@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-memory LRU in front of a SQLite file."""
+
+    def __init__(self, directory: str, max_memory_items: int = 10000, max_disk_items: int = 500000):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "embeddings.sqlite3")
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        # 磁盘行数在内存里维护，写入时不必每次 COUNT(*) 扫全表
+        self._disk_items = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """Hash (model, text) into a cache key."""
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Look up keys, returning None for misses."""
+        results = [None] * len(keys)
+        with self._lock:
+            pending = {}
+            for idx, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[idx] = self._memory[key]
+                    self.memory_hits += 1
+                else:
+                    pending.setdefault(key, []).append(idx)
+
+            if pending:
+                found = self._load(list(pending))
+                for key, vector in found.items():
+                    self._remember(key, vector)
+                    for idx in pending[key]:
+                        results[idx] = vector
+                    self.disk_hits += len(pending[key])
+                self.misses += sum(len(idxs) for key, idxs in pending.items() if key not in found)
+        return results
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        """Store vectors for keys in memory and on disk."""
+        now = time.time()
+        with self._lock:
+            rows = {}
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector)
+                rows[key] = (key, array("f", vector).tobytes(), now)
+            self._disk_items += len(rows) - self._count_existing(list(rows))
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows.values())
+            if self._disk_items > self.max_disk_items:
+                self._evict_disk()
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current sizes."""
+        with self._lock:
+            disk_items = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+                "disk_items": disk_items,
+            }
+
+    def _count_existing(self, keys: List[str]) -> int:
+        count = 0
+        for i in range(0, len(keys), 900):
+            batch = keys[i:i + 900]
+            placeholders = ",".join("?" * len(batch))
+            count += self._conn.execute(
+                f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchone()[0]
+        return count
+
+    def _load(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        now = time.time()
+        # SQLite 默认最多 999 个绑定参数
+        for i in range(0, len(keys), 900):
+            batch = keys[i:i + 900]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+        if found:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._conn.commit()
+        return found
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        # 其他进程也可能写同一个文件，真正淘汰前重新数一次
+        self._disk_items = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = self._disk_items - self.max_disk_items
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                (overflow,)
+            )
+            self._disk_items -= overflow
+            logger.info(f"Evicted {overflow} embeddings from disk cache")
@@ -0,0 +1,40 @@
+"""Gunicorn settings for production serving.
+
+One writer process owns ingestion (/init, dropping shards) and publishes each new index
+generation; any number of read-only query workers serve /query and switch to a new
+generation without restarting. Run the writer with a single worker and route /init and
+DELETE /shards to it:
+
+    OM_AGENT_ROLE=writer OM_AGENT_BIND=127.0.0.1:8081 gunicorn -c gunicorn.conf.py "app:create_app()"
+    OM_AGENT_ROLE=reader gunicorn -c gunicorn.conf.py "app:create_app()"
+
+Readers need `vector_db.backend: numpy` (memory-mapped snapshots shared by all workers)
+or a Chroma server (`vector_db.chroma_host`, started with `chroma run --path <dir>`).
+The ASGI app runs the same way with `-k uvicorn.workers.UvicornWorker "asgi:create_app()"`.
+"""
+import multiprocessing
+import os
+from settings import get_config, get_role
+
+_config = get_config()
+_serving = _config.get("serving", {})
+
+role = get_role()
+bind = os.environ.get("OM_AGENT_BIND", f"{_config['app']['host']}:{_config['app']['port']}")
+# 写入进程只能有一个；查询进程默认每个 CPU 一个
+workers = 1 if role == "writer" else _serving.get("workers") or multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = _serving.get("threads", 16)  # 每个 SSE 流占用一个线程
+timeout = _serving.get("timeout", 120)
+graceful_timeout = 30
+keepalive = 5
+# 不预加载：每个 worker 自己打开索引，避免在 fork 之前创建线程和数据库连接
+preload_app = False
+accesslog = "-"
+
+def post_worker_init(worker):
+    """Open the index before the first request, which also starts the refresh thread of readers."""
+    from ops_agent import get_agent
+
+    get_agent()
+    worker.log.info(f"Worker {worker.pid} ready as {role}")
@@ -0,0 +1,202 @@
+import html
+import re
+from html.parser import HTMLParser
+from typing import Dict, List
+
+# Confluence storage 格式中代码宏的内容放在 CDATA 里，HTML 解析器会丢掉，先转成普通文本
+_CDATA = re.compile(r"<!\[CDATA\[(.*?)\]\]>", re.S)
+
+_HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+_SKIP = {"script", "style", "ac:parameter", "head", "title"}
+_CODE = {"pre", "ac:plain-text-body"}
+_BLOCKS = {
+    "p", "div", "br", "hr", "ul", "ol", "li", "dl", "dt", "dd", "blockquote", "section",
+    "table", "tr", "thead", "tbody", "ac:structured-macro", "ac:rich-text-body", "ac:layout-section",
+    "ac:layout-cell", "ac:task", "body"
+}
+
+ENGINES = ("auto", "lxml", "html.parser", "bs4")
+
+class _TextBuilder:
+    """Turn a stream of start/end/data events into text with structural markers.
+
+    Headings become '#'-prefixed lines, code blocks are fenced with ```, table rows are
+    written as '| cell | cell |' and list items as '- item'. Other text is collapsed into
+    one line per block element. The start/end/data/close interface is the one lxml's
+    parser targets use, so the same builder serves both engines.
+    """
+
+    def __init__(self):
+        self.lines: List[str] = []
+        self._inline: List[str] = []
+        self._skip = None
+        self._skip_depth = 0
+        self._code: List[str] = None
+        self._code_depth = 0
+        self._heading = 0
+        self._row: List[str] = None
+        self._cell: List[str] = None
+        self._cell_depth = 0  # 单元格里嵌套的表格并入外层单元格
+        self._list_item = False
+
+    def start(self, tag: str, attrib: Dict):
+        if self._skip is not None:
+            if tag == self._skip:
+                self._skip_depth += 1
+            return
+        if tag in _SKIP:
+            self._skip, self._skip_depth = tag, 1
+        elif tag in _CODE:
+            if self._code_depth == 0:
+                self._flush()
+                self._code = []
+            self._code_depth += 1
+        elif self._code is not None:
+            return
+        elif tag in _HEADINGS:
+            self._flush()
+            self._heading = _HEADINGS[tag]
+        elif tag in ("td", "th"):
+            if self._cell is None:
+                self._cell = []
+            else:
+                self._cell.append(" ")
+            self._cell_depth += 1
+        elif self._cell is not None:
+            if tag in _BLOCKS:
+                self._cell.append(" ")
+        elif tag == "tr":
+            self._flush()
+            self._row = []
+        elif tag == "li":
+            self._flush()
+            self._list_item = True
+        elif tag in _BLOCKS:
+            self._flush()
+
+    def end(self, tag: str):
+        if self._skip is not None:
+            if tag == self._skip:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self._skip = None
+            return
+        if tag in _CODE and self._code_depth:
+            self._code_depth -= 1
+            if self._code_depth == 0:
+                code = "".join(self._code).strip("\n")
+                if code.strip():
+                    self.lines.append(f"```\n{code}\n```")
+                self._code = None
+        elif self._code is not None:
+            return
+        elif tag in _HEADINGS:
+            self._flush()
+            self._heading = 0
+        elif tag in ("td", "th") and self._cell is not None:
+            self._cell_depth -= 1
+            if self._cell_depth == 0:
+                if self._row is not None:
+                    self._row.append(" ".join("".join(self._cell).split()))
+                self._cell = None
+        elif self._cell is not None:
+            return
+        elif tag == "tr" and self._row is not None:
+            if any(self._row):
+                self.lines.append("| " + " | ".join(self._row) + " |")
+            self._row = None
+        elif tag in _BLOCKS:
+            self._flush()
+
+    def data(self, text: str):
+        if self._skip is not None:
+            return
+        if self._code is not None:
+            self._code.append(text)
+        elif self._cell is not None:
+            self._cell.append(text)
+        else:
+            self._inline.append(text)
+
+    def close(self) -> str:
+        self._flush()
+        return "\n".join(self.lines)
+
+    def _flush(self):
+        text = " ".join("".join(self._inline).split())
+        self._inline = []
+        if not text:
+            return
+        if self._heading:
+            text = "#" * self._heading + " " + text
+        elif self._list_item:
+            text = "- " + text
+            self._list_item = False
+        self.lines.append(text)
+
+class _StdlibParser(HTMLParser):
+    """Feed html.parser events into a _TextBuilder (used when lxml is not installed)."""
+
+    def __init__(self, builder: _TextBuilder):
+        super().__init__(convert_charrefs=True)
+        self.builder = builder
+
+    def handle_starttag(self, tag, attrs):
+        self.builder.start(tag, dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.builder.start(tag, dict(attrs))
+        self.builder.end(tag)
+
+    def handle_endtag(self, tag):
+        self.builder.end(tag)
+
+    def handle_data(self, data):
+        self.builder.data(data)
+
+def _has_lxml() -> bool:
+    try:
+        import lxml.etree  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def extract_text(html_content: str, engine: str = "auto") -> str:
+    """Extract text from Confluence HTML, keeping headings, code blocks and tables as markers.
+
+    engine is 'lxml' (libxml2 tokenizer), 'html.parser' (stdlib tokenizer), 'auto' (lxml
+    when installed) or 'bs4' (the original BeautifulSoup extraction, without markers).
+    Module-level so it can run in a process pool.
+    """
+    if engine == "auto":
+        engine = "lxml" if _has_lxml() else "html.parser"
+    if engine == "bs4":
+        return extract_text_bs4(html_content)
+
+    html_content = _CDATA.sub(lambda match: html.escape(match.group(1), quote=False), html_content)
+    builder = _TextBuilder()
+    if engine == "lxml":
+        from lxml import etree
+        parser = etree.HTMLParser(target=builder)
+        parser.feed(html_content)
+        return parser.close()
+    if engine == "html.parser":
+        parser = _StdlibParser(builder)
+        parser.feed(html_content)
+        parser.close()
+        return builder.close()
+    raise ValueError(f"Unknown HTML extraction engine '{engine}'")
+
+def extract_text_bs4(html_content: str) -> str:
+    """Original BeautifulSoup-based extraction, kept for comparison and as a fallback."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+    # Get text and clean up whitespace
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks if chunk)
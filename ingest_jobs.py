@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from telemetry import new_trace_id
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+class IngestJob:
+    """State and progress of one background ingestion run."""
+
+    def __init__(self, page_id: str, incremental: bool, shard: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.page_id = page_id
+        self.incremental = incremental
+        self.shard = shard
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.pipeline = None
+        self.cancel_requested = False
+
+    def attach(self, pipeline):
+        """Called by OpsAgent.initialize once the pipeline for this job exists."""
+        self.pipeline = pipeline
+        if self.cancel_requested:
+            pipeline.cancel()
+
+    def cancel(self):
+        self.cancel_requested = True
+        if self.pipeline:
+            self.pipeline.cancel()
+
+    def to_dict(self) -> Dict:
+        stats = dict(self.pipeline.stats) if self.pipeline else {}
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+
+        throughput = {"pages_per_second": 0.0, "chunks_per_second": 0.0}
+        eta = None
+        if stats and elapsed > 0:
+            throughput["pages_per_second"] = round(stats["pages_written"] / elapsed, 2)
+            throughput["chunks_per_second"] = round(stats["chunks_embedded"] / elapsed, 1)
+            remaining = stats["pages_total"] - stats["pages_skipped"] - stats["pages_written"] - stats["pages_failed"] - stats["pages_empty"]
+            if self.status == "running" and stats["pages_written"]:
+                eta = round(max(remaining, 0) / (stats["pages_written"] / elapsed), 1)
+
+        return {
+            "job_id": self.job_id,
+            "page_id": self.page_id,
+            "shard": self.shard,
+            "incremental": self.incremental,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(elapsed, 1),
+            "progress": stats,
+            "throughput": throughput,
+            "eta_seconds": eta
+        }
+
+class IngestJobManager:
+    """Run ingestion jobs one at a time on a background thread.
+
+    Submitting a root page that already has a queued or running job returns that job
+    instead of starting another, and jobs never run concurrently against the collection.
+    """
+
+    def __init__(self, agent, max_finished_jobs: int = 100):
+        self.agent = agent
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-job")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, page_id: str, incremental: bool = True, shard: str = None) -> IngestJob:
+        with self._lock:
+            for job in self._jobs.values():
+                if job.page_id == page_id and job.status in ACTIVE_STATUSES:
+                    logger.info(f"Ingestion of {page_id} already {job.status} as job {job.job_id}")
+                    return job
+            job = IngestJob(page_id, incremental, shard)
+            self._jobs[job.job_id] = job
+            self._trim()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        job = self.get(job_id)
+        if job and job.status in ACTIVE_STATUSES:
+            job.cancel()
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = time.time()
+        return job
+
+    def _run(self, job: IngestJob):
+        if job.cancel_requested:
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        new_trace_id(job.job_id)  # 该任务的日志都带上 job ID
+        try:
+            self.agent.initialize(job.page_id, incremental=job.incremental, on_pipeline=job.attach, shard=job.shard)
+            job.status = "cancelled" if job.cancel_requested else "succeeded"
+        except Exception as e:
+            logger.error(f"Ingestion job {job.job_id} failed: {str(e)}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status not in ACTIVE_STATUSES]
+        for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job_id]
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_job_manager() -> IngestJobManager:
+    """Return the process-wide job manager, building it (and the agent) on first use."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                from ops_agent import get_agent
+                _manager = IngestJobManager(get_agent())
+    return _manager
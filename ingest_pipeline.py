@@ -0,0 +1,339 @@
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from html_extract import extract_text
+from telemetry import span
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()  # 队列结束标记
+
+class IngestPipeline:
+    """Staged ingestion: fetch -> clean -> chunk -> embed -> upsert, connected by bounded queues.
+
+    Each stage runs in its own worker threads, so only about `queue_size` pages per stage
+    are held in memory at once. Pages are written in batched upserts by a single writer.
+    Every `save_seconds` and at the end of the run the writer saves the index, then records
+    the saved pages in a checkpoint file so an interrupted run can resume without redoing
+    them. Saving rewrites the whole lexical index (and numpy snapshot), so it is not done
+    per batch. The checkpoint is removed once a run completes; with resume=False (a full
+    sync) an existing checkpoint is discarded first.
+    A failure in the embed or write stage stops the run and run() raises it.
+    With clean_processes > 0, HTML cleaning runs in a process pool so it uses more than
+    one core; the clean stage threads then only hand pages to the pool.
+    """
+
+    def __init__(self, wiki_fetcher, vector_db, root_id: str, checkpoint_dir: str,
+                 queue_size: int = 64, fetch_workers: int = 8, clean_workers: int = 2,
+                 embed_workers: int = 2, upsert_batch_size: int = 256, clean_processes: int = 0, resume: bool = True,
+                 save_seconds: float = 60):
+        self.wiki_fetcher = wiki_fetcher
+        self.vector_db = vector_db
+        self.root_id = root_id
+        self.queue_size = queue_size
+        self.fetch_workers = fetch_workers
+        self.clean_workers = clean_workers
+        self.clean_processes = clean_processes
+        self.embed_workers = embed_workers
+        self.upsert_batch_size = upsert_batch_size
+        self.save_seconds = save_seconds
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.checkpoint_path = os.path.join(checkpoint_dir, f"{root_id}.json")
+        self.resume = resume
+        self.stop_event = threading.Event()
+        self.stats = {
+            "pages_total": 0,
+            "pages_skipped": 0,
+            "pages_fetched": 0,
+            "pages_failed": 0,
+            "pages_empty": 0,
+            "chunks_embedded": 0,
+            "pages_written": 0,
+            "records_written": 0
+        }
+        self.written_ids = set()
+        self.empty_ids = set()  # 成功获取但没有内容的页面，调用方可以删除它们的旧记录
+        self.failed_ids = set()  # 获取、清洗或向量化失败的页面，旧记录应保留
+        self._stats_lock = threading.Lock()
+        self._error = None
+        self._clean_pool = None
+        self._unsaved = []  # 已 upsert 但还没保存到磁盘的 (page_id, version)
+        self._last_save = time.monotonic()
+
+    def run(self, pages: List[Dict]) -> Dict:
+        """Ingest the given pages (as returned by list_pages) and return the run statistics."""
+        if not self.resume:
+            self._remove_checkpoint()  # 全量同步：上次中断留下的 checkpoint 不再有效
+        checkpoint = self._load_checkpoint()
+        todo = [page for page in pages if checkpoint.get(page['id']) != page['version']]
+        self.written_ids.update(page['id'] for page in pages if checkpoint.get(page['id']) == page['version'])
+        self._count("pages_total", len(pages))
+        self._count("pages_skipped", len(pages) - len(todo))
+        if len(todo) < len(pages):
+            logger.info(f"Resuming from checkpoint: {len(pages) - len(todo)} pages already written")
+
+        ids = queue.Queue()
+        for page in todo:
+            ids.put(page['id'])
+        ids.put(_DONE)
+
+        fetched = queue.Queue(maxsize=self.queue_size)
+        cleaned = queue.Queue(maxsize=self.queue_size)
+        chunked = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+
+        clean_workers = self.clean_workers
+        if self.clean_processes > 0:
+            # spawn 而不是 fork：当前进程里已经有很多线程
+            self._clean_pool = ProcessPoolExecutor(
+                max_workers=self.clean_processes, mp_context=multiprocessing.get_context("spawn")
+            )
+            clean_workers = max(clean_workers, self.clean_processes)  # 每个线程同时只提交一个页面
+        try:
+            threads = [
+                *self._stage("fetch", self.fetch_workers, self._fetch, ids, fetched),
+                *self._stage("clean", clean_workers, self._clean, fetched, cleaned),
+                *self._stage("chunk", 1, self._chunk, cleaned, chunked),
+                *self._stage("embed", self.embed_workers, None, chunked, embedded, worker=self._embed_worker),
+                threading.Thread(target=contextvars.copy_context().run, args=(self._write_worker, embedded, checkpoint),
+                             name="ingest-write", daemon=True)
+            ]
+            threads[-1].start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if self._clean_pool is not None:
+                self._clean_pool.shutdown()
+                self._clean_pool = None
+
+        if self._error:
+            raise self._error
+        if not self.stop_event.is_set():
+            self._remove_checkpoint()
+        logger.info(f"Ingestion of {self.root_id} finished: {self.stats}")
+        return dict(self.stats)
+
+    def cancel(self):
+        """Stop processing; pages already written stay in the checkpoint."""
+        self.stop_event.set()
+
+    def _stage(self, name: str, workers: int, fn: Optional[Callable], inbox: queue.Queue, outbox: queue.Queue,
+               worker: Callable = None) -> List[threading.Thread]:
+        """Start `workers` threads for a stage and a closer that ends the outbox when they finish."""
+        worker = worker or self._map_worker
+        # 复制 contextvars，让各阶段线程的日志沿用任务的 trace ID
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(worker, fn, inbox, outbox),
+                             name=f"ingest-{name}-{idx}", daemon=True)
+            for idx in range(max(workers, 1))
+        ]
+        for thread in threads:
+            thread.start()
+
+        def close():
+            for thread in threads:
+                thread.join()
+            outbox.put(_DONE)
+
+        closer = threading.Thread(target=close, name=f"ingest-{name}-close", daemon=True)
+        closer.start()
+        return threads + [closer]
+
+    def _map_worker(self, fn: Callable, inbox: queue.Queue, outbox: queue.Queue):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put(_DONE)  # 让同一阶段的其它 worker 也能退出
+                return
+            if self.stop_event.is_set():
+                continue  # 取消后只排空队列，不再处理
+            try:
+                result = fn(item)
+            except Exception as e:
+                logger.error(f"Ingestion step failed for {self._describe(item)}: {str(e)}")
+                self._failed(self._describe(item))
+                continue
+            if result is not None:
+                outbox.put(result)
+
+    def _fetch(self, page_id: str) -> Optional[Dict]:
+        with span("wiki_fetch"):
+            # 请求失败时抛出异常，由 _map_worker 记为失败；返回 None 表示页面确实没有内容
+            page = self.wiki_fetcher._fetch_raw_page(page_id, raise_errors=True)
+        if page is None:
+            self._empty(page_id)
+            return None
+        self._count("pages_fetched")
+        return page
+
+    def _clean(self, page: Dict) -> Dict:
+        with span("html_clean"):
+            if self._clean_pool is not None:
+                page["content"] = self._clean_pool.submit(extract_text, page.pop("html"), self.wiki_fetcher.html_engine).result()
+            else:
+                page["content"] = self.wiki_fetcher._clean_content(page.pop("html"))
+        return page
+
+    def _chunk(self, page: Dict) -> Optional[Dict]:
+        if not page["content"].strip():
+            self._empty(page['id'])  # 正文清洗后为空
+            return None
+        with span("chunk"):
+            page["chunks"] = self.vector_db._chunk_spans(page["content"])
+        return page
+
+    def _embed_worker(self, fn, inbox: queue.Queue, outbox: queue.Queue):
+        """Embed chunks of several pages at once so requests stay full across small pages."""
+        target = self.vector_db.embedding_batch_size * self.vector_db.embedding_concurrency
+        finished = False
+        while not finished:
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put(_DONE)
+                return
+            pages = [item]
+            while sum(len(page["chunks"]) for page in pages) < target:
+                try:
+                    item = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    inbox.put(_DONE)
+                    finished = True
+                    break
+                pages.append(item)
+            if self.stop_event.is_set():
+                continue
+
+            try:
+                self._embed_pages(pages, outbox)
+            except Exception as e:
+                # 丢掉这些页面后继续会让 initialize 删除它们的旧记录，所以停止整个流水线
+                self._fail(f"Embedding {len(pages)} pages failed", e)
+
+    def _embed_pages(self, pages: List[Dict], outbox: queue.Queue):
+        texts = [chunk["text"] for page in pages for chunk in page["chunks"]]
+        vectors = iter(self.vector_db._get_embeddings(texts, skip_errors=True))
+        for page in pages:
+            page["vectors"] = [next(vectors) for _ in page["chunks"]]
+            if any(vector is None for vector in page["vectors"]):
+                logger.error(f"Skipping document {page['id']}: failed to embed all chunks")
+                self._failed(page['id'])
+                continue
+            self._count("chunks_embedded", len(page["chunks"]))
+            outbox.put(page)
+
+    def _write_worker(self, inbox: queue.Queue, checkpoint: Dict):
+        """Single writer: batch whole pages into upserts, saving and checkpointing periodically."""
+        pending = []
+        while True:
+            page = inbox.get()
+            if page is _DONE:
+                break
+            if self.stop_event.is_set():
+                continue
+            pending.append(page)
+            if sum(len(page["chunks"]) for page in pending) >= self.upsert_batch_size:
+                self._safe_flush(pending, checkpoint)
+                pending = []
+        if pending and not self.stop_event.is_set():
+            self._safe_flush(pending, checkpoint)
+        if self._error is None:
+            self._save(checkpoint)  # 取消时已写入的页面也保存并记入 checkpoint
+
+    def _safe_flush(self, pages: List[Dict], checkpoint: Dict):
+        # writer 异常退出会让上游阻塞在已满的队列上，run() 永远等不到结束
+        try:
+            self._flush(pages, checkpoint)
+        except Exception as e:
+            self._fail(f"Writing {len(pages)} pages failed", e)
+
+    def _flush(self, pages: List[Dict], checkpoint: Dict):
+        records = []
+        for page in pages:
+            metadata = {
+                "title": page['title'],
+                "page_id": page['id'],
+                "root_id": self.root_id,
+                "version": page['version'],
+                "last_modified": page['last_modified']
+            }
+            records.extend(self.vector_db.build_records(page['id'], page['content'], metadata, page['chunks'], page['vectors']))
+        try:
+            self.vector_db.upsert_records([page['id'] for page in pages], records)
+        except Exception as e:
+            # 写入失败时停止整个流水线，已保存的页面保留在 checkpoint 中
+            self._fail(f"Writing {len(records)} records failed", e)
+            return
+
+        for page in pages:
+            self._unsaved.append((page['id'], page['version']))
+            self.written_ids.add(page['id'])
+        self._count("pages_written", len(pages))
+        self._count("records_written", len(records))
+        logger.info(f"Upserted {len(records)} records for {len(pages)} pages")
+        if time.monotonic() - self._last_save >= self.save_seconds:
+            self._save(checkpoint)
+
+    def _save(self, checkpoint: Dict):
+        """Save the index, then checkpoint the pages written since the last save."""
+        if not self._unsaved:
+            return
+        try:
+            # numpy 后端和 BM25 索引在 save() 之前只在内存中，先落盘再记 checkpoint
+            self.vector_db.save()
+        except Exception as e:
+            self._fail("Saving the index failed", e)
+            return
+        for page_id, version in self._unsaved:
+            checkpoint[page_id] = version
+        self._unsaved = []
+        self._save_checkpoint(checkpoint)
+        self._last_save = time.monotonic()
+
+    def _empty(self, page_id: str):
+        with self._stats_lock:
+            self.empty_ids.add(page_id)
+            self.stats["pages_empty"] += 1
+
+    def _failed(self, page_id: str):
+        with self._stats_lock:
+            self.failed_ids.add(page_id)
+            self.stats["pages_failed"] += 1
+
+    def _fail(self, message: str, error: Exception):
+        """Stop the pipeline; run() raises the error once every stage has drained its queue."""
+        logger.error(f"{message}: {str(error)}")
+        self._error = error
+        self.stop_event.set()
+
+    def _load_checkpoint(self) -> Dict:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, "r") as f:
+            return json.load(f).get("done", {})
+
+    def _save_checkpoint(self, checkpoint: Dict):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"root_id": self.root_id, "updated": time.time(), "done": checkpoint}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    @staticmethod
+    def _describe(item) -> str:
+        return item.get('id', '?') if isinstance(item, dict) else str(item)
@@ -0,0 +1,165 @@
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 标识符：错误码、主机名、k8s 资源名等，允许中间出现 . _ - : /
+_IDENTIFIER = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.\-:/]*[A-Za-z0-9]|[A-Za-z0-9]")
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_SEPARATORS = re.compile(r"[_.\-:/]+")
+
+def tokenize(text: str) -> List[str]:
+    """Tokenize mixed Chinese and technical text.
+
+    Identifiers are kept whole (lowercased) and also split on separators, so both
+    'nginx-ingress-7d9f' and 'nginx' match. Chinese runs become character bigrams.
+    """
+    tokens = []
+    for match in _IDENTIFIER.finditer(text):
+        token = match.group().lower()
+        tokens.append(token)
+        parts = [part for part in _SEPARATORS.split(token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    for match in _CJK_RUN.finditer(text):
+        run = match.group()
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def looks_like_identifier(query: str) -> bool:
+    """Whether a query is a short identifier lookup (error code, hostname, resource name)."""
+    words = query.split()
+    if not words or len(words) > 4 or _CJK_RUN.search(query):
+        return False
+    return any(
+        len(word) >= 3 and _IDENTIFIER.fullmatch(word) and (re.search(r"\d", word) or _SEPARATORS.search(word))
+        for word in words
+    )
+
+class BM25Index:
+    """In-memory BM25 inverted index over record texts, persisted as gzipped JSON."""
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Tuple[str, int, Dict[str, int]]] = {}  # id -> (page_id, 长度, 词频)
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._pages: Dict[str, set] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, record_id: str, text: str, page_id: str = None):
+        """Index a record, replacing any previous version of it."""
+        counts = Counter(tokenize(text))
+        with self._lock:
+            self._remove(record_id)
+            self._docs[record_id] = (page_id, sum(counts.values()), dict(counts))
+            self._total_length += sum(counts.values())
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[record_id] = tf
+            if page_id is not None:
+                self._pages.setdefault(page_id, set()).add(record_id)
+            self.dirty = True
+
+    def remove(self, record_ids: Iterable[str]):
+        with self._lock:
+            for record_id in record_ids:
+                self._remove(record_id)
+
+    def remove_pages(self, page_ids: Iterable[str]):
+        with self._lock:
+            for page_id in page_ids:
+                for record_id in list(self._pages.get(page_id, ())):
+                    self._remove(record_id)
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Return (record_id, score) pairs for the best-matching records."""
+        terms = set(tokenize(query))
+        with self._lock:
+            total = len(self._docs)
+            if not total or not terms:
+                return []
+            avg_length = self._total_length / total
+            scores = Counter()
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for record_id, tf in postings.items():
+                    length = self._docs[record_id][1]
+                    scores[record_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+        return scores.most_common(limit)
+
+    def save(self):
+        """Write the index to disk if it changed since the last save."""
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, "docs": self._docs}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        logger.info(f"Saved lexical index with {len(self._docs)} records to {self.path}")
+
+    def load(self) -> bool:
+        """Load the index from disk; returns False if there is no saved index."""
+        if not os.path.exists(self.path):
+            return False
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self._docs, self._postings, self._pages, self._total_length = {}, {}, {}, 0
+            for record_id, (page_id, length, counts) in data["docs"].items():
+                self._docs[record_id] = (page_id, length, counts)
+                self._total_length += length
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[record_id] = tf
+                if page_id is not None:
+                    self._pages.setdefault(page_id, set()).add(record_id)
+            self.dirty = False
+        logger.info(f"Loaded lexical index with {len(self._docs)} records from {self.path}")
+        return True
+
+    def _remove(self, record_id: str):
+        doc = self._docs.pop(record_id, None)
+        if doc is None:
+            return
+        page_id, length, counts = doc
+        self._total_length -= length
+        for term in counts:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(record_id, None)
+                if not postings:
+                    del self._postings[term]
+        if page_id is not None and page_id in self._pages:
+            self._pages[page_id].discard(record_id)
+            if not self._pages[page_id]:
+                del self._pages[page_id]
+        self.dirty = True
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> Dict[str, float]:
+    """Fuse several ranked ID lists into one score per ID."""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, record_id in enumerate(ranking):
+            scores[record_id] += 1.0 / (k + rank + 1)
+    return dict(scores)
@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class NumpyCollection:
+    """In-process vector collection backed by a contiguous NumPy matrix.
+
+    Implements the subset of the Chroma collection API that VectorDB uses (count, get,
+    upsert, delete, query), so it can stand in for a Chroma collection. Vectors are
+    L2-normalised and stored as float32 or per-row scaled int8; search is brute force
+    over the matrix with argpartition top-k, and distances are cosine distances.
+
+    Changes are kept in memory until save(), which writes a new snapshot generation and
+    atomically switches the CURRENT pointer. Snapshots are memory-mapped, so every
+    process opening the same directory shares one copy through the page cache, and
+    read-only instances pick up a new generation on their next call, unless they were
+    opened pinned to a given snapshot generation.
+    """
+
+    BLOCK_ROWS = 8192  # int8 矩阵分块反量化，避免一次性生成整块 float32 副本
+
+    def __init__(self, path: str, name: str, quantization: str = "int8", read_only: bool = False, generation: str = None):
+        if quantization not in ("int8", "float32"):
+            raise ValueError(f"Unsupported quantization '{quantization}'")
+        self.path = path
+        self.name = name
+        self.quantization = quantization
+        self.read_only = read_only
+        self.pinned = generation is not None  # 固定在指定快照，不自动切换
+        self.retained = None  # 清理旧快照时保留的世代（读进程正在使用的已发布快照）
+        self._lock = threading.RLock()
+        self._generation = None
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._documents: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._vectors = None  # 快照中的矩阵：float32 单位向量，或 int8
+        self._scales = None  # int8 快照中每行的缩放系数，float32 快照为 None
+        self._pending = None  # 写入后尚未保存的 float32 矩阵，save() 时再量化
+        self._dirty = False
+        os.makedirs(os.path.join(path, "snapshots"), exist_ok=True)
+        self._load(generation)
+
+    # ---- Chroma 兼容接口 ----
+
+    def count(self) -> int:
+        self.refresh()
+        return len(self._ids)
+
+    def get(self, ids: List[str] = None, where: Dict = None, include: List[str] = None,
+            limit: int = None, offset: int = None) -> Dict:
+        self.refresh()
+        include = ["documents", "metadatas"] if include is None else include
+        with self._lock:
+            if ids is not None:
+                rows = [self._index[record_id] for record_id in ids if record_id in self._index]
+            else:
+                rows = range(len(self._ids))
+            rows = [row for row in rows if where is None or self._match(self._metadatas[row], where)]
+            rows = rows[offset or 0:(offset or 0) + limit if limit else None]
+            return self._result(rows, include)
+
+    def upsert(self, ids: List[str], embeddings: List, metadatas: List[Dict] = None, documents: List[str] = None):
+        self._check_writable()
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            dense = self._dense()
+            new_rows = []
+            for pos, record_id in enumerate(ids):
+                row = self._index.get(record_id)
+                if row is None:
+                    row = len(self._ids)
+                    self._index[record_id] = row
+                    self._ids.append(record_id)
+                    self._documents.append(None)
+                    self._metadatas.append(None)
+                    new_rows.append(vectors[pos])
+                elif row >= len(dense):
+                    new_rows[row - len(dense)] = vectors[pos]  # 同一批次中重复的 ID
+                else:
+                    dense[row] = vectors[pos]
+                self._documents[row] = documents[pos] if documents else ""
+                self._metadatas[row] = metadatas[pos] if metadatas else {}
+            if new_rows:
+                dense = np.vstack([dense, np.stack(new_rows)]) if len(dense) else np.stack(new_rows)
+            self._pending = dense
+            self._dirty = True
+
+    def delete(self, ids: List[str] = None, where: Dict = None):
+        self._check_writable()
+        with self._lock:
+            doomed = set(self._index[record_id] for record_id in (ids or []) if record_id in self._index)
+            if where is not None:
+                doomed.update(row for row, metadata in enumerate(self._metadatas) if self._match(metadata, where))
+            if not doomed:
+                return
+            keep = np.array([row not in doomed for row in range(len(self._ids))], dtype=bool)
+            dense = self._dense()[keep]
+            self._ids = [record_id for row, record_id in enumerate(self._ids) if keep[row]]
+            self._documents = [doc for row, doc in enumerate(self._documents) if keep[row]]
+            self._metadatas = [metadata for row, metadata in enumerate(self._metadatas) if keep[row]]
+            self._index = {record_id: row for row, record_id in enumerate(self._ids)}
+            self._pending = dense
+            self._dirty = True
+
+    def query(self, query_embeddings: List, n_results: int = 10, include: List[str] = None, where: Dict = None) -> Dict:
+        self.refresh()
+        include = ["documents", "metadatas", "distances"] if include is None else include
+        queries = self._normalize(np.asarray(query_embeddings, dtype=np.float32))
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        with self._lock:
+            if not self._ids:
+                for key in results:
+                    results[key] = [[] for _ in queries]
+                return results
+
+            scores = self._scores(queries)
+            if where is not None:
+                mask = np.array([self._match(metadata, where) for metadata in self._metadatas], dtype=bool)
+                scores[:, ~mask] = -np.inf
+            k = min(n_results, len(self._ids))
+            for row_scores in scores:
+                top = np.argpartition(-row_scores, k - 1)[:k]
+                top = top[np.argsort(-row_scores[top])]
+                top = [row for row in top if np.isfinite(row_scores[row])]
+                result = self._result(top, include)
+                for key in ("ids", "documents", "metadatas", "embeddings"):
+                    results[key].append(result.get(key))
+                results["distances"].append([float(1.0 - row_scores[row]) for row in top])
+        return results
+
+    # ---- 快照 ----
+
+    def save(self):
+        """Write a new snapshot generation and switch readers to it."""
+        self._check_writable()
+        with self._lock:
+            if not self._dirty:
+                return
+            generation = f"{time.time_ns()}"
+            directory = os.path.join(self.path, "snapshots", generation)
+            os.makedirs(directory)
+            vectors, scales = self._quantize(self._dense())
+            np.save(os.path.join(directory, "vectors.npy"), vectors)
+            if scales is not None:
+                np.save(os.path.join(directory, "scales.npy"), scales)
+            with open(os.path.join(directory, "records.json"), "w") as f:
+                json.dump({"ids": self._ids, "documents": self._documents, "metadatas": self._metadatas}, f, ensure_ascii=False)
+
+            tmp_path = os.path.join(self.path, "CURRENT.tmp")
+            with open(tmp_path, "w") as f:
+                f.write(generation)
+            os.replace(tmp_path, os.path.join(self.path, "CURRENT"))
+            self._generation = generation
+            self._vectors, self._scales, self._pending = vectors, scales, None
+            self._dirty = False
+            self._prune_snapshots(keep=2)
+        logger.info(f"Saved snapshot {generation} of '{self.name}' with {len(self._ids)} records")
+
+    @property
+    def generation(self) -> Optional[str]:
+        """The snapshot generation currently loaded (None before the first save)."""
+        return self._generation
+
+    def refresh(self):
+        """Reload if another process published a newer snapshot (unpinned read-only instances only)."""
+        if self.read_only and not self.pinned and self._current_generation() != self._generation:
+            self._load()
+
+    def _load(self, generation: str = None):
+        generation = generation or self._current_generation()
+        with self._lock:
+            self._generation = generation
+            if generation is None:
+                self._ids, self._index, self._documents, self._metadatas = [], {}, [], []
+                self._vectors, self._scales, self._pending = None, None, None
+                return
+            directory = os.path.join(self.path, "snapshots", generation)
+            with open(os.path.join(directory, "records.json"), "r") as f:
+                records = json.load(f)
+            self._ids = records["ids"]
+            self._documents = records["documents"]
+            self._metadatas = records["metadatas"]
+            self._index = {record_id: row for row, record_id in enumerate(self._ids)}
+            # 只读实例直接 mmap，多个进程共享同一份物理内存
+            self._vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+            scales_path = os.path.join(directory, "scales.npy")
+            self._scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+            self._pending = None
+        logger.info(f"Loaded snapshot {generation} of '{self.name}' with {len(self._ids)} records")
+
+    def _current_generation(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, "CURRENT"), "r") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _prune_snapshots(self, keep: int):
+        snapshots = sorted(os.listdir(os.path.join(self.path, "snapshots")))
+        for generation in snapshots[:-keep]:
+            if generation == self.retained:
+                continue
+            directory = os.path.join(self.path, "snapshots", generation)
+            for filename in os.listdir(directory):
+                os.remove(os.path.join(directory, filename))
+            os.rmdir(directory)
+
+    # ---- 向量运算 ----
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each query against every stored vector."""
+        if self._pending is not None:
+            return queries @ self._pending.T
+        if self._scales is None:
+            return queries @ np.asarray(self._vectors).T
+        scores = np.empty((len(queries), len(self._ids)), dtype=np.float32)
+        for start in range(0, len(self._ids), self.BLOCK_ROWS):
+            block = np.asarray(self._vectors[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = (queries @ block.T) * self._scales[start:start + len(block)]
+        return scores
+
+    def _dense(self) -> np.ndarray:
+        """Float32 matrix of the stored vectors, dequantized on first write after a load."""
+        if self._pending is not None:
+            return self._pending
+        if self._vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._scales is not None:
+            return np.asarray(self._vectors, dtype=np.float32) * np.asarray(self._scales)[:, None]
+        return np.array(self._vectors, dtype=np.float32)
+
+    def _quantize(self, dense: np.ndarray):
+        """Return the matrix in the configured storage format, plus per-row scales for int8."""
+        if self.quantization == "float32":
+            return dense.astype(np.float32), None
+        scales = np.abs(dense).max(axis=1) / 127.0 if len(dense) else np.zeros(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        return np.round(dense / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _result(self, rows: List[int], include: List[str]) -> Dict:
+        result = {"ids": [self._ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self._documents[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self._metadatas[row] for row in rows]
+        if "embeddings" in include:
+            matrix = self._pending if self._pending is not None else self._vectors
+            dense = [np.asarray(matrix[row], dtype=np.float32) for row in rows]
+            if self._pending is None and self._scales is not None:
+                dense = [vector * self._scales[row] for vector, row in zip(dense, rows)]
+            result["embeddings"] = [vector.tolist() for vector in dense]
+        return result
+
+    @classmethod
+    def _match(cls, metadata: Optional[Dict], where: Dict) -> bool:
+        """Evaluate the subset of Chroma's where filter used here: equality, $in, $and."""
+        metadata = metadata or {}
+        for key, condition in where.items():
+            if key == "$and":
+                if not all(cls._match(metadata, clause) for clause in condition):
+                    return False
+            elif isinstance(condition, dict):
+                if "$in" in condition and metadata.get(key) not in condition["$in"]:
+                    return False
+                if "$eq" in condition and metadata.get(key) != condition["$eq"]:
+                    return False
+            elif metadata.get(key) != condition:
+                return False
+        return True
+
+    def _check_writable(self):
+        if self.read_only:
+            raise Exception(f"Collection '{self.name}' is opened read-only")
+
+def export_chroma_collection(chroma_collection, target: NumpyCollection, batch_size: int = 1000) -> int:
+    """Copy every record of a Chroma collection into a NumpyCollection snapshot."""
+    total = chroma_collection.count()
+    for offset in range(0, total, batch_size):
+        batch = chroma_collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
+        )
+        target.upsert(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            metadatas=batch["metadatas"],
+            documents=batch["documents"]
+        )
+    target.save()
+    logger.info(f"Exported {total} records from Chroma collection '{chroma_collection.name}'")
+    return total
@@ -1,36 +1,89 @@
 from wiki_fetcher import WikiDataFetcher
 from vector_db import VectorDB
-import requests
+from context_builder import ContextBuilder
+from ingest_pipeline import IngestPipeline
+from lexical_index import looks_like_identifier
+from siliconflow_client import SiliconFlowClient
+from sse import SSEParser, parse_delta, token_event
+from answer_cache import AnswerCache, RequestCoalescer, AsyncRequestCoalescer, normalize_question
+from shards import DEFAULT_SHARD, ShardBusyError, validate_shard_name
+import asyncio
+import contextvars
 import logging
 import os
+import re
+import shutil
+import time
 import json
-import yaml
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Optional
 from dotenv import load_dotenv
+from settings import get_config, get_role
+from telemetry import LLM_TOKENS, PROMPT_TOKENS, observe, span
 
-# 加载配置文件
-with open("config/config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+READ_ONLY_MESSAGE = "This is a read-only query worker; send ingestion requests to the writer process"
+
 class OpsAgent:
-    def __init__(self, wiki_domain: str, wiki_username: str, wiki_password: str, persist_directory: str = "chroma_db"):
-        """Initialize the agent with a local Chroma database."""
-        self.wiki_fetcher = WikiDataFetcher(wiki_domain, wiki_username, wiki_password)
-        self.vector_db = VectorDB(persist_directory=persist_directory)  # Load local Chroma database
+    def __init__(self, wiki_domain: str, wiki_username: str, wiki_password: str, persist_directory: str = "chroma_db",
+                 read_only: bool = False):
+        """Initialize the agent with a local Chroma database.
+        
+        A read_only agent (a query worker) cannot ingest or drop shards; a background
+        thread switches it to new index generations as the writer publishes them.
+        """
+        config = get_config()
+        self.read_only = read_only
+        self.wiki_fetcher = WikiDataFetcher(
+            wiki_domain, wiki_username, wiki_password,
+            max_workers=config["wiki"].get("max_workers", 8),
+            requests_per_second=config["wiki"].get("requests_per_second"),
+            page_size=config["wiki"].get("page_size", 100),
+            html_engine=config["wiki"].get("html_engine", "auto")
+        )
+        self.persist_directory = persist_directory
+        self.client = SiliconFlowClient.from_config(config["siliconflow"])  # 嵌入和对话共用一个连接池
+        self.vector_db = VectorDB(persist_directory=persist_directory, client=self.client, read_only=read_only)  # Load local Chroma database
         self.initialized = self._check_database_initialized()  # Check if database is already initialized
-        self.api_key = config["siliconflow"]["api_key"]  # 从配置文件中读取 API 密钥
+        self.top_k = config["vector_db"].get("top_k", 3)  # 每个问题检索的文档（或 chunk）数量
+        
+        # 控制 prompt 大小：先多取候选，再去重、按 MMR 排序并装入 token 预算
+        context_config = config.get("context", {})
+        self.candidates = context_config.get("candidates", self.top_k * 3)
+        self.context_builder = ContextBuilder(
+            self.vector_db.encoder,
+            max_tokens=context_config.get("max_tokens", 3000),
+            mmr_lambda=context_config.get("mmr_lambda", 0.7),
+            dedup_threshold=context_config.get("dedup_threshold", 0.85)
+        )
+        
+        # 语义答案缓存，并发的相同问题只向上游发起一次生成
+        cache_config = config.get("answer_cache", {})
+        self.answer_cache = None
+        if cache_config.get("enabled", True):
+            self.answer_cache = AnswerCache(
+                similarity_threshold=cache_config.get("similarity_threshold", 0.95),
+                ttl_seconds=cache_config.get("ttl_seconds", 600),
+                max_items=cache_config.get("max_items", 256)
+            )
+        self.coalescer = RequestCoalescer()
+        self.async_coalescer = AsyncRequestCoalescer()
+        self._write_lock = threading.Lock()
+        
+        if read_only:
+            self.refresh_seconds = config.get("serving", {}).get("refresh_seconds", 5)
+            threading.Thread(target=self._refresh_loop, name="index-refresh", daemon=True).start()
         
     def _check_database_initialized(self):
-        """Check if the Chroma database is already initialized."""
+        """Check if any shard of the Chroma database has records."""
         try:
-            # Attempt to load the default collection
-            self.vector_db.create_collection("ops_docs")
-            collection_info = self.vector_db.collection.get()
-            if len(collection_info['ids']) > 0:
-                logger.info(f"Chroma database is already initialized with {len(collection_info['ids'])} documents.")
+            if not self.vector_db.shards.names() and not self.read_only:
+                self._register_legacy_collection()
+            count = self._count_records()
+            if count > 0:
+                logger.info(f"Chroma database is already initialized with {count} records in {len(self.vector_db.shards.names())} shards.")
                 return True
             else:
                 logger.warning("Chroma database exists but is empty.")
@@ -39,131 +92,543 @@ class OpsAgent:
             logger.error(f"Error checking database initialization: {str(e)}")
             return False
         
-    def initialize(self, page_id: str):
-        """Initialize the agent by fetching and storing wiki data"""
-        documents = self.wiki_fetcher.fetch_page_and_children(page_id)
-        if not documents:
-            logger.error("No documents fetched from the wiki.")
+    def _register_legacy_collection(self):
+        """Register the single 'ops_docs' collection of databases created before sharding as a shard.
+        
+        Records written before root pages were tracked have no root_id, so the shard is
+        registered whenever the collection has records, with whatever root pages it names.
+        """
+        legacy_numpy = os.path.isdir(os.path.join(self.persist_directory, "numpy", DEFAULT_SHARD))
+        if not legacy_numpy and DEFAULT_SHARD not in [collection.name for collection in self.vector_db.chroma.list_collections()]:
             return
+        db = self.vector_db.shard(DEFAULT_SHARD)
+        if db.collection.count() == 0:
+            return
+        root_ids = sorted({metadata['root_id'] for metadata in db.get_metadatas().values() if metadata and metadata.get('root_id')})
+        self.vector_db.shards.add(DEFAULT_SHARD)
+        for root_id in root_ids:
+            self.vector_db.shards.add_root(DEFAULT_SHARD, root_id)
+        self.vector_db.publish(DEFAULT_SHARD)
+        logger.info(f"Registered existing collection '{DEFAULT_SHARD}' as a shard with {len(root_ids)} root pages")
         
-        # 检查集合是否已存在
-        if not self.initialized:
-            self.vector_db.create_collection("ops_docs")
-            logger.info("Created new collection 'ops_docs'")
-        else:
-            logger.info("Using existing collection 'ops_docs'")
-        
-        # 获取现有文档的 ID
-        existing_ids = set(self.vector_db.collection.get()['ids'])
-        
-        # 存储新文档
-        new_documents = []
-        for idx, doc in enumerate(documents):
-            # 生成唯一 ID
-            doc_id = f"{page_id}_{idx}"
-            if doc_id not in existing_ids:
-                new_documents.append((doc_id, doc))
-        
-        if new_documents:
-            self.vector_db.store_documents("ops_docs", [doc for _, doc in new_documents], [doc_id for doc_id, _ in new_documents])
-            logger.info(f"Added {len(new_documents)} new documents to the collection.")
-        else:
-            logger.info("No new documents to add.")
-        
-        self.initialized = True
-        
-    def query(self, question: str) -> str:
-        """Query the agent with a question"""
+    def _count_records(self) -> int:
+        return sum(self.vector_db.shard(name).collection.count() for name in self.vector_db.shards.names())
+        
+    def initialize(self, page_id: str, incremental: bool = True, on_pipeline: Callable = None, shard: str = None) -> dict:
+        """Initialize the agent by fetching and storing wiki data.
+        
+        The pages under page_id are stored in the given shard; without one, in the shard
+        the root page was ingested into before, or the default 'ops_docs' shard. A root
+        page moved to another shard is deleted from its previous one.
+        
+        In incremental mode only pages whose Confluence version changed are re-fetched
+        and re-embedded; vectors of pages that no longer exist are deleted. on_pipeline is
+        called with the IngestPipeline before it runs, for progress reporting and cancellation.
+        """
+        if self.read_only:
+            raise Exception(READ_ONLY_MESSAGE)
+        previous = self.vector_db.shards.shard_for_root(page_id)
+        shard = validate_shard_name(shard or previous or DEFAULT_SHARD)
+        
+        # 同一时间只有一个写入者：入库和删除分片互斥
+        with self._write_lock:
+            db = self.vector_db.shard(shard)
+            if previous and previous != shard:
+                logger.info(f"Moving page {page_id} from shard '{previous}' to '{shard}'")
+                self._remove_root(previous, page_id)
+            self.vector_db.shards.add_root(shard, page_id)
+            logger.info(f"Syncing page {page_id} into shard '{shard}'")
+            self._remove_legacy_documents(db, page_id)
+            
+            pages = self.wiki_fetcher.list_pages(page_id)
+            stored = db.get_page_versions(where={"root_id": page_id})
+            
+            # 删除已从 wiki 中移除的页面
+            current_ids = {page['id'] for page in pages}
+            removed_ids = [doc_id for doc_id in stored if doc_id not in current_ids]
+            db.delete_pages(removed_ids)
+            
+            # 只重新获取版本号变化的页面
+            if incremental:
+                changed = [page for page in pages if stored.get(page['id']) != page['version']]
+            else:
+                changed = pages
+            
+            pipeline = self._create_pipeline(db, shard, page_id, resume=incremental)
+            if on_pipeline:
+                on_pipeline(pipeline)
+            try:
+                stats = pipeline.run(changed)
+            finally:
+                db.save()
+            
+            # 变成空白的页面不应保留旧内容；获取或向量化失败的页面保留旧记录，下次同步再试
+            if not pipeline.stop_event.is_set():
+                db.delete_pages([page_id for page_id in pipeline.empty_ids if page_id in stored])
+            
+            if (pipeline.written_ids or removed_ids or previous != shard) and self.answer_cache:
+                self.answer_cache.clear()
+            
+            logger.info(
+                f"Synced page {page_id} into shard '{shard}': {len(pages)} pages, {stats['pages_written']} updated, "
+                f"{len(pages) - len(changed)} unchanged, {len(removed_ids)} removed."
+            )
+            db.save()
+            self.vector_db.publish(shard)
+            self.initialized = self._count_records() > 0
+        return stats
+        
+    def _remove_root(self, shard: str, page_id: str):
+        """Delete the records of a root page from a shard."""
+        db = self.vector_db.shard(shard)
+        db.delete_pages(list(db.get_page_versions(where={"root_id": page_id})))
+        db.save()
+        self.vector_db.publish(shard)
+        
+    def list_shards(self) -> list:
+        """Registered shards with their root pages and record counts."""
+        return self.vector_db.shards.entries()
+        
+    def drop_shard(self, name: str) -> bool:
+        """Delete a shard and everything indexed in it; returns False if there is no such shard."""
+        if self.read_only:
+            raise Exception(READ_ONLY_MESSAGE)
+        if not self._write_lock.acquire(blocking=False):
+            raise ShardBusyError("An ingestion job is running, try again when it has finished")
+        try:
+            dropped = self.vector_db.drop_shard(name)
+            if dropped:
+                # 旧 checkpoint 会让同名分片重建时跳过页面
+                shutil.rmtree(os.path.join(self.persist_directory, "ingest_checkpoints", name), ignore_errors=True)
+        finally:
+            self._write_lock.release()
+        if dropped:
+            if self.answer_cache:
+                self.answer_cache.clear()
+            self.initialized = self._count_records() > 0
+        return dropped
+        
+    def _refresh_loop(self):
+        """Poll the shard registry and switch to newly published index generations."""
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing the index: {str(e)}")
+        
+    def refresh(self) -> bool:
+        """Switch to the latest published index generation; returns True if it changed."""
+        if not self.vector_db.refresh():
+            return False
+        # 索引变了，缓存的答案可能已过期
+        if self.answer_cache:
+            self.answer_cache.clear()
+        self.initialized = self._count_records() > 0
+        return True
+        
+    def _create_pipeline(self, db: VectorDB, shard: str, page_id: str, resume: bool = True) -> IngestPipeline:
+        """Build an ingestion pipeline for a root page from the `ingest` config section."""
+        ingest_config = get_config().get("ingest", {})
+        return IngestPipeline(
+            self.wiki_fetcher,
+            db,
+            root_id=page_id,
+            checkpoint_dir=os.path.join(self.persist_directory, "ingest_checkpoints", shard),
+            queue_size=ingest_config.get("queue_size", 64),
+            fetch_workers=ingest_config.get("fetch_workers", self.wiki_fetcher.max_workers),
+            clean_workers=ingest_config.get("clean_workers", 2),
+            clean_processes=ingest_config.get("clean_processes", 0),
+            embed_workers=ingest_config.get("embed_workers", 2),
+            upsert_batch_size=ingest_config.get("upsert_batch_size", 256),
+            save_seconds=ingest_config.get("save_seconds", 60),
+            resume=resume
+        )
+        
+    @staticmethod
+    def _remove_legacy_documents(db: VectorDB, page_id: str):
+        """Delete records stored under the old position-based '{page_id}_{idx}' IDs."""
+        pattern = re.compile(rf"{re.escape(page_id)}_\d+")
+        all_ids = db.collection.get(include=[])['ids']
+        db.delete_documents([doc_id for doc_id in all_ids if pattern.fullmatch(doc_id)])
+        
+    @staticmethod
+    def _scope(shards: List[str]) -> str:
+        """Answer cache and coalescing scope of a shard selection."""
+        return ",".join(sorted(shards))
+        
+    def _use_lexical_fast_path(self, question: str, shards: List[str]) -> bool:
+        """Identifier-like questions that the lexical index can answer skip the embedding call."""
+        if not self.vector_db.hybrid or not looks_like_identifier(question):
+            return False
+        if not any(self.vector_db.shard(name).lexical_index.search(question, limit=1) for name in shards):
+            return False
+        logger.info("Using lexical fast path")
+        return True
+        
+    def _embed_question(self, question: str, shards: List[str]):
+        """Embed a question, or return None when the lexical fast path applies."""
+        if self._use_lexical_fast_path(question, shards):
+            return None
+        with span("question_embed"):
+            return self.vector_db._get_embedding(question)
+        
+    async def _aembed_question(self, question: str, client, shards: List[str]):
+        """Async variant of _embed_question."""
+        # BM25 检索是同步的 CPU 计算，放到线程里避免阻塞事件循环
+        if await asyncio.to_thread(self._use_lexical_fast_path, question, shards):
+            return None
+        with span("question_embed"):
+            return await self.vector_db._aget_embedding(client, question)
+        
+    def _embed_questions(self, questions: List[str], shards: List[str]) -> list:
+        """Batch variant of _embed_question: all questions share the same batched embedding calls."""
+        embeddings = [None] * len(questions)
+        rows = [idx for idx, question in enumerate(questions) if not self._use_lexical_fast_path(question, shards)]
+        if rows:
+            with span("question_embed"):
+                vectors = self.vector_db._get_embedding_many([questions[idx] for idx in rows])
+            for idx, vector in zip(rows, vectors):
+                embeddings[idx] = vector
+        return embeddings
+        
+    def _build_context(self, question: str, query_embedding, shards: List[str]) -> str:
+        """Retrieve the passages most relevant to a question from the given shards and pack them into a context."""
+        with span("retrieve"):
+            passages = self.vector_db.retrieve_shards(
+                [query_embedding], limit=self.candidates, include_embeddings=True, query_texts=[question], shards=shards
+            )[0]
+        return self._pack_context(query_embedding, passages)
+        
+    def _pack_context(self, query_embedding, passages: list) -> str:
+        """Deduplicate, rank and render retrieved passages within the context token budget."""
+        with span("context_build"):
+            selected = self.context_builder.build(query_embedding, passages, limit=self.top_k)
+            return self.context_builder.render(selected)
+        
+    def _build_messages(self, question: str, context: str) -> list:
+        """Build the chat messages for a question and log the prompt size."""
+        messages = [
+            {"role": "system", "content": "You are an operations and maintenance assistant. Use the following context to answer questions:"},
+            {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
+        ]
+        prompt_tokens = sum(len(self.vector_db.encoder.encode(message["content"])) for message in messages)
+        PROMPT_TOKENS.observe(prompt_tokens)
+        logger.debug(f"Prompt tokens: {prompt_tokens}")
+        return messages
+        
+    def _chat_payload(self, question: str, context: str, stream: bool = False) -> dict:
+        """Build the chat completions request body."""
+        payload = {
+            "model": "deepseek-ai/DeepSeek-V2.5",
+            "messages": self._build_messages(question, context),
+            "temperature": 0.7,
+            "max_tokens": 1000
+        }
+        if stream:
+            payload["stream"] = True  # Enable streaming
+        return payload
+        
+    def query(self, question: str, shards: List[str] = None) -> str:
+        """Query the agent with a question, searching the given shards (default: all)"""
         if not self.initialized:
             return "Vector database is not initialized. Please initialize first."
-            
-        # First, find relevant documents
-        query_embedding = self.vector_db._get_embedding(question)
-        search_result = self.vector_db.search(query_embedding, limit=3)
-        
-        # Build context from relevant documents
-        context = "\n".join(search_result['documents'][0])
-        
-        # Query SiliconFlow's chat API directly
-        response = requests.post(
-            "https://api.siliconflow.cn/v1/chat/completions",
-            headers={"Authorization": f"Bearer {self.api_key}"},
-            json={
-                "model": "deepseek-ai/DeepSeek-V2.5",
-                "messages": [
-                    {"role": "system", "content": "You are an operations and maintenance assistant. Use the following context to answer questions:"},
-                    {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1000
+        
+        shards = self.vector_db.select_shards(shards)
+        query_embedding = self._embed_question(question, shards)
+        cached = self.answer_cache.lookup(question, query_embedding, self._scope(shards)) if self.answer_cache else None
+        if cached is not None:
+            return cached
+        
+        def produce():
+            try:
+                yield self._answer(question, query_embedding, shards)
+            except Exception as e:
+                yield e
+        
+        results = list(self.coalescer.subscribe(f"query:{self._scope(shards)}:{normalize_question(question)}", produce))
+        if not results:
+            raise Exception("Query produced no answer")
+        if isinstance(results[0], Exception):
+            raise results[0]
+        return results[0]
+        
+    def _answer(self, question: str, query_embedding, shards: List[str]) -> str:
+        """Generate a complete answer and cache it."""
+        generation = self.answer_cache.generation if self.answer_cache else None
+        context = self._build_context(question, query_embedding, shards)
+        return self._complete(question, query_embedding, context, generation, self._scope(shards))
+        
+    def _complete(self, question: str, query_embedding, context: str, generation, scope: str) -> str:
+        """Run a non-streaming chat completion for a question and cache the answer."""
+        payload = self._chat_payload(question, context)
+        with span("llm_chat"):
+            response = self.client.chat(payload)
+        
+        answer = response['choices'][0]['message']['content']
+        if self.answer_cache:
+            self.answer_cache.store(question, query_embedding, answer, generation, scope)
+        return answer
+        
+    def query_batch(self, questions: List[str], concurrency: int = None, shards: List[str] = None) -> Iterator[dict]:
+        """Answer many questions, yielding {"index", "question", "answer" or "error"} in completion order.
+        
+        All questions are embedded in shared batched API calls and searched with one
+        multi-query lookup per shard; the chat completions then run on at most
+        `concurrency` threads (default `batch.concurrency`). Repeated questions are
+        answered once and cached answers are yielded first.
+        """
+        if not self.initialized:
+            for idx, question in enumerate(questions):
+                yield {"index": idx, "question": question, "error": "Vector database is not initialized. Please initialize first."}
+            return
+        
+        # 相同的问题只回答一次，结果按原始位置分别返回
+        groups = {}
+        for idx, question in enumerate(questions):
+            groups.setdefault(normalize_question(question), []).append(idx)
+        unique = [questions[indices[0]] for indices in groups.values()]
+        targets = list(groups.values())
+        
+        def results(position: int, **result):
+            return [dict(result, index=idx, question=questions[idx]) for idx in targets[position]]
+        
+        try:
+            shards = self.vector_db.select_shards(shards)
+            scope = self._scope(shards)
+            embeddings = self._embed_questions(unique, shards)
+        except Exception as e:
+            logger.error(f"Error in query_batch: {str(e)}")
+            for position in range(len(unique)):
+                yield from results(position, error=str(e))
+            return
+        
+        pending = []
+        for position, question in enumerate(unique):
+            cached = self.answer_cache.lookup(question, embeddings[position], scope) if self.answer_cache else None
+            if cached is not None:
+                yield from results(position, answer=cached, cached=True)
+            else:
+                pending.append(position)
+        if not pending:
+            return
+        
+        generation = self.answer_cache.generation if self.answer_cache else None
+        try:
+            with span("retrieve"):
+                found = self.vector_db.retrieve_shards(
+                    [embeddings[position] for position in pending], limit=self.candidates, include_embeddings=True,
+                    query_texts=[unique[position] for position in pending], shards=shards
+                )
+        except Exception as e:
+            logger.error(f"Error in query_batch: {str(e)}")
+            for position in pending:
+                yield from results(position, error=str(e))
+            return
+        
+        def answer(position: int, passages: list) -> str:
+            context = self._pack_context(embeddings[position], passages)
+            return self._complete(unique[position], embeddings[position], context, generation, scope)
+        
+        concurrency = concurrency or get_config().get("batch", {}).get("concurrency", 8)
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-chat")
+        try:
+            # 每个任务复制一份上下文，日志沿用请求的 trace ID
+            futures = {
+                executor.submit(contextvars.copy_context().run, answer, position, passages): position
+                for position, passages in zip(pending, found)
             }
-        )
+            for future in as_completed(futures):
+                position = futures[future]
+                try:
+                    yield from results(position, answer=future.result())
+                except Exception as e:
+                    logger.error(f"Error in query_batch: {str(e)}")
+                    yield from results(position, error=str(e))
+        finally:
+            # 客户端断开时不再发起尚未开始的请求
+            executor.shutdown(wait=False, cancel_futures=True)
         
-        return response.json()['choices'][0]['message']['content']
+    def stream_batch(self, questions: List[str], concurrency: int = None, shards: List[str] = None) -> Iterator[str]:
+        """Yield query_batch results as NDJSON lines for the batch endpoints."""
+        results = self.query_batch(questions, concurrency, shards)
+        try:
+            for result in results:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            results.close()
 
-    def stream_query(self, question: str):
-        """Stream the response for a question"""
+    def stream_query(self, question: str, shards: List[str] = None):
+        """Stream the response for a question, searching the given shards (default: all)"""
+        started = time.perf_counter()
         if not self.initialized:
             logger.error("Vector database is not initialized.")
             yield "data: " + json.dumps({"error": "Vector database is not initialized. Please initialize first."}) + "\n\n"
             return
         
         try:
-            # First, find relevant documents
-            query_embedding = self.vector_db._get_embedding(question)
-            search_result = self.vector_db.search(query_embedding, limit=3)
-            
-            # Build context from relevant documents
-            context = "\n".join(search_result['documents'][0])
-            logger.info(f"Context for question: {context[:100]}...")  # Log first 100 chars of context
+            shards = self.vector_db.select_shards(shards)
+            query_embedding = self._embed_question(question, shards)
+        except Exception as e:
+            logger.error(f"Error in stream_query: {str(e)}")
+            yield "data: " + json.dumps({"error": str(e)}) + "\n\n"
+            return
+        
+        cached = self.answer_cache.lookup(question, query_embedding, self._scope(shards)) if self.answer_cache else None
+        if cached is not None:
+            logger.info("Answer cache hit")
+            yield token_event(cached)
+            yield "data: " + json.dumps({"done": True}) + "\n\n"
+            return
+        
+        # 相同问题的并发请求共享同一个上游流
+        yield from self.coalescer.subscribe(
+            f"stream:{self._scope(shards)}:{normalize_question(question)}",
+            lambda: self._stream_answer(question, query_embedding, started, shards)
+        )
+        
+    def _stream_answer(self, question: str, query_embedding, started: float, shards: List[str]):
+        """Stream an answer from the chat API as per-token SSE events and cache the full text."""
+        generation = self.answer_cache.generation if self.answer_cache else None
+        try:
+            context = self._build_context(question, query_embedding, shards)
+            logger.debug(f"Context for question: {context[:100]}...")  # Log first 100 chars of context
             
             # Stream the response
-            response = requests.post(
-                "https://api.siliconflow.cn/v1/chat/completions",
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                json={
-                    "model": "deepseek-ai/DeepSeek-V2.5",
-                    "messages": [
-                        {"role": "system", "content": "You are an operations and maintenance assistant. Use the following context to answer questions:"},
-                        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"}
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 1000,
-                    "stream": True  # Enable streaming
-                },
-                stream=True
-            )
+            response = self.client.stream_chat(self._chat_payload(question, context))
             
             if response.status_code != 200:
                 logger.error(f"API request failed with status {response.status_code}: {response.text}")
                 yield "data: " + json.dumps({"error": f"API request failed with status {response.status_code}"}) + "\n\n"
                 return
             
+            # 上游的网络分块可能切断 SSE 事件和多字节字符，交给增量解析器处理
+            parser = SSEParser()
+            answer = []
+            timing = {"started": started}
             for chunk in response.iter_content(chunk_size=None):
                 if chunk:
-                    decoded_chunk = chunk.decode('utf-8')
-                    if decoded_chunk.startswith("data: "):
-                        yield decoded_chunk + "\n"
-                    else:
-                        yield "data: " + json.dumps({"answer": decoded_chunk}) + "\n\n"
+                    yield from self._relay_tokens(parser.feed(chunk), answer, timing)
+            yield from self._relay_tokens(parser.close(), answer, timing)
             
-            # Send the [DONE] marker at the end
-            yield "data: " + json.dumps({"done": True}) + "\n\n"
+            yield self._finish_stream(question, query_embedding, answer, timing, generation, self._scope(shards))
         except Exception as e:
             logger.error(f"Error in stream_query: {str(e)}")
             yield "data: " + json.dumps({"error": str(e)}) + "\n\n"
+        
+    def _relay_tokens(self, events, answer: list, timing: dict):
+        """Turn parsed upstream events into compact per-token events for the browser."""
+        for data in events:
+            content = parse_delta(data)
+            if content is None:
+                timing["done"] = True  # 上游发送了 [DONE]，回答是完整的
+            elif content:
+                timing.setdefault("first_token", time.perf_counter())
+                answer.append(content)
+                yield token_event(content)
+        
+    def _finish_stream(self, question: str, query_embedding, answer: list, timing: dict, generation, scope: str) -> str:
+        """Cache the streamed answer, log time-to-first-token and throughput, and build the done event."""
+        answer = "".join(answer)
+        # 只缓存完整的回答：没收到 [DONE] 的流可能在中途被上游断开
+        if self.answer_cache and timing.get("done") and answer:
+            self.answer_cache.store(question, query_embedding, answer, generation, scope)
+        elif self.answer_cache:
+            logger.warning("Not caching an empty or incomplete streamed answer")
+        
+        finished = time.perf_counter()
+        first_token = timing.get("first_token", finished)
+        tokens = len(self.vector_db.encoder.encode(answer))
+        observe("llm_ttft", first_token - timing["started"])
+        observe("llm_stream_total", finished - timing["started"])
+        LLM_TOKENS.inc(tokens)
+        stats = {
+            "ttft": round(first_token - timing["started"], 3),
+            "tokens": tokens,
+            "tokens_per_second": round(tokens / (finished - first_token), 1) if finished > first_token else 0.0
+        }
+        logger.info(f"Stream finished: ttft={stats['ttft']}s, {tokens} tokens, {stats['tokens_per_second']} tokens/s")
+        
+        # Send the [DONE] marker at the end
+        return "data: " + json.dumps(dict(stats, done=True)) + "\n\n"
+        
+    async def astream_query(self, question: str, client, shards: List[str] = None):
+        """Async variant of stream_query for the ASGI app; upstream calls go through an AsyncSiliconFlowClient."""
+        started = time.perf_counter()
+        if not self.initialized:
+            logger.error("Vector database is not initialized.")
+            yield "data: " + json.dumps({"error": "Vector database is not initialized. Please initialize first."}) + "\n\n"
+            return
+        
+        try:
+            shards = self.vector_db.select_shards(shards)
+            query_embedding = await self._aembed_question(question, client, shards)
+        except Exception as e:
+            logger.error(f"Error in astream_query: {str(e)}")
+            yield "data: " + json.dumps({"error": str(e)}) + "\n\n"
+            return
+        
+        cached = self.answer_cache.lookup(question, query_embedding, self._scope(shards)) if self.answer_cache else None
+        if cached is not None:
+            logger.info("Answer cache hit")
+            yield token_event(cached)
+            yield "data: " + json.dumps({"done": True}) + "\n\n"
+            return
+        
+        async for event in self.async_coalescer.subscribe(
+            f"stream:{self._scope(shards)}:{normalize_question(question)}",
+            lambda: self._astream_answer(question, query_embedding, client, started, shards)
+        ):
+            yield event
+        
+    async def _astream_answer(self, question: str, query_embedding, client, started: float, shards: List[str]):
+        """Async variant of _stream_answer."""
+        generation = self.answer_cache.generation if self.answer_cache else None
+        try:
+            # Chroma 检索和 prompt 组装是同步的，放到线程池里避免阻塞事件循环
+            payload = await asyncio.to_thread(
+                lambda: self._chat_payload(question, self._build_context(question, query_embedding, shards))
+            )
+            
+            parser = SSEParser()
+            answer = []
+            timing = {"started": started}
+            async for chunk in client.stream_chat(payload):
+                for event in self._relay_tokens(parser.feed(chunk), answer, timing):
+                    yield event
+            for event in self._relay_tokens(parser.close(), answer, timing):
+                yield event
+            
+            yield self._finish_stream(question, query_embedding, answer, timing, generation, self._scope(shards))
+        except Exception as e:
+            logger.error(f"Error in astream_query: {str(e)}")
+            yield "data: " + json.dumps({"error": str(e)}) + "\n\n"
 
-# Initialize with a specific page
-# agent.initialize("76418066")
+def parse_batch_concurrency(value) -> Optional[int]:
+    """Validate a requested batch concurrency: None, or an integer from 1 to batch.concurrency."""
+    if value is None:
+        return None
+    limit = get_config().get("batch", {}).get("concurrency", 8)
+    # bool 也是 int，"4" 这样的字符串会让线程池直接报错
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= limit:
+        raise ValueError(f"'concurrency' must be an integer from 1 to {limit}")
+    return value
 
-# Initialize OpsAgent
-agent = OpsAgent(
-    wiki_domain=config["wiki"]["domain"],
-    wiki_username=config["wiki"]["username"],
-    wiki_password=config["wiki"]["password"],
-    persist_directory=config["vector_db"]["persist_directory"]
-)
+_agent = None
+_agent_lock = threading.Lock()
 
-# Query the agent
-response = agent.query("How do I restart the production server?")
-print(response) 
\ No newline at end of file
+def get_agent() -> OpsAgent:
+    """Return the process-wide agent, building it on first use."""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                config = get_config()
+                _agent = OpsAgent(
+                    wiki_domain=config["wiki"]["domain"],
+                    wiki_username=config["wiki"]["username"],
+                    wiki_password=config["wiki"]["password"],
+                    persist_directory=config["vector_db"]["persist_directory"],
+                    read_only=get_role() == "reader"
+                )
+    return _agent
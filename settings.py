@@ -0,0 +1,31 @@
+import os
+import threading
+import yaml
+
+CONFIG_PATH = os.environ.get("OM_AGENT_CONFIG", "config/config.yaml")
+
+_config = None
+_lock = threading.Lock()
+
+def get_config() -> dict:
+    """Load config.yaml once per process and return the shared dict."""
+    global _config
+    if _config is None:
+        with _lock:
+            if _config is None:
+                # 加载配置文件
+                with open(CONFIG_PATH, "r") as f:
+                    _config = yaml.safe_load(f)
+    return _config
+
+ROLES = ("writer", "reader")
+
+def get_role() -> str:
+    """Serving role of this process: the writer owns ingestion, readers only answer queries.
+
+    OM_AGENT_ROLE overrides `serving.role` from config.yaml.
+    """
+    role = os.environ.get("OM_AGENT_ROLE") or get_config().get("serving", {}).get("role", "writer")
+    if role not in ROLES:
+        raise ValueError(f"Unknown serving role '{role}', expected one of {', '.join(ROLES)}")
+    return role
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD = "ops_docs"  # 分片之前唯一的集合，未指定分片的根页面仍写入这里
+
+# Chroma 集合名的限制：3-63 个字符，首尾为字母或数字
+_SHARD_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{1,61}[A-Za-z0-9]")
+
+def validate_shard_name(name: str) -> str:
+    """Return the name if it can be used as a shard (and collection) name, else raise ValueError."""
+    if not isinstance(name, str) or not _SHARD_NAME.fullmatch(name):
+        raise ValueError(f"Invalid shard name {name!r}: use 3-63 letters, digits, '_' or '-', starting and ending with a letter or digit")
+    return name
+
+class ShardBusyError(Exception):
+    """Raised when a shard cannot be changed because an ingestion is writing to the store."""
+
+class ShardRegistry:
+    """Named shards, one collection each, and the root pages ingested into them.
+
+    Persisted as JSON next to the Chroma database so every process sees the same shards.
+    The writer bumps a shard's generation after each ingestion; read-only processes
+    reload the file when it changes and switch to the new generation:
+
+        {"shards": {"sre": {"root_ids": ["123"], "records": 4200, "generation": 7, "snapshot": "1718...",
+                            "created_at": ..., "updated_at": ...}}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._shards: Dict[str, Dict] = {}
+        self._stat = None  # 已加载文件的 (inode, mtime)，用来发现其他进程的更新
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> bool:
+        """Load the registry from disk; returns False if it does not exist yet."""
+        stat = self._file_stat()
+        if stat is None:
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self._shards = data.get("shards", {})
+            self._stat = stat
+        return True
+
+    def changed(self) -> bool:
+        """Whether another process replaced the file since it was last loaded or saved."""
+        return self._file_stat() != self._stat
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def save(self):
+        with self._lock:
+            data = {"shards": self._shards}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            self._stat = self._file_stat()
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._shards)
+
+    def get(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._shards.get(name)
+            return dict(entry, name=name) if entry is not None else None
+
+    def entries(self) -> List[Dict]:
+        with self._lock:
+            return [dict(self._shards[name], name=name) for name in sorted(self._shards)]
+
+    def shard_for_root(self, root_id: str) -> Optional[str]:
+        """Return the shard a root page was ingested into, if any."""
+        with self._lock:
+            for name, entry in self._shards.items():
+                if root_id in entry["root_ids"]:
+                    return name
+        return None
+
+    def add(self, name: str):
+        """Register a shard with no root pages if it is not registered yet."""
+        with self._lock:
+            if name in self._shards:
+                return
+            self._shards[name] = self._new_entry()
+        self.save()
+
+    def add_root(self, name: str, root_id: str):
+        """Register a shard if needed and assign a root page to it, removing it from any other shard."""
+        with self._lock:
+            for other, entry in self._shards.items():
+                if other != name and root_id in entry["root_ids"]:
+                    entry["root_ids"].remove(root_id)
+            entry = self._shards.setdefault(name, self._new_entry())
+            if root_id not in entry["root_ids"]:
+                entry["root_ids"].append(root_id)
+        self.save()
+
+    @staticmethod
+    def _new_entry() -> Dict:
+        now = time.time()
+        return {"root_ids": [], "records": 0, "created_at": now, "updated_at": now}
+
+    def update(self, name: str, **fields):
+        """Set fields of a registered shard and bump its updated_at."""
+        with self._lock:
+            if name not in self._shards:
+                return
+            self._shards[name].update(fields, updated_at=time.time())
+        self.save()
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            removed = self._shards.pop(name, None) is not None
+        if removed:
+            self.save()
+        return removed
+
+def parse_shard_list(value) -> Optional[List[str]]:
+    """Parse a shard selection from a request: a list or a comma-separated string; None selects all shards."""
+    if value is None:
+        return None
+    names = value.split(",") if isinstance(value, str) else value
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError("'shards' must be a list of shard names or a comma-separated string")
+    return [name.strip() for name in names if name.strip()] or None
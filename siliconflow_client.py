@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from telemetry import UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://api.siliconflow.cn/v1"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def backoff_delay(attempt: int, base: float = 0.5, maximum: float = 8.0, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with full jitter, honouring a Retry-After header in seconds."""
+    if retry_after:
+        try:
+            return min(float(retry_after), maximum)
+        except ValueError:
+            pass
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: grows by one after a run of successes, halves when rate-limited."""
+
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 32):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify()
+
+    def on_throttled(self):
+        with self._condition:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+        logger.warning(f"SiliconFlow rate limited, concurrency limit lowered to {self.limit}")
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """asyncio counterpart of AdaptiveLimiter: same AIMD bookkeeping, but waiters yield to the event loop."""
+
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 32):
+        super().__init__(initial=initial, minimum=minimum, maximum=maximum)
+        self._waiters = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._waiters:
+            await self._waiters.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._waiters:
+                self.in_flight -= 1
+                # 上限可能在此期间调高，按空出的名额唤醒
+                self._waiters.notify(max(1, self.limit - self.in_flight))
+
+class SiliconFlowClient:
+    """Shared SiliconFlow client: pooled keep-alive connections, timeouts, retries and adaptive concurrency.
+    
+    The concurrency slot is held until response headers arrive; a streamed body is read
+    after the slot is released so long generations do not starve other calls.
+    """
+
+    def __init__(self, api_key: str, pool_size: int = 16, connect_timeout: float = 5, read_timeout: float = 60,
+                 max_retries: int = 3, initial_concurrency: int = 8, max_concurrency: int = 32,
+                 base_url: str = API_BASE):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.limiter = AdaptiveLimiter(initial=initial_concurrency, maximum=max_concurrency)
+
+    @classmethod
+    def from_config(cls, siliconflow_config: Dict) -> "SiliconFlowClient":
+        """Build a client from the `siliconflow` section of config.yaml."""
+        return cls(
+            siliconflow_config["api_key"],
+            pool_size=siliconflow_config.get("pool_size", 16),
+            connect_timeout=siliconflow_config.get("connect_timeout", 5),
+            read_timeout=siliconflow_config.get("read_timeout", 60),
+            max_retries=siliconflow_config.get("max_retries", 3),
+            initial_concurrency=siliconflow_config.get("initial_concurrency", 8),
+            max_concurrency=siliconflow_config.get("max_concurrency", 32),
+            base_url=siliconflow_config.get("base_url", API_BASE)
+        )
+
+    def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed a batch of texts with a single request."""
+        response = self.post("/embeddings", {"input": texts, "model": model})
+        if response.status_code != 200:
+            raise Exception(f"Embedding API failed with status {response.status_code}: {response.text}")
+
+        data = response.json()
+        if 'data' not in data or len(data['data']) != len(texts):
+            raise Exception("Invalid response format: missing 'data' field")
+        # 接口不保证返回顺序，按 index 还原
+        items = sorted(data['data'], key=lambda item: item.get('index', 0))
+        return [item['embedding'] for item in items]
+
+    def chat(self, payload: Dict) -> Dict:
+        """Run a non-streaming chat completion."""
+        response = self.post("/chat/completions", payload)
+        if response.status_code != 200:
+            raise Exception(f"API request failed with status {response.status_code}: {response.text}")
+        return response.json()
+
+    def stream_chat(self, payload: Dict) -> requests.Response:
+        """Start a streaming chat completion and return the open response."""
+        return self.post("/chat/completions", dict(payload, stream=True), stream=True)
+
+    def post(self, path: str, payload: Dict, stream: bool = False) -> requests.Response:
+        """POST with retries on connection errors, timeouts and 429/5xx responses.
+        
+        After the last attempt the final response is returned so callers can report its status.
+        """
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                with self.limiter.slot():
+                    response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"SiliconFlow request to {path} failed ({str(e)}), retrying")
+                UPSTREAM_RETRIES.inc(path=path, reason="connection")
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.limiter.on_success()
+                    return response
+                if response.status_code == 429:
+                    self.limiter.on_throttled()
+                if attempt == self.max_retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+                logger.warning(f"SiliconFlow request to {path} returned {response.status_code}, retrying")
+                UPSTREAM_RETRIES.inc(path=path, reason=str(response.status_code))
+            time.sleep(backoff_delay(attempt, retry_after=retry_after))
+
+class AsyncSiliconFlowClient:
+    """Pooled asyncio client for the SiliconFlow embeddings and chat completions APIs.
+    
+    Retries and adaptive concurrency work as in SiliconFlowClient, including holding the
+    concurrency slot only until the response headers of a stream arrive.
+    """
+
+    def __init__(self, api_key: str, max_connections: int = 200, timeout: float = 60, max_retries: int = 3,
+                 initial_concurrency: int = 8, max_concurrency: int = 32, base_url: str = API_BASE):
+        import httpx
+        
+        self.max_retries = max_retries
+        self.limiter = AsyncAdaptiveLimiter(initial=initial_concurrency, maximum=max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=10)
+        )
+
+    async def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed a batch of texts with a single request."""
+        response = await self._post("/embeddings", {"input": texts, "model": model})
+        if response.status_code != 200:
+            raise Exception(f"Embedding API failed with status {response.status_code}: {response.text}")
+
+        data = response.json()
+        if 'data' not in data or len(data['data']) != len(texts):
+            raise Exception("Invalid response format: missing 'data' field")
+        items = sorted(data['data'], key=lambda item: item.get('index', 0))
+        return [item['embedding'] for item in items]
+
+    async def chat(self, payload: Dict) -> Dict:
+        """Run a non-streaming chat completion."""
+        response = await self._post("/chat/completions", payload)
+        if response.status_code != 200:
+            raise Exception(f"API request failed with status {response.status_code}: {response.text}")
+        return response.json()
+
+    async def stream_chat(self, payload: Dict) -> AsyncIterator[bytes]:
+        """Run a streaming chat completion, yielding raw chunks of the upstream SSE stream."""
+        response = await self._post("/chat/completions", dict(payload, stream=True), stream=True)
+        try:
+            if response.status_code != 200:
+                body = await response.aread()
+                logger.error(f"API request failed with status {response.status_code}: {body[:500]!r}")
+                raise Exception(f"API request failed with status {response.status_code}")
+            async for chunk in response.aiter_bytes():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def _post(self, path: str, payload: Dict, stream: bool = False) -> "httpx.Response":
+        """POST with jittered-backoff retries on transport errors and 429/5xx responses.
+        
+        With stream=True the body is left unread and the caller must close the response.
+        """
+        import httpx
+        
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self.limiter.slot():
+                    request = self.client.build_request("POST", path, json=payload)
+                    response = await self.client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"SiliconFlow request to {path} failed ({str(e)}), retrying")
+                UPSTREAM_RETRIES.inc(path=path, reason="connection")
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.limiter.on_success()
+                    return response
+                if response.status_code == 429:
+                    self.limiter.on_throttled()
+                if attempt == self.max_retries:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                await response.aclose()
+                logger.warning(f"SiliconFlow request to {path} returned {response.status_code}, retrying")
+                UPSTREAM_RETRIES.inc(path=path, reason=str(response.status_code))
+            await asyncio.sleep(backoff_delay(attempt, retry_after=retry_after))
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,62 @@
+import codecs
+import json
+from typing import List, Optional
+
+class SSEParser:
+    """Incremental parser for a server-sent event stream.
+
+    Bytes may be fed in arbitrary chunks: partial lines and partial UTF-8 sequences are
+    buffered until complete, and the data of each finished event is returned.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._data: List[str] = []
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """Consume a chunk of bytes and return the data of events it completed."""
+        self._buffer += self._decoder.decode(chunk)
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._process(lines)
+
+    def close(self) -> List[str]:
+        """Flush buffered input at the end of the stream."""
+        self._buffer += self._decoder.decode(b"", final=True)
+        lines, self._buffer = [self._buffer, ""], ""
+        return self._process(lines)
+
+    def _process(self, lines: List[str]) -> List[str]:
+        events = []
+        for line in lines:
+            line = line.rstrip("\r")
+            if not line:
+                # 空行表示一个事件结束
+                if self._data:
+                    events.append("\n".join(self._data))
+                    self._data = []
+            elif line.startswith("data:"):
+                value = line[5:]
+                self._data.append(value[1:] if value.startswith(" ") else value)
+            # 注释行（以 ':' 开头）以及 event/id/retry 字段不需要处理
+        return events
+
+def parse_delta(data: str) -> Optional[str]:
+    """Extract choices[0].delta.content from a chat completion chunk.
+
+    Returns None for the terminal [DONE] marker and '' for chunks without content.
+    """
+    if data.strip() == "[DONE]":
+        return None
+    try:
+        return json.loads(data)['choices'][0]['delta'].get('content') or ""
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ""
+
+def event(payload: dict) -> str:
+    """Format a compact SSE event for the browser."""
+    return "data: " + json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n\n"
+
+def token_event(content: str) -> str:
+    """Format one streamed token in the chat completion shape the UI expects."""
+    return event({"choices": [{"delta": {"content": content}}]})
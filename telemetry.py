@@ -0,0 +1,223 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s'
+
+class _Metric:
+    """Base for labelled metrics rendered in the Prometheus text format."""
+
+    type = None
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{self._labels(key)} {value}" for key, value in sorted(self._values.items())]
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List] = {}  # 每组标签：[各桶计数..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[idx] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Dict]:
+        """Count and sum per label set, for reports outside /metrics."""
+        with self._lock:
+            return {key: {"count": state[-1], "sum": state[-2]} for key, state in self._values.items()}
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{self._labels(key, {'le': repr(bound)})} {cumulative}")
+                lines.append(f"{self.name}_bucket{self._labels(key, {'le': '+Inf'})} {state[-1]}")
+                lines.append(f"{self.name}_sum{self._labels(key)} {state[-2]}")
+                lines.append(f"{self.name}_count{self._labels(key)} {state[-1]}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "om_agent_stage_duration_seconds", "Time spent in each ingestion and query stage.", ("stage",)
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "om_agent_stage_errors_total", "Stages that raised an exception.", ("stage",)
+))
+REQUESTS = REGISTRY.register(Counter(
+    "om_agent_http_requests_total", "HTTP requests by endpoint and status code.", ("endpoint", "status")
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "om_agent_http_request_duration_seconds", "Time until the response headers are sent.", ("endpoint",)
+))
+EMBEDDED_TEXTS = REGISTRY.register(Counter(
+    "om_agent_embedded_texts_total", "Texts embedded, by whether the embedding came from the cache or the API.", ("source",)
+))
+ANSWER_CACHE = REGISTRY.register(Counter(
+    "om_agent_answer_cache_lookups_total", "Answer cache lookups by result.", ("result",)
+))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "om_agent_prompt_tokens", "Prompt size of chat requests in tokens.",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000)
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "om_agent_llm_completion_tokens_total", "Tokens streamed back from the chat model."
+))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "om_agent_upstream_retries_total", "Retried SiliconFlow requests by path and reason.", ("path", "reason")
+))
+
+@contextmanager
+def span(stage: str):
+    """Time a block into the stage histogram and count it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+def observe(stage: str, seconds: float):
+    """Record a stage duration measured outside a span (e.g. time-to-first-token)."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"{stage} took {seconds * 1000:.1f} ms")
+
+# ---- trace ID ----
+
+_trace_id = contextvars.ContextVar("trace_id", default="-")
+
+def new_trace_id(trace_id: str = None) -> str:
+    """Set the trace ID of the current context, generating one if none is given."""
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    _trace_id.set(trace_id)
+    return trace_id
+
+def get_trace_id() -> str:
+    return _trace_id.get()
+
+def bind_trace(iterable: Iterable, trace_id: str) -> Iterator:
+    """Iterate with the trace ID set, for response generators consumed after the view returns."""
+    iterator = iter(iterable)
+    try:
+        while True:
+            token = _trace_id.set(trace_id)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _trace_id.reset(token)
+            yield item
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()  # 客户端断开时也关闭上游生成器
+
+class TraceIdFilter(logging.Filter):
+    """Add the current trace ID to every log record as `trace_id`."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get()
+        return True
+
+def configure_logging(log_config: Dict = None):
+    """Set the root log level and add trace IDs and a rotating file handler to the root logger.
+
+    Safe to call more than once; handlers are only added the first time.
+    """
+    log_config = log_config or {}
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, str(log_config.get("level", "INFO")).upper()))
+    if any(isinstance(handler_filter, TraceIdFilter) for handler in root.handlers for handler_filter in handler.filters):
+        return
+
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler())
+    path = log_config.get("file", "logs/app.log")
+    if path:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        root.addHandler(RotatingFileHandler(
+            path,
+            maxBytes=log_config.get("max_bytes", 10 * 1024 * 1024),
+            backupCount=log_config.get("backup_count", 5),
+            encoding="utf-8"
+        ))
+    formatter = logging.Formatter(LOG_FORMAT)
+    for handler in root.handlers:
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(formatter)
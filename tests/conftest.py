@@ -0,0 +1,48 @@
+import copy
+import os
+import sys
+
+import pytest
+import yaml
+
+# 模块都在仓库根目录，没有安装成包
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+class CharEncoder:
+    """Stands in for the tiktoken encoding, whose vocabulary is downloaded on first use."""
+
+    def encode(self, text: str):
+        return [ord(char) for char in text]
+
+    def decode(self, tokens) -> str:
+        return "".join(chr(token) for token in tokens)
+
+@pytest.fixture
+def stub():
+    """Local Confluence and SiliconFlow stand-ins (benchmarks/stub_servers.py)."""
+    from stub_servers import StubConfig, StubServer
+
+    server = StubServer(StubConfig(pages=6, sections=3, latency_ms=0, embed_ms_per_text=0, ttft_ms=0,
+                                   token_rate=0, answer_tokens=5, dim=32)).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def config(tmp_path, stub, monkeypatch):
+    """The example config pointed at the stub servers and a temporary directory; tests may edit it."""
+    import settings
+    import tiktoken
+
+    with open(os.path.join(REPO_DIR, "config", "config.example.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    config = copy.deepcopy(config)
+    config["wiki"].update(domain=stub.url, requests_per_second=None)
+    config["vector_db"]["persist_directory"] = str(tmp_path / "db")
+    config["siliconflow"].update(api_key="test", base_url=f"{stub.url}/v1", max_retries=0)
+    config["answer_cache"]["enabled"] = False
+    config["logging"] = {"level": "INFO", "file": None}
+    monkeypatch.setattr(settings, "_config", config)
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: CharEncoder())
+    return config
@@ -0,0 +1,90 @@
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    return now
+
+def test_similar_question_hits(clock):
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.store("How do I restart nginx?", [1.0, 0.0, 0.0], "systemctl restart nginx", cache.generation)
+    assert cache.lookup("how do i restart  NGINX?", None) == "systemctl restart nginx"
+    assert cache.lookup("restart nginx", [0.99, 0.05, 0.0]) == "systemctl restart nginx"
+    assert cache.lookup("disk alert", [0.0, 1.0, 0.0]) is None
+    assert cache.stats() == {"hits": 2, "misses": 1, "items": 1}
+
+def test_entries_expire_after_ttl(clock):
+    cache = AnswerCache(ttl_seconds=60)
+    cache.store("q", [1.0, 0.0], "a", cache.generation)
+    clock[0] += 59
+    assert cache.lookup("q", [1.0, 0.0]) == "a"
+    clock[0] += 2
+    assert cache.lookup("q", [1.0, 0.0]) is None
+    assert cache.stats()["items"] == 0
+
+def test_store_from_before_clear_is_dropped(clock):
+    cache = AnswerCache()
+    generation = cache.generation
+    cache.store("q", [1.0, 0.0], "old", generation)
+    cache.clear()
+    assert cache.lookup("q", [1.0, 0.0]) is None
+    # 清空前开始的生成在清空后才完成，不能写回缓存
+    cache.store("q", [1.0, 0.0], "stale", generation)
+    assert cache.lookup("q", [1.0, 0.0]) is None
+    cache.store("q", [1.0, 0.0], "fresh", cache.generation)
+    assert cache.lookup("q", [1.0, 0.0]) == "fresh"
+
+def test_scopes_are_separate(clock):
+    cache = AnswerCache()
+    cache.store("q", [1.0, 0.0], "from sre", cache.generation, scope="sre")
+    assert cache.lookup("q", [1.0, 0.0], scope="dba") is None
+    assert cache.lookup("q", [1.0, 0.0], scope="sre") == "from sre"
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = AnswerCache(max_items=2)
+    cache.store("a", [1.0, 0.0, 0.0], "A", cache.generation)
+    cache.store("b", [0.0, 1.0, 0.0], "B", cache.generation)
+    assert cache.lookup("a", None) == "A"
+    cache.store("c", [0.0, 0.0, 1.0], "C", cache.generation)
+    assert cache.lookup("b", [0.0, 1.0, 0.0]) is None
+    assert cache.lookup("a", [1.0, 0.0, 0.0]) == "A"
+    assert cache.lookup("c", [0.0, 0.0, 1.0]) == "C"
+
+def test_embedding_dimension_change_only_drops_semantic_matches(clock):
+    cache = AnswerCache()
+    cache.store("old model", [1.0, 0.0], "A", cache.generation)
+    cache.store("new model", [1.0, 0.0, 0.0], "B", cache.generation)
+    assert cache.lookup("similar", [1.0, 0.0]) is None
+    assert cache.lookup("old model", None) == "A"
+    assert cache.lookup("similar", [1.0, 0.0, 0.0]) == "B"
+
+def test_coalesced_producer_keeps_trace_id():
+    from telemetry import get_trace_id, new_trace_id
+
+    new_trace_id("req-1")
+    coalescer = answer_cache.RequestCoalescer()
+    assert list(coalescer.subscribe("q", lambda: iter([get_trace_id()]))) == ["req-1"]
+
+def test_async_coalescer_holds_producer_task():
+    import asyncio
+
+    async def produce():
+        await asyncio.sleep(0)
+        yield "a"
+        yield "b"
+
+    async def main():
+        coalescer = answer_cache.AsyncRequestCoalescer()
+        stream = coalescer.subscribe("q", produce)
+        assert len(coalescer._tasks) == 1
+        events = [event async for event in stream]
+        await asyncio.sleep(0)
+        return events, coalescer._tasks
+
+    events, tasks = asyncio.run(main())
+    assert events == ["a", "b"]
+    assert not tasks
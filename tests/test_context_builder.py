@@ -0,0 +1,50 @@
+from conftest import CharEncoder
+from context_builder import ContextBuilder
+
+def passage(text: str, embedding=None, title: str = None) -> dict:
+    return {"text": text, "embedding": embedding, "metadata": {"title": title} if title else {}}
+
+def texts(passages) -> list:
+    return [item["text"] for item in passages]
+
+def test_near_duplicates_are_dropped():
+    builder = ContextBuilder(CharEncoder())
+    passages = [
+        passage("restart nginx with systemctl restart nginx on every web host"),
+        passage("restart nginx with systemctl restart nginx on every web host."),
+        passage("check disk usage with df -h before cleaning logs"),
+    ]
+    assert texts(builder.build(None, passages, limit=5)) == [passages[0]["text"], passages[2]["text"]]
+
+def test_mmr_prefers_diverse_passages():
+    builder = ContextBuilder(CharEncoder(), mmr_lambda=0.5)
+    passages = [
+        passage("nginx restart steps", [0.9, 0.44, 0.0]),
+        passage("nginx restart checklist", [0.89, 0.46, 0.0]),
+        passage("disk alert runbook", [0.8, -0.6, 0.0]),
+    ]
+    selected = builder.build([1.0, 0.0, 0.0], passages, limit=2)
+    # 第二条相关性也很高，但几乎和第一条重复
+    assert texts(selected) == ["nginx restart steps", "disk alert runbook"]
+
+def test_without_embeddings_keeps_retrieval_order():
+    builder = ContextBuilder(CharEncoder())
+    passages = [passage("first runbook"), passage("second note", [1.0, 0.0]), passage("third page")]
+    assert texts(builder.build([0.0, 1.0], passages, limit=2)) == ["first runbook", "second note"]
+
+def test_budget_truncates_last_passage():
+    builder = ContextBuilder(CharEncoder(), max_tokens=150)
+    passages = [passage("a" * 60, title="Nginx"), passage("b" * 200, title="Disk"), passage("c" * 10)]
+    selected = builder.build(None, passages, limit=3)
+    assert [item["tokens"] for item in selected] == [len("[Nginx]\n") + 60, 150 - 68]
+    assert selected[1]["truncated"]
+    assert selected[1]["text"].startswith("[Disk]\nbbb")
+
+    context = builder.render(selected)
+    assert context.startswith("[Nginx]\naaa")
+    assert len(context) == 150 + len("\n\n")
+
+def test_small_leftover_budget_is_not_filled():
+    builder = ContextBuilder(CharEncoder(), max_tokens=100)
+    passages = [passage("a" * 60), passage("b" * 60)]
+    assert texts(builder.build(None, passages, limit=2)) == ["a" * 60]
@@ -0,0 +1,41 @@
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: now[0])
+    return now
+
+def test_round_trip_through_disk(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_memory_items=1)
+    cache.put_many(["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+    reopened = EmbeddingCache(str(tmp_path))
+    assert reopened.get_many(["a", "b", "c"]) == [[1.0, 2.0], [3.0, 4.0], None]
+    assert reopened.stats()["disk_hits"] == 2
+
+def test_least_recently_used_rows_are_evicted(tmp_path, clock):
+    cache = EmbeddingCache(str(tmp_path), max_memory_items=1, max_disk_items=2)
+    cache.put_many(["a"], [[1.0]])
+    clock[0] += 1
+    cache.put_many(["b"], [[2.0]])
+    clock[0] += 1
+    cache.get_many(["a"])  # a 比 b 更近被访问
+    clock[0] += 1
+    cache.put_many(["c"], [[3.0]])
+    assert EmbeddingCache(str(tmp_path)).get_many(["a", "b", "c"]) == [[1.0], None, [3.0]]
+
+def test_rewrites_do_not_count_as_new_rows(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), max_disk_items=2)
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    for _ in range(3):
+        cache.put_many(["a", "b", "b"], [[1.0], [2.0], [2.0]])
+    assert not any(sql.startswith("DELETE") for sql in statements)
+    assert not any(sql == "SELECT COUNT(*) FROM embeddings" for sql in statements)  # 未超限时不扫全表
+    assert cache.stats()["disk_items"] == 2
+
+    cache.put_many(["c"], [[3.0]])
+    assert cache.stats()["disk_items"] == 2
@@ -0,0 +1,55 @@
+import pytest
+
+from html_extract import extract_text
+
+ENGINES = ["lxml", "html.parser"]
+
+PAGE = """
+<h2>Restart  nginx</h2>
+<p>Run the steps <b>in order</b>.<br/>Then check the logs.</p>
+<ul><li>drain the host</li><li>restart the service</li></ul>
+<ac:structured-macro ac:name="code">
+  <ac:parameter ac:name="language">bash</ac:parameter>
+  <ac:plain-text-body><![CDATA[systemctl restart nginx
+tail -n 50 /var/log/nginx/error.log]]></ac:plain-text-body>
+</ac:structured-macro>
+<table><tbody>
+  <tr><th>Host</th><th>Role</th></tr>
+  <tr><td>web-01</td><td><p>edge</p><p>proxy</p></td></tr>
+</tbody></table>
+<script>alert(1)</script>
+"""
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_structure_is_kept_as_markers(engine):
+    assert extract_text(PAGE, engine).split("\n") == [
+        "## Restart nginx",
+        "Run the steps in order.",
+        "Then check the logs.",
+        "- drain the host",
+        "- restart the service",
+        "```",
+        "systemctl restart nginx",
+        "tail -n 50 /var/log/nginx/error.log",
+        "```",
+        "| Host | Role |",
+        "| web-01 | edge proxy |",
+    ]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_code_keeps_markup_characters(engine):
+    page = "<pre>if [ $a &lt; 3 ]; then\n  echo '&lt;ok&gt;'\nfi</pre>"
+    assert extract_text(page, engine) == "```\nif [ $a < 3 ]; then\n  echo '<ok>'\nfi\n```"
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nested_table_is_folded_into_cell(engine):
+    page = "<table><tr><td>outer<table><tr><td>inner</td></tr></table></td><td>next</td></tr></table>"
+    assert extract_text(page, engine) == "| outer inner | next |"
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_empty_page_gives_empty_text(engine):
+    assert extract_text("<p> </p><script>x()</script>", engine) == ""
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError):
+        extract_text("<p>x</p>", "regex")
@@ -0,0 +1,126 @@
+import os
+
+import pytest
+from requests.adapters import HTTPAdapter
+
+from stub_servers import ROOT_ID
+
+@pytest.fixture
+def agent(config, stub):
+    from ops_agent import OpsAgent
+
+    agent = OpsAgent(stub.url, "test", "test", config["vector_db"]["persist_directory"])
+    # wiki 请求默认带退避重试，注入的 503 会让测试多等好几秒
+    agent.wiki_fetcher.session.mount("http://", HTTPAdapter())
+    return agent
+
+def stored_versions(agent) -> dict:
+    return agent.vector_db.shard("ops_docs").get_page_versions()
+
+def page_ids(agent) -> set:
+    return {page['id'] for page in agent.wiki_fetcher.list_pages(ROOT_ID)}
+
+def test_full_sync_writes_every_page(agent):
+    stats = agent.initialize(ROOT_ID, incremental=False)
+    assert stats["pages_written"] == len(page_ids(agent))
+    assert stored_versions(agent) == {page_id: 1 for page_id in page_ids(agent)}
+    assert agent.initialized
+
+def test_failed_fetch_keeps_stored_page(agent, stub):
+    agent.initialize(ROOT_ID)
+    stub.config.version = 2
+    stub.config.failing_pages = "100003"
+
+    stats = agent.initialize(ROOT_ID)
+    assert stats["pages_failed"] == 1
+    versions = stored_versions(agent)
+    assert versions.pop("100003") == 1  # 旧记录保留，下次同步重试
+    assert set(versions.values()) == {2}
+
+    stub.config.failing_pages = ""
+    assert agent.initialize(ROOT_ID)["pages_written"] == 1
+    assert stored_versions(agent)["100003"] == 2
+
+def test_failed_embedding_keeps_stored_pages(agent, config, stub):
+    config["vector_db"]["embedding_cache"]["enabled"] = False
+    agent.vector_db.embedding_cache = None
+    agent.initialize(ROOT_ID)
+    count = agent.vector_db.shard("ops_docs").collection.count()
+    stub.config.version = 2
+    stub.config.embed_error_rate = 1.0
+
+    stats = agent.initialize(ROOT_ID)
+    assert stats["pages_written"] == 0
+    assert stats["pages_failed"] == len(page_ids(agent))
+    assert agent.vector_db.shard("ops_docs").collection.count() == count
+    assert set(stored_versions(agent).values()) == {1}
+
+def test_page_without_content_is_deleted(agent, stub):
+    agent.initialize(ROOT_ID)
+    stub.config.version = 2
+    stub.config.empty_pages = "100002"
+
+    stats = agent.initialize(ROOT_ID)
+    assert stats["pages_empty"] == 1
+    assert stats["pages_failed"] == 0
+    assert "100002" not in stored_versions(agent)
+
+def test_resume_skips_checkpointed_pages(agent):
+    db = agent.vector_db.shard("ops_docs")
+    pages = agent.wiki_fetcher.list_pages(ROOT_ID)
+    pipeline = agent._create_pipeline(db, "ops_docs", ROOT_ID)
+    pipeline._save_checkpoint({page['id']: page['version'] for page in pages[:2]})
+
+    stats = pipeline.run(pages)
+    assert stats["pages_skipped"] == 2
+    assert stats["pages_written"] == len(pages) - 2
+    assert pipeline.written_ids == {page['id'] for page in pages}
+    assert not os.path.exists(pipeline.checkpoint_path)
+
+def test_write_failure_stops_run_and_keeps_checkpoint(agent, config, monkeypatch):
+    config["ingest"].update(upsert_batch_size=1, embed_workers=1, save_seconds=0)  # 每批都保存并记 checkpoint
+    db = agent.vector_db.shard("ops_docs")
+    pipeline = agent._create_pipeline(db, "ops_docs", ROOT_ID)
+    upsert = db.upsert_records
+    calls = []
+
+    def failing_upsert(page_ids, records):
+        calls.append(page_ids)
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        upsert(page_ids, records)
+
+    monkeypatch.setattr(db, "upsert_records", failing_upsert)
+    with pytest.raises(RuntimeError):
+        pipeline.run(agent.wiki_fetcher.list_pages(ROOT_ID))
+    assert pipeline.stop_event.is_set()
+    assert set(pipeline._load_checkpoint()) == set(calls[0])
+
+def test_index_saved_before_checkpoint_not_per_batch(agent, config, monkeypatch):
+    config["ingest"].update(upsert_batch_size=1)
+    db = agent.vector_db.shard("ops_docs")
+    pipeline = agent._create_pipeline(db, "ops_docs", ROOT_ID)
+    events = []
+    save, save_checkpoint = db.save, pipeline._save_checkpoint
+    monkeypatch.setattr(db, "save", lambda: (events.append("save"), save()))
+    monkeypatch.setattr(pipeline, "_save_checkpoint", lambda checkpoint: (events.append("checkpoint"), save_checkpoint(checkpoint)))
+
+    pages = agent.wiki_fetcher.list_pages(ROOT_ID)
+    assert pipeline.run(pages)["pages_written"] == len(pages)
+    assert events == ["save", "checkpoint"]  # 每个页面一批，但整个运行只保存一次
+
+def test_small_queues_do_not_deadlock(agent, config):
+    config["ingest"].update(queue_size=1, fetch_workers=4, clean_workers=2, embed_workers=2, upsert_batch_size=1)
+    stats = agent.initialize(ROOT_ID, incremental=False)
+    assert stats["pages_written"] == len(page_ids(agent))
+
+def test_full_sync_ignores_leftover_checkpoint(agent, stub):
+    agent.initialize(ROOT_ID)
+    stub.config.version = 2
+    db = agent.vector_db.shard("ops_docs")
+    leftover = agent._create_pipeline(db, "ops_docs", ROOT_ID)
+    leftover._save_checkpoint({page_id: 2 for page_id in page_ids(agent)})  # 上次中断的同步留下的
+
+    stats = agent.initialize(ROOT_ID, incremental=False)
+    assert stats["pages_skipped"] == 0
+    assert set(stored_versions(agent).values()) == {2}
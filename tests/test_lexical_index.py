@@ -0,0 +1,26 @@
+from lexical_index import looks_like_identifier, tokenize
+
+def test_identifiers_kept_whole_and_split_on_separators():
+    tokens = tokenize("Pod nginx-ingress-7d9f CrashLoopBackOff")
+    assert "nginx-ingress-7d9f" in tokens
+    assert {"nginx", "ingress", "7d9f"} <= set(tokens)
+    assert "crashloopbackoff" in tokens  # 统一小写
+
+def test_trailing_punctuation_is_not_part_of_identifier():
+    assert tokenize("see db-01.prod.") == ["see", "db-01.prod", "db", "01", "prod"]
+
+def test_chinese_runs_become_bigrams():
+    assert tokenize("磁盘告警") == ["磁盘", "盘告", "告警"]
+    assert tokenize("查 ERR42") == ["err42", "查"]
+
+def test_looks_like_identifier():
+    assert looks_like_identifier("ORA-00942")
+    assert looks_like_identifier("nginx-ingress-7d9f restart")
+    assert looks_like_identifier("db01")
+
+def test_natural_language_is_not_an_identifier():
+    assert not looks_like_identifier("")
+    assert not looks_like_identifier("restart nginx service")  # 没有数字或分隔符
+    assert not looks_like_identifier("ORA-00942 是什么错误")
+    assert not looks_like_identifier("ab")  # 太短
+    assert not looks_like_identifier("one two three four ERR-1")  # 超过 4 个词
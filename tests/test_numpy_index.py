@@ -0,0 +1,90 @@
+import pytest
+
+from numpy_index import NumpyCollection
+
+VECTORS = {
+    "a": [1.0, 0.0, 0.0],
+    "b": [0.0, 1.0, 0.0],
+    "c": [0.6, 0.8, 0.0],
+}
+
+def make_collection(path, quantization="float32") -> NumpyCollection:
+    collection = NumpyCollection(str(path), "docs", quantization=quantization)
+    collection.upsert(
+        ids=list(VECTORS),
+        embeddings=list(VECTORS.values()),
+        metadatas=[{"page_id": record_id, "root_id": "r1" if record_id != "c" else "r2"} for record_id in VECTORS],
+        documents=[f"text {record_id}" for record_id in VECTORS]
+    )
+    return collection
+
+@pytest.mark.parametrize("quantization", ["float32", "int8"])
+def test_query_ranks_by_cosine_distance(tmp_path, quantization):
+    collection = make_collection(tmp_path, quantization)
+    collection.save()
+    result = collection.query([[2.0, 0.1, 0.0]], n_results=2)
+    assert result["ids"] == [["a", "c"]]
+    assert result["documents"][0][0] == "text a"
+    assert result["distances"][0][0] == pytest.approx(1 - 2.0 / (2.0 ** 2 + 0.1 ** 2) ** 0.5, abs=1e-2)
+
+def test_upsert_replaces_and_where_filters(tmp_path):
+    collection = make_collection(tmp_path)
+    collection.upsert(ids=["a"], embeddings=[[0.0, 0.0, 1.0]], metadatas=[{"page_id": "a", "root_id": "r1"}], documents=["new a"])
+    assert collection.count() == 3
+    assert collection.get(ids=["a"])["documents"] == ["new a"]
+    assert collection.query([[0.0, 0.0, 1.0]], n_results=1)["ids"] == [["a"]]
+    assert collection.get(where={"root_id": "r2"}, include=[])["ids"] == ["c"]
+    assert collection.query([[1.0, 0.0, 0.0]], n_results=3, where={"root_id": {"$in": ["r2"]}})["ids"] == [["c"]]
+
+def test_delete_by_id_and_where(tmp_path):
+    collection = make_collection(tmp_path)
+    collection.delete(ids=["b", "missing"])
+    assert sorted(collection.get(include=[])["ids"]) == ["a", "c"]
+    collection.delete(where={"root_id": "r2"})
+    assert collection.get(include=[])["ids"] == ["a"]
+    assert collection.query([[0.0, 1.0, 0.0]], n_results=5)["ids"] == [["a"]]
+
+def test_save_round_trip(tmp_path):
+    collection = make_collection(tmp_path)
+    collection.delete(ids=["b"])
+    collection.save()
+
+    reopened = NumpyCollection(str(tmp_path), "docs", quantization="float32")
+    assert reopened.generation == collection.generation
+    assert reopened.get(include=["documents", "metadatas"]) == collection.get(include=["documents", "metadatas"])
+    assert reopened.query([[0.6, 0.8, 0.0]], n_results=1)["ids"] == [["c"]]
+    assert reopened.get(ids=["c"], include=["embeddings"])["embeddings"][0] == pytest.approx([0.6, 0.8, 0.0])
+
+def test_unsaved_changes_are_not_visible_to_readers(tmp_path):
+    collection = make_collection(tmp_path)
+    collection.save()
+    collection.delete(ids=["a"])
+
+    reader = NumpyCollection(str(tmp_path), "docs", read_only=True)
+    assert reader.count() == 3
+    collection.save()
+    assert reader.count() == 2  # 读进程在下次调用时切换到新快照
+    with pytest.raises(Exception):
+        reader.upsert(ids=["d"], embeddings=[[1.0, 1.0, 0.0]])
+
+def test_pinned_reader_keeps_its_snapshot(tmp_path):
+    collection = make_collection(tmp_path)
+    collection.save()
+    pinned = NumpyCollection(str(tmp_path), "docs", read_only=True, generation=collection.generation)
+    collection.delete(ids=["a"])
+    collection.save()
+    assert pinned.count() == 3
+
+def test_pruning_keeps_the_retained_snapshot(tmp_path):
+    collection = make_collection(tmp_path)
+    collection.save()
+    published = collection.generation
+    collection.retained = published
+    for record_id in ("a", "b", "c"):
+        collection.delete(ids=[record_id])
+        collection.save()
+
+    snapshots = sorted((tmp_path / "snapshots").iterdir())
+    assert published in [snapshot.name for snapshot in snapshots]
+    assert len(snapshots) == 3  # 最新的两个，加上被保留的已发布快照
+    assert NumpyCollection(str(tmp_path), "docs", read_only=True, generation=published).count() == 3
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+def record(page_id: str, text: str, vector):
+    return {
+        "id": f"{page_id}#0",
+        "embedding": vector,
+        "metadata": {"page_id": page_id, "title": page_id, "root_id": "root"},
+        "document": text
+    }
+
+@pytest.fixture
+def writer(config):
+    from vector_db import VectorDB
+
+    config["vector_db"]["backend"] = "numpy"
+    config["vector_db"]["numpy"]["quantization"] = "float32"
+    db = VectorDB(persist_directory=config["vector_db"]["persist_directory"])
+    db.shards.add("sre")
+    return db
+
+def open_reader(config):
+    from vector_db import VectorDB
+
+    return VectorDB(persist_directory=config["vector_db"]["persist_directory"], read_only=True)
+
+def lexical_ids(db, query: str) -> list:
+    return [record_id for record_id, _ in db.shard("sre").lexical_index.search(query)]
+
+def test_reader_sees_only_published_generations(writer, config):
+    shard = writer.shard("sre")
+    shard.upsert_records(["p1"], [record("p1", "nginx-01 disk alert", [1.0, 0.0, 0.0])])
+    writer.publish("sre")
+    reader = open_reader(config)
+    assert lexical_ids(reader, "nginx-01") == ["p1#0"]
+
+    # 入库中途保存：新打开的读进程仍然只看到已发布的快照和与之配套的 BM25 索引
+    shard.upsert_records(["p2"], [record("p2", "nginx-02 restart", [0.0, 1.0, 0.0])])
+    shard.save()
+    late_reader = open_reader(config)
+    assert late_reader.shard("sre").collection.count() == 1
+    assert lexical_ids(late_reader, "restart") == []
+    assert not reader.refresh()
+
+    writer.publish("sre")
+    assert reader.refresh()
+    assert reader.shard("sre").collection.count() == 2
+    assert lexical_ids(reader, "restart") == ["p2#0"]
+    assert reader.shard("sre").generation == 2
+
+def test_publish_keeps_current_and_previous_lexical_copies(writer, config):
+    shard = writer.shard("sre")
+    for idx in range(3):
+        shard.upsert_records([f"p{idx}"], [record(f"p{idx}", f"host-{idx} alert", [1.0, float(idx), 0.0])])
+        writer.publish("sre")
+    directory = os.path.join(config["vector_db"]["persist_directory"], "lexical")
+    assert sorted(os.listdir(directory)) == ["sre.2.json.gz", "sre.3.json.gz", "sre.json.gz"]
+
+    writer.drop_shard("sre")
+    assert os.listdir(directory) == []
+
+def test_registry_moves_roots_and_sees_other_processes(tmp_path):
+    from shards import ShardRegistry
+
+    path = str(tmp_path / "shards.json")
+    writer, reader = ShardRegistry(path), ShardRegistry(path)
+    writer.add_root("sre", "100")
+    writer.add_root("dba", "100")  # 根页面只能属于一个分片
+    assert writer.get("sre")["root_ids"] == []
+    assert writer.shard_for_root("100") == "dba"
+
+    assert reader.changed()
+    assert reader.load()
+    assert not reader.changed()
+    assert reader.names() == ["dba", "sre"]
+    writer.remove("sre")
+    assert reader.changed()
+
+def test_shard_names_and_selection_are_validated():
+    from shards import parse_shard_list, validate_shard_name
+
+    assert validate_shard_name("sre_team-1") == "sre_team-1"
+    for name in ["ab", "-sre", "sre/../x", "x" * 64, None]:
+        with pytest.raises(ValueError):
+            validate_shard_name(name)
+    assert parse_shard_list(" sre, dba ,") == ["sre", "dba"]
+    assert parse_shard_list(["sre"]) == ["sre"]
+    assert parse_shard_list("") is None
+    with pytest.raises(ValueError):
+        parse_shard_list({"sre": 1})
+
+def test_reader_picks_up_added_and_dropped_shards(writer, config):
+    writer.shard("sre").upsert_records(["p1"], [record("p1", "nginx-01 disk alert", [1.0, 0.0, 0.0])])
+    writer.publish("sre")
+    reader = open_reader(config)
+    assert reader.select_shards() == ["sre"]
+
+    writer.shards.add("dba")
+    writer.shard("dba").upsert_records(["p2"], [record("p2", "postgres vacuum", [0.0, 1.0, 0.0])])
+    writer.publish("dba")
+    assert reader.refresh()
+    hits = reader.retrieve_shards([[0.0, 1.0, 0.0]], limit=2, query_texts=["vacuum"])[0]
+    assert hits[0]["id"] == "p2#0"
+    assert {hit["id"] for hit in hits} == {"p1#0", "p2#0"}
+
+    writer.drop_shard("dba")
+    assert reader.refresh()
+    assert reader.select_shards() == ["sre"]
+    with pytest.raises(ValueError):
+        reader.select_shards(["dba"])
+
+def test_reader_keeps_old_view_until_new_generation_opens(writer, config, monkeypatch):
+    shard = writer.shard("sre")
+    shard.upsert_records(["p1"], [record("p1", "nginx-01 disk alert", [1.0, 0.0, 0.0])])
+    writer.publish("sre")
+    reader = open_reader(config)
+    old_view = reader.shard("sre")
+
+    shard.upsert_records(["p2"], [record("p2", "nginx-02 restart", [0.0, 1.0, 0.0])])
+    writer.publish("sre")
+    open_shard = reader._open_shard
+
+    def failing_open(name):
+        raise OSError("snapshot missing")
+
+    monkeypatch.setattr(reader, "_open_shard", failing_open)
+    assert reader.refresh()
+    assert reader.shard("sre") is old_view
+
+    # 打开失败的分片在下次 refresh 时重试，即使 shards.json 没有再变
+    monkeypatch.setattr(reader, "_open_shard", open_shard)
+    assert reader.refresh()
+    assert reader.shard("sre").generation == 2
+    assert reader.shard("sre").collection.count() == 2
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import pytest
+
+import siliconflow_client
+from siliconflow_client import AdaptiveLimiter, AsyncAdaptiveLimiter, AsyncSiliconFlowClient, SiliconFlowClient
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(siliconflow_client, "backoff_delay", lambda attempt, retry_after=None: 0)
+
+def run_async(stub, fn, **kwargs):
+    async def main():
+        client = AsyncSiliconFlowClient("test", base_url=f"{stub.url}/v1", **kwargs)
+        try:
+            return await fn(client)
+        finally:
+            await client.aclose()
+    return asyncio.run(main())
+
+async def collect(stream) -> bytes:
+    return b"".join([chunk async for chunk in stream])
+
+def test_sync_client_retries_throttled_requests(stub):
+    client = SiliconFlowClient("test", max_retries=2, initial_concurrency=8, base_url=f"{stub.url}/v1")
+    stub.config.throttled_requests = 2
+    assert len(client.embed(["disk alert"], "bge")) == 1
+    assert client.limiter.limit == 2  # 两次 429 各减半
+
+    stub.config.throttled_requests = 3
+    with pytest.raises(Exception, match="429"):
+        client.embed(["disk alert"], "bge")
+
+def test_async_client_retries_throttled_requests(stub):
+    async def embed(client):
+        return await client.embed(["disk alert"], "bge"), client.limiter.limit
+
+    stub.config.throttled_requests = 2
+    vectors, limit = run_async(stub, embed, max_retries=2, initial_concurrency=8)
+    assert len(vectors) == 1
+    assert limit == 2
+
+def test_async_stream_is_retried_before_first_chunk(stub):
+    stub.config.throttled_requests = 1
+    payload = {"messages": [{"role": "user", "content": "restart nginx"}]}
+
+    async def stream(client):
+        body = await collect(client.stream_chat(payload))
+        return body, client.limiter.limit
+
+    body, limit = run_async(stub, stream, max_retries=1, initial_concurrency=8)
+    assert body.endswith(b"data: [DONE]\n\n")
+    assert limit == 4
+
+    stub.config.throttled_requests = 2
+    with pytest.raises(Exception, match="429"):
+        run_async(stub, lambda client: collect(client.stream_chat(payload)), max_retries=1)
+
+def test_limiter_halves_on_throttle_and_grows_after_successes():
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=5)
+    limiter.on_throttled()
+    assert limiter.limit == 2
+    limiter.on_throttled()
+    limiter.on_throttled()
+    assert limiter.limit == 1
+    for _ in range(1 + 2):
+        limiter.on_success()
+    assert limiter.limit == 3
+    for _ in range(3 + 4 + 5):
+        limiter.on_success()
+    assert limiter.limit == 5
+
+def test_limiter_bounds_concurrency():
+    limiter = AdaptiveLimiter(initial=2)
+    peak, active, lock = [0], [0], threading.Lock()
+
+    def work():
+        with limiter.slot():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            threading.Event().wait(0.01)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+    assert limiter.in_flight == 0
+
+def test_async_limiter_bounds_concurrency_and_wakes_on_growth():
+    async def main():
+        limiter = AsyncAdaptiveLimiter(initial=1, maximum=4)
+        active, peak = [0], [0]
+
+        async def work():
+            async with limiter.slot():
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+                await asyncio.sleep(0.01)
+                active[0] -= 1
+            limiter.on_success()
+
+        await asyncio.gather(*(work() for _ in range(12)))
+        return peak[0], limiter.limit, limiter.in_flight
+
+    peak, limit, in_flight = asyncio.run(main())
+    assert 1 < peak <= limit
+    assert in_flight == 0
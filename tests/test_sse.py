@@ -0,0 +1,39 @@
+import json
+
+from sse import SSEParser, parse_delta
+
+def chat_chunk(content: str) -> str:
+    return json.dumps({"choices": [{"delta": {"content": content}}]}, ensure_ascii=False)
+
+def feed_all(parser: SSEParser, chunks) -> list:
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events + parser.close()
+
+def test_events_fed_one_byte_at_a_time():
+    stream = f"data: {chat_chunk('重启')}\n\ndata: {chat_chunk('服务')}\n\ndata: [DONE]\n\n".encode("utf-8")
+    events = feed_all(SSEParser(), [stream[i:i + 1] for i in range(len(stream))])
+    assert [parse_delta(data) for data in events] == ["重启", "服务", None]
+
+def test_crlf_line_endings():
+    stream = b"data: first\r\n\r\n: keep-alive comment\r\n\r\ndata: second\r\n\r\n"
+    assert feed_all(SSEParser(), [stream]) == ["first", "second"]
+
+def test_utf8_character_split_across_chunks():
+    encoded = "data: 磁盘告警\n\n".encode("utf-8")
+    split = encoded.index("盘".encode("utf-8")) + 1  # 切在多字节字符中间
+    parser = SSEParser()
+    assert parser.feed(encoded[:split]) == []
+    assert parser.feed(encoded[split:]) == ["磁盘告警"]
+
+def test_multiline_data_and_unterminated_last_event():
+    parser = SSEParser()
+    assert parser.feed(b"event: message\ndata: line one\ndata:line two\n\ndata: tail") == ["line one\nline two"]
+    assert parser.close() == ["tail"]
+
+def test_parse_delta():
+    assert parse_delta(chat_chunk("ok")) == "ok"
+    assert parse_delta(" [DONE] ") is None
+    assert parse_delta(json.dumps({"choices": [{"delta": {}}]})) == ""
+    assert parse_delta("not json") == ""
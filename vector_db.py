@@ -1,70 +1,272 @@
-import chromadb
-from typing import List, Dict
-import requests
-import tiktoken
+from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import copy
 import os
+import re
 import logging
-import yaml
-
-# 加载配置文件
-with open("config/config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+import shutil
+import threading
+from embedding_cache import EmbeddingCache
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from settings import get_config
+from shards import ShardRegistry, validate_shard_name
+from siliconflow_client import SiliconFlowClient
+from telemetry import EMBEDDED_TEXTS, span
 
 logger = logging.getLogger(__name__)
 
 class VectorDB:
-    def __init__(self, host: str = "localhost", port: int = 8000, persist_directory: str = "chroma_db"):
-        """Initialize the vector database with a local persistence directory."""
-        print(f"Loading Chroma database from: {os.path.abspath(persist_directory)}")
-        self.client = chromadb.PersistentClient(path=persist_directory)  # Use persistent client
+    def __init__(self, host: str = "localhost", port: int = 8000, persist_directory: str = "chroma_db", client: SiliconFlowClient = None,
+                 read_only: bool = False):
+        """Initialize the vector database with a local persistence directory.
+        
+        With vector_db.chroma_host set, Chroma is reached through that server instead of
+        opening the SQLite directory in this process. A read_only instance (a query worker)
+        never writes to the store; it needs the numpy backend or a Chroma server, and
+        switches to new shard generations published by the writer when refresh() is called.
+        """
+        # chromadb 和 tiktoken 导入较慢，延迟到真正创建 VectorDB 时再加载
+        import chromadb
+        import tiktoken
+        
+        config = get_config()
+        self.persist_directory = persist_directory
+        self.read_only = read_only
+        self.backend = config["vector_db"].get("backend", "chroma")
+        chroma_host = config["vector_db"].get("chroma_host")
+        if chroma_host:
+            logger.info(f"Connecting to Chroma server at {chroma_host}:{config['vector_db'].get('chroma_port', port)}")
+            self.chroma = chromadb.HttpClient(host=chroma_host, port=config["vector_db"].get("chroma_port", port))
+        elif read_only and self.backend == "numpy":
+            self.chroma = None  # 只读进程直接 mmap 写入进程发布的快照，不打开 SQLite
+        elif read_only:
+            raise Exception("Read-only workers need vector_db.backend 'numpy' or a Chroma server (vector_db.chroma_host)")
+        else:
+            logger.info(f"Loading Chroma database from: {os.path.abspath(persist_directory)}")
+            self.chroma = chromadb.PersistentClient(path=persist_directory)  # Use persistent client
         self.encoder = tiktoken.get_encoding("cl100k_base")  # Initialize tokenizer
         self.collection = None  # Initialize collection as None
-        self.api_key = config["siliconflow"]["api_key"]  # 从配置文件中读取 API 密钥
+        self.client = client or SiliconFlowClient.from_config(config["siliconflow"])  # 共享的 SiliconFlow 客户端
         self.chunk_size = config["vector_db"].get("chunk_size", 200)  # 从配置文件中读取 chunk_size
         self.overlap = config["vector_db"].get("overlap", 50)  # 从配置文件中读取 overlap
+        self.embedding_model = "BAAI/bge-large-zh-v1.5"
+        self.embedding_batch_size = config["vector_db"].get("embedding_batch_size", 32)  # 每个请求携带的 chunk 数
+        self.embedding_concurrency = config["vector_db"].get("embedding_concurrency", 4)  # 并行请求数上限
+        self.index_mode = config["vector_db"].get("index_mode", "document")  # document: 每页一条记录；chunk: 每个 token 窗口一条记录
+        self.merge_adjacent = config["vector_db"].get("merge_adjacent", True)  # chunk 模式下合并同一页面中相邻的命中
+        
+        # 基于内容寻址的 embedding 缓存，存放在 Chroma 目录旁
+        cache_config = config["vector_db"].get("embedding_cache", {})
+        self.embedding_cache = None
+        if cache_config.get("enabled", True):
+            self.embedding_cache = EmbeddingCache(
+                os.path.join(persist_directory, "embedding_cache"),
+                max_memory_items=cache_config.get("max_memory_items", 10000),
+                max_disk_items=cache_config.get("max_disk_items", 500000)
+            )
+        
+        # 混合检索：与 Chroma 集合同步维护的 BM25 倒排索引
+        hybrid_config = config["vector_db"].get("hybrid", {})
+        self.hybrid = hybrid_config.get("enabled", True)
+        self.rrf_k = hybrid_config.get("rrf_k", 60)
+        self.lexical_index = None
+        
+        # 向量后端：chroma 使用 Chroma 的 HNSW 索引；numpy 使用 mmap 的 NumPy 矩阵暴力检索
+        self.numpy_config = config["vector_db"].get("numpy", {})
+        
+        # 分片登记表和按分片缓存的 VectorDB 视图；查询并行扇出到各分片
+        self.shards = ShardRegistry(os.path.join(persist_directory, "shards.json"))
+        self._views: Dict[str, "VectorDB"] = {}
+        self._views_lock = threading.Lock()
+        self._stale = False  # 上次 refresh 有分片打开失败，下次重试
+        self.generation = None  # 分片视图加载的代数
+        self._fanout = ThreadPoolExecutor(max_workers=config["vector_db"].get("fanout_workers", 8), thread_name_prefix="shard-search")
+        
+    def create_collection(self, collection_name: str, snapshot: str = None, lexical_generation: int = None):
+        """Create or get a collection, loading its lexical index when hybrid search is enabled.
+        
+        With the numpy backend the collection is a NumpyCollection snapshot under
+        persist_directory/numpy/<name>; an empty snapshot is filled from the Chroma
+        collection of the same name on first use. Read-only instances open the given
+        snapshot generation, or the latest one, and the lexical index published with the
+        given shard generation instead of the writer's working copy.
+        """
+        if self.backend == "numpy":
+            self.collection = self._create_numpy_collection(collection_name, snapshot)
+        else:
+            self.collection = self.chroma.get_or_create_collection(collection_name)
+        if self.hybrid:
+            self.lexical_index = BM25Index(self._lexical_path(collection_name, lexical_generation))
+            if not self.lexical_index.load() and self.collection.count() > 0:
+                self._rebuild_lexical_index()
+        
+    def _lexical_path(self, name: str, generation: int = None) -> str:
+        """The writer's working lexical index of a collection, or the copy published with a shard generation."""
+        filename = f"{name}.json.gz" if generation is None else f"{name}.{generation}.json.gz"
+        return os.path.join(self.persist_directory, "lexical", filename)
+        
+    def _prune_lexical(self, name: str, keep=()):
+        """Delete published copies of a shard's lexical index except the given generations."""
+        directory = os.path.join(self.persist_directory, "lexical")
+        pattern = re.compile(rf"{re.escape(name)}\.(\d+)\.json\.gz")
+        for filename in os.listdir(directory) if os.path.isdir(directory) else []:
+            match = pattern.fullmatch(filename)
+            if match and int(match.group(1)) not in keep:
+                os.remove(os.path.join(directory, filename))
         
-    def create_collection(self, collection_name: str):
-        """Create or get a collection in Chroma"""
-        self.collection = self.client.get_or_create_collection(collection_name)
+    def _rebuild_lexical_index(self):
+        """Build the lexical index from the records already stored in the collection."""
+        logger.info(f"Building lexical index for collection '{self.collection.name}'")
+        result = self.collection.get(include=["documents", "metadatas"])
+        for record_id, text, metadata in zip(result['ids'], result['documents'], result['metadatas']):
+            self.lexical_index.add(record_id, text, (metadata or {}).get('page_id'))
+        if not self.read_only:
+            self.lexical_index.save()
+        
+    def _create_numpy_collection(self, collection_name: str, snapshot: str = None):
+        from numpy_index import NumpyCollection, export_chroma_collection
+        
+        read_only = self.read_only or self.numpy_config.get("read_only", False)
+        collection = NumpyCollection(
+            os.path.join(self.persist_directory, "numpy", collection_name),
+            collection_name,
+            quantization=self.numpy_config.get("quantization", "int8"),
+            read_only=read_only,
+            generation=snapshot if read_only else None
+        )
+        if not collection.read_only and collection.count() == 0:
+            chroma_collection = self.chroma.get_or_create_collection(collection_name)
+            if chroma_collection.count() > 0:
+                logger.info(f"Exporting Chroma collection '{collection_name}' to the numpy backend")
+                export_chroma_collection(chroma_collection, collection)
+        return collection
         
-    def store_documents(self, collection_name: str, documents: List[Dict], ids: List[str] = None):
-        """Store documents in the collection"""
+    def save(self):
+        """Persist the lexical index and, with the numpy backend, a new vector snapshot."""
+        if self.read_only:
+            return
+        if self.lexical_index is not None:
+            self.lexical_index.save()
+        if self.backend == "numpy" and self.collection is not None and not self.collection.read_only:
+            self.collection.save()
+        
+    def store_documents(self, collection_name: str, documents: List[Dict], ids: List[str] = None, metadatas: List[Dict] = None):
+        """Store documents in the collection, replacing any records previously stored for them.
+        
+        In document mode each document becomes one record whose embedding is the mean of its
+        chunk embeddings. In chunk mode every token window becomes its own record with the page
+        ID, title and token offsets in its metadata.
+        """
         if not self.collection:
             self.create_collection(collection_name)
         
         # Prepare data for Chroma
         if ids is None:
             ids = [str(idx) for idx in range(len(documents))]
+        if metadatas is None:
+            metadatas = [{"title": doc['title']} for doc in documents]
         
-        embeddings = []
-        metadatas = []
-        documents_to_store = []
-        
+        # 先把所有文档切块，再跨文档批量获取 embedding
+        doc_chunks = []
+        all_chunks = []
         for doc_id, doc in zip(ids, documents):
             try:
-                embedding = self._get_embedding(doc['content'])
-                embeddings.append(embedding)
-                metadatas.append({"title": doc['title']})
-                documents_to_store.append(doc['content'])
-                logger.info(f"Storing document {doc_id}: {doc['title']}")
+                chunks = self._chunk_spans(doc['content'])
             except Exception as e:
                 logger.error(f"Skipping document {doc_id} due to error: {str(e)}")
+                chunks = []
+            doc_chunks.append(chunks)
+            all_chunks.extend(chunk['text'] for chunk in chunks)
+        
+        chunk_embeddings = iter(self._get_embeddings(all_chunks, skip_errors=True))
+        
+        stored_pages = []
+        records = []
+        for doc_id, doc, metadata, chunks in zip(ids, documents, metadatas, doc_chunks):
+            vectors = [next(chunk_embeddings) for _ in chunks]
+            if not chunks or any(vector is None for vector in vectors):
+                logger.error(f"Skipping document {doc_id}: failed to embed all chunks")
                 continue
+            
+            metadata = dict(metadata, page_id=metadata.get("page_id", doc_id))
+            stored_pages.append(metadata["page_id"])
+            records.extend(self.build_records(doc_id, doc['content'], metadata, chunks, vectors))
+            logger.info(f"Storing document {doc_id}: {doc['title']} ({len(chunks)} chunks)")
         
         # Store in Chroma
-        if ids:
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                metadatas=metadatas,
-                documents=documents_to_store
-            )
-            logger.info(f"Successfully stored {len(ids)} documents in collection '{collection_name}'.")
+        if records:
+            self.upsert_records(stored_pages, records)
+            self.save()
+            logger.info(f"Successfully stored {len(stored_pages)} documents ({len(records)} records) in collection '{collection_name}'.")
         else:
             logger.warning("No valid documents to store.")
         
-    def _get_embedding(self, text: str, chunk_size: int = None, overlap: int = None):
-        """Get embedding for a given text by splitting it into overlapping chunks and merging the embeddings."""
+    def build_records(self, doc_id: str, content: str, metadata: Dict, chunks: List[Dict], vectors: List[List[float]]) -> List[Dict]:
+        """Turn one embedded document into Chroma records according to the index mode."""
+        if self.index_mode == "chunk":
+            return [
+                {
+                    "id": f"{doc_id}#{idx}",
+                    "embedding": vector,
+                    "metadata": dict(
+                        metadata,
+                        chunk_index=idx,
+                        token_start=chunk['token_start'],
+                        token_end=chunk['token_end']
+                    ),
+                    "document": chunk['text']
+                }
+                for idx, (chunk, vector) in enumerate(zip(chunks, vectors))
+            ]
+        return [{"id": doc_id, "embedding": self._mean_pool(vectors), "metadata": metadata, "document": content}]
+        
+    def upsert_records(self, page_ids: List[str], records: List[Dict]):
+        """Replace all records of the given pages with new ones."""
+        # 页面变短时旧的 chunk 不会被 upsert 覆盖，先按页面删除
+        self.delete_pages(page_ids)
+        self.collection.upsert(
+            ids=[record['id'] for record in records],
+            embeddings=[record['embedding'] for record in records],
+            metadatas=[record['metadata'] for record in records],
+            documents=[record['document'] for record in records]
+        )
+        if self.lexical_index is not None:
+            for record in records:
+                self.lexical_index.add(record['id'], record['document'], record['metadata'].get('page_id'))
+        
+    def get_metadatas(self, where: Dict = None) -> Dict[str, Dict]:
+        """Return the metadata of stored records, keyed by ID"""
+        result = self.collection.get(where=where, include=["metadatas"])
+        return dict(zip(result['ids'], result['metadatas']))
+        
+    def get_page_versions(self, where: Dict = None) -> Dict[str, int]:
+        """Return the stored version of each page, keyed by page ID"""
+        return {
+            metadata['page_id']: metadata.get('version')
+            for metadata in self.get_metadatas(where).values()
+            if metadata and 'page_id' in metadata
+        }
+        
+    def delete_pages(self, page_ids: List[str]):
+        """Delete all records (documents or chunks) belonging to the given pages"""
+        if page_ids:
+            self.collection.delete(where={"page_id": {"$in": list(page_ids)}})
+            if self.lexical_index is not None:
+                self.lexical_index.remove_pages(page_ids)
+            logger.info(f"Deleted records of {len(page_ids)} pages from the collection.")
+        
+    def delete_documents(self, ids: List[str]):
+        """Delete records from the collection"""
+        if ids:
+            self.collection.delete(ids=ids)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(ids)
+            logger.info(f"Deleted {len(ids)} documents from the collection.")
+        
+    def _chunk_spans(self, text: str, chunk_size: int = None, overlap: int = None) -> List[Dict]:
+        """Split text into overlapping token windows, keeping their token offsets."""
         if chunk_size is None:
             chunk_size = self.chunk_size
         if overlap is None:
@@ -74,38 +276,383 @@ class VectorDB:
         if len(tokens) == 0:
             raise Exception("Input text is empty after encoding")
         
-        embeddings = []
-        for i in range(0, len(tokens), chunk_size - overlap):
-            chunk_tokens = tokens[i:i + chunk_size]
-            chunk_text = self.encoder.decode(chunk_tokens)
-            print(f"Processing chunk {i} to {i + chunk_size}: {chunk_text[:100]}...")  # Log first 100 chars of chunk
-            
-            response = requests.post(
-                "https://api.siliconflow.cn/v1/embeddings",
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                json={"input": chunk_text, "model": "BAAI/bge-large-zh-v1.5"}
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Embedding API failed with status {response.status_code}: {response.text}")
-            
-            data = response.json()
-            if 'data' not in data or len(data['data']) == 0:
-                raise Exception("Invalid response format: missing 'data' field")
-            embeddings.append(data['data'][0]['embedding'])
+        return [
+            {
+                "text": self.encoder.decode(tokens[i:i + chunk_size]),
+                "token_start": i,
+                "token_end": min(i + chunk_size, len(tokens))
+            }
+            for i in range(0, len(tokens), chunk_size - overlap)
+        ]
+        
+    def _chunk_text(self, text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+        """Split text into overlapping token windows."""
+        return [chunk['text'] for chunk in self._chunk_spans(text, chunk_size, overlap)]
+        
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts with a single API request."""
+        with span("embed_batch"):
+            return self.client.embed(texts, self.embedding_model)
+        
+    def _get_embeddings(self, texts: List[str], skip_errors: bool = False) -> List[Optional[List[float]]]:
+        """Embed many texts using batched requests sent with bounded concurrency.
+        
+        Texts already in the embedding cache are not sent to the API.
+        With skip_errors=True, texts of a failed batch map to None instead of raising.
+        """
+        if self.embedding_cache:
+            keys = [EmbeddingCache.make_key(self.embedding_model, text) for text in texts]
+            results = self.embedding_cache.get_many(keys)
+        else:
+            keys = None
+            results = [None] * len(texts)
         
-        # Merge embeddings using mean pooling
+        # 同一批次中重复的文本只请求一次
+        missing = {}
+        for idx, (text, embedding) in enumerate(zip(texts, results)):
+            if embedding is None:
+                missing.setdefault(text, []).append(idx)
+        EMBEDDED_TEXTS.inc(len(texts) - sum(len(idxs) for idxs in missing.values()), source="cache")
+        if not missing:
+            return results
+        
+        missing_texts = list(missing)
+        EMBEDDED_TEXTS.inc(len(missing_texts), source="api")
+        batches = [
+            missing_texts[i:i + self.embedding_batch_size]
+            for i in range(0, len(missing_texts), self.embedding_batch_size)
+        ]
+        
+        def run(batch):
+            try:
+                embeddings = self._embed_batch(batch)
+            except Exception as e:
+                if not skip_errors:
+                    raise
+                logger.error(f"Embedding batch of {len(batch)} chunks failed: {str(e)}")
+                return [None] * len(batch)
+            if self.embedding_cache:
+                self.embedding_cache.put_many([keys[missing[text][0]] for text in batch], embeddings)
+            return embeddings
+        
+        logger.info(f"Embedding {len(missing_texts)} of {len(texts)} chunks in {len(batches)} batches")
+        with ThreadPoolExecutor(max_workers=min(self.embedding_concurrency, len(batches))) as executor:
+            batch_results = list(executor.map(run, batches))
+        
+        for batch, embeddings in zip(batches, batch_results):
+            for text, embedding in zip(batch, embeddings):
+                for idx in missing[text]:
+                    results[idx] = embedding
+        return results
+        
+    @staticmethod
+    def _mean_pool(embeddings: List[List[float]]) -> List[float]:
+        """Merge embeddings using mean pooling"""
         return [sum(x) / len(x) for x in zip(*embeddings)]
         
-    def search(self, query_embedding, limit: int = 3):
+    def _get_embedding(self, text: str, chunk_size: int = None, overlap: int = None):
+        """Get embedding for a given text by splitting it into overlapping chunks and merging the embeddings."""
+        chunks = self._chunk_text(text, chunk_size, overlap)
+        return self._mean_pool(self._get_embeddings(chunks))
+        
+    def _get_embedding_many(self, texts: List[str]) -> List[List[float]]:
+        """Batch variant of _get_embedding: the chunks of all texts share the same batched API calls."""
+        chunk_lists = [self._chunk_text(text) for text in texts]
+        embeddings = self._get_embeddings([chunk for chunks in chunk_lists for chunk in chunks])
+        pooled, start = [], 0
+        for chunks in chunk_lists:
+            pooled.append(self._mean_pool(embeddings[start:start + len(chunks)]))
+            start += len(chunks)
+        return pooled
+        
+    async def _aget_embedding(self, client, text: str):
+        """Async variant of _get_embedding that sends uncached chunks through an AsyncSiliconFlowClient."""
+        chunks = self._chunk_text(text)
+        keys = [EmbeddingCache.make_key(self.embedding_model, chunk) for chunk in chunks]
+        # 缓存的磁盘层是 SQLite，读写放到线程里，不阻塞事件循环
+        if self.embedding_cache:
+            embeddings = await asyncio.to_thread(self.embedding_cache.get_many, keys)
+        else:
+            embeddings = [None] * len(chunks)
+        
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        EMBEDDED_TEXTS.inc(len(chunks) - len(missing), source="cache")
+        EMBEDDED_TEXTS.inc(len(missing), source="api")
+        for i in range(0, len(missing), self.embedding_batch_size):
+            batch = missing[i:i + self.embedding_batch_size]
+            with span("embed_batch"):
+                vectors = await client.embed([chunks[idx] for idx in batch], self.embedding_model)
+            for idx, vector in zip(batch, vectors):
+                embeddings[idx] = vector
+            if self.embedding_cache:
+                await asyncio.to_thread(self.embedding_cache.put_many, [keys[idx] for idx in batch], vectors)
+        
+        return self._mean_pool(embeddings)
+        
+    def search(self, query_embedding, limit: int = 3, include_embeddings: bool = False):
         """Search for similar documents in the collection"""
+        return self.search_many([query_embedding], limit=limit, include_embeddings=include_embeddings)
+        
+    def search_many(self, query_embeddings: List[List[float]], limit: int = 3, include_embeddings: bool = False):
+        """Search for several query embeddings with a single collection query; results are per query."""
         if not self.collection:
             raise Exception("Collection is not initialized. Please create a collection first.")
         
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=limit
-        )
+        include = ["documents", "metadatas", "distances"]
+        if include_embeddings:
+            include.append("embeddings")
+        with span("vector_search"):
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=limit,
+                include=include
+            )
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for ids, distances in zip(results['ids'], results['distances']):
+                logger.debug(f"Search returned {len(ids)} results, distances: {distances}")
+        return results
+        
+    def retrieve(self, query_embedding, limit: int = 3, include_embeddings: bool = False, query_text: str = None) -> List[Dict]:
+        """Search the collection and return passages with their metadata, distance and fused score.
+        
+        When hybrid search is enabled and query_text is given, BM25 hits are fused with the
+        vector hits by reciprocal rank fusion. A query_embedding of None searches the lexical
+        index only. In chunk mode, hits on adjacent chunks of the same page are merged into
+        one passage when merge_adjacent is enabled.
+        """
+        return self.retrieve_many([query_embedding], limit, include_embeddings, [query_text])[0]
+        
+    def retrieve_many(self, query_embeddings: List, limit: int = 3, include_embeddings: bool = False,
+                      query_texts: List[str] = None) -> List[List[Dict]]:
+        """Batch variant of retrieve: all non-None embeddings go to the collection in one query."""
+        return [self._rank(hits, limit) for hits in self._candidates(query_embeddings, limit, include_embeddings, query_texts)]
+        
+    def _candidates(self, query_embeddings: List, limit: int, include_embeddings: bool, query_texts: List[str] = None) -> List[Dict]:
+        """Vector and BM25 hits of each query in this collection, before fusion.
+        
+        Each entry has the passages by ID, the vector hits as (distance, id) and the
+        lexical hits as (bm25 score, id), so hits from several shards can be merged
+        before they are ranked.
+        """
+        query_texts = query_texts or [None] * len(query_embeddings)
+        candidates = [{"passages": {}, "vector": [], "lexical": []} for _ in query_embeddings]
+        vector_rows = [idx for idx, embedding in enumerate(query_embeddings) if embedding is not None]
+        if vector_rows:
+            results = self.search_many([query_embeddings[idx] for idx in vector_rows], limit=limit, include_embeddings=include_embeddings)
+            for row, idx in enumerate(vector_rows):
+                embeddings = results['embeddings'][row] if include_embeddings else [None] * len(results['ids'][row])
+                for record_id, text, metadata, distance, embedding in zip(
+                    results['ids'][row], results['documents'][row],
+                    results['metadatas'][row], results['distances'][row], embeddings
+                ):
+                    candidates[idx]["passages"][record_id] = {
+                        "id": record_id, "text": text, "metadata": metadata or {}, "distance": distance, "embedding": embedding
+                    }
+                    candidates[idx]["vector"].append((distance, record_id))
+        
+        if self.lexical_index is not None:
+            for query_text, hits in zip(query_texts, candidates):
+                if not query_text:
+                    continue
+                with span("lexical_search"):
+                    hits["lexical"] = [(score, record_id) for record_id, score in self.lexical_index.search(query_text, limit)]
+                missing = [record_id for _, record_id in hits["lexical"] if record_id not in hits["passages"]]
+                for passage in self._get_passages(missing, include_embeddings):
+                    hits["passages"][passage['id']] = passage
+        return candidates
+        
+    def _rank(self, hits: Dict, limit: int) -> List[Dict]:
+        """Fuse vector and BM25 hits by reciprocal rank fusion and merge adjacent chunks."""
+        rankings = [
+            [record_id for _, record_id in sorted(hits["vector"], key=lambda hit: hit[0])[:limit]],
+            [record_id for _, record_id in sorted(hits["lexical"], key=lambda hit: -hit[0])[:limit]]
+        ]
+        scores = reciprocal_rank_fusion(rankings, k=self.rrf_k)
+        passages = list(hits["passages"].values())
+        for passage in passages:
+            passage['score'] = scores.get(passage['id'], 0.0)
+        passages = sorted(passages, key=lambda passage: passage['score'], reverse=True)[:limit]
+        
+        if self.index_mode == "chunk" and self.merge_adjacent:
+            passages = self._merge_adjacent(passages)
+        return passages
+        
+    # ---- 分片：每个分片是一个独立的集合（及其 BM25 索引），由 shards.json 登记 ----
+    
+    def shard(self, name: str) -> "VectorDB":
+        """Return a VectorDB bound to the collection of one shard, sharing clients and caches with this one."""
+        with self._views_lock:
+            view = self._views.get(name)
+            if view is None:
+                view = self._open_shard(validate_shard_name(name))
+                self._views[name] = view
+            return view
+        
+    def _open_shard(self, name: str) -> "VectorDB":
+        entry = self.shards.get(name) or {}
+        view = copy.copy(self)
+        view.generation = entry.get("generation")
+        if self.read_only:
+            view.create_collection(name, snapshot=entry.get("snapshot"), lexical_generation=entry.get("lexical"))
+        else:
+            view.create_collection(name)
+        if self.backend == "numpy" and not self.read_only:
+            view.collection.retained = entry.get("snapshot")
+        return view
+        
+    def publish(self, name: str):
+        """Record a new generation of a shard after writing to it, so query workers switch to it.
+        
+        The vector snapshot and a copy of the lexical index are published together: the
+        writer keeps rewriting its working lexical index during the next ingestion, while
+        readers stay on the copy that matches their pinned snapshot.
+        """
+        view = self.shard(name)
+        view.save()
+        entry = self.shards.get(name) or {}
+        fields = {"records": view.collection.count(), "generation": entry.get("generation", 0) + 1}
+        if self.backend == "numpy":
+            fields["snapshot"] = view.collection.generation
+            view.collection.retained = fields["snapshot"]  # 入库中途保存快照时不能清理掉它
+        if view.lexical_index is not None and os.path.exists(view.lexical_index.path):
+            published = self._lexical_path(name, fields["generation"])
+            shutil.copyfile(view.lexical_index.path, published + ".tmp")
+            os.replace(published + ".tmp", published)
+            fields["lexical"] = fields["generation"]
+        self.shards.update(name, **fields)
+        # 保留上一版本，正在切换的读进程还可能打开它
+        self._prune_lexical(name, keep={fields.get("lexical"), entry.get("lexical")})
+        
+    def refresh(self) -> bool:
+        """Switch to the shard generations last published by the writer (read-only instances).
+        
+        Shards whose generation changed are opened in full before the view table is
+        swapped, so a query sees either the old or the new generation of a shard, never a
+        mix. Returns True if anything changed.
+        """
+        if not self._stale and not self.shards.changed():
+            return False
+        self.shards.load()
+        with self._views_lock:
+            current = dict(self._views)
+        
+        views, self._stale = {}, False
+        for entry in self.shards.entries():
+            view = current.get(entry["name"])
+            if view is None or view.generation != entry.get("generation"):
+                try:
+                    view = self._open_shard(entry["name"])
+                    logger.info(f"Loaded generation {entry.get('generation')} of shard '{entry['name']}'")
+                except Exception as e:
+                    # 快照可能已被写入进程清理，保留旧视图，下次再试
+                    logger.error(f"Failed to open shard '{entry['name']}': {str(e)}")
+                    self._stale = True
+            if view is not None:
+                views[entry["name"]] = view
+        with self._views_lock:
+            self._views = views
+        return True
+        
+    def select_shards(self, names: List[str] = None) -> List[str]:
+        """Resolve a shard selection: None or empty means all registered shards."""
+        registered = self.shards.names()
+        if not names:
+            return registered
+        unknown = [name for name in names if name not in registered]
+        if unknown:
+            raise ValueError(f"Unknown shard(s): {', '.join(unknown)}")
+        return list(dict.fromkeys(names))
+        
+    def retrieve_shards(self, query_embeddings: List, limit: int = 3, include_embeddings: bool = False,
+                        query_texts: List[str] = None, shards: List[str] = None) -> List[List[Dict]]:
+        """retrieve_many over several shards: each shard is searched in parallel and the hits of
+        all shards are merged into one global top-k per query.
+        """
+        # 登记为空的分片（例如根页面已移走）不参与检索
+        views = [self.shard(name) for name in self.select_shards(shards) if self.shards.get(name).get("records", 1)]
+        if not views:
+            return [[] for _ in query_embeddings]
+        search = lambda view: view._candidates(query_embeddings, limit, include_embeddings, query_texts)  # noqa: E731
+        if len(views) == 1:
+            per_shard = [search(views[0])]
+        else:
+            # 每个任务复制一份上下文，日志沿用请求的 trace ID
+            futures = [self._fanout.submit(contextvars.copy_context().run, search, view) for view in views]
+            per_shard = [future.result() for future in futures]
+        
+        merged = []
+        for shard_hits in zip(*per_shard):
+            hits = {"passages": {}, "vector": [], "lexical": []}
+            for shard_hit in shard_hits:
+                for record_id, passage in shard_hit["passages"].items():
+                    hits["passages"].setdefault(record_id, passage)
+                hits["vector"].extend(shard_hit["vector"])
+                hits["lexical"].extend(shard_hit["lexical"])
+            merged.append(self._rank(hits, limit))
+        return merged
+        
+    def drop_shard(self, name: str) -> bool:
+        """Delete a shard's collection, lexical index and vector snapshots and unregister it."""
+        if self.read_only:
+            raise Exception("Cannot drop shards from a read-only worker")
+        if self.shards.get(name) is None:
+            return False
+        with self._views_lock:
+            self._views.pop(name, None)
+        try:
+            self.chroma.delete_collection(name)
+        except ValueError:
+            pass  # 集合不存在（例如只使用过 numpy 后端）
+        shutil.rmtree(os.path.join(self.persist_directory, "numpy", name), ignore_errors=True)
+        lexical_path = self._lexical_path(name)
+        if os.path.exists(lexical_path):
+            os.remove(lexical_path)
+        self._prune_lexical(name)
+        self.shards.remove(name)
+        logger.info(f"Dropped shard '{name}'")
+        return True
+        
+    def _get_passages(self, ids: List[str], include_embeddings: bool = False) -> List[Dict]:
+        """Load records by ID as passages without a vector distance."""
+        if not ids:
+            return []
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        result = self.collection.get(ids=ids, include=include)
+        embeddings = result['embeddings'] if include_embeddings else [None] * len(result['ids'])
+        return [
+            {"id": record_id, "text": text, "metadata": metadata or {}, "distance": None, "embedding": embedding}
+            for record_id, text, metadata, embedding in zip(result['ids'], result['documents'], result['metadatas'], embeddings)
+        ]
+        
+    def _merge_adjacent(self, passages: List[Dict]) -> List[Dict]:
+        """Merge hits on consecutive chunks of a page, keeping the best score and distance."""
+        groups = {}
+        for passage in passages:
+            groups.setdefault(passage['metadata'].get('page_id'), []).append(passage)
+        
+        merged = []
+        for page_id, hits in groups.items():
+            if page_id is None:
+                merged.extend(hits)
+                continue
+            hits.sort(key=lambda hit: hit['metadata'].get('chunk_index', 0))
+            current = dict(hits[0])
+            for hit in hits[1:]:
+                if hit['metadata'].get('chunk_index') == current['metadata'].get('chunk_index') + 1:
+                    # 相邻窗口有重叠，去掉后一个窗口中重复的 token
+                    shared = max(current['metadata']['token_end'] - hit['metadata']['token_start'], 0)
+                    tail = self.encoder.decode(self.encoder.encode(hit['text'])[shared:])
+                    current['text'] += tail
+                    current['score'] = max(current['score'], hit['score'])
+                    distances = [d for d in (current['distance'], hit['distance']) if d is not None]
+                    current['distance'] = min(distances) if distances else None
+                    current['metadata'] = dict(current['metadata'],
+                                               chunk_index=hit['metadata']['chunk_index'],
+                                               token_end=hit['metadata']['token_end'])
+                else:
+                    merged.append(current)
+                    current = dict(hit)
+            merged.append(current)
         
-        print(f"Search results: {results}")  # Log search results
-        return results 
\ No newline at end of file
+        return sorted(merged, key=lambda passage: passage['score'], reverse=True)
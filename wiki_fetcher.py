@@ -1,20 +1,45 @@
 import requests
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator
 import logging
-from bs4 import BeautifulSoup
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import socket
+from html_extract import extract_text
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class _RateLimiter:
+    """Space out calls so that at most `rate` happen per second across threads."""
+    
+    def __init__(self, rate: float = None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+        
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
 class WikiDataFetcher:
-    def __init__(self, wiki_domain: str, wiki_username: str, wiki_password: str):
+    def __init__(self, wiki_domain: str, wiki_username: str, wiki_password: str,
+                 max_workers: int = 8, requests_per_second: float = None, page_size: int = 100,
+                 html_engine: str = "auto"):
         self.wiki_domain = wiki_domain
         self.wiki_username = wiki_username
         self.wiki_password = wiki_password
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.html_engine = html_engine  # 见 html_extract.extract_text
+        self.rate_limiter = _RateLimiter(requests_per_second)
         self.session = requests.Session()
         self.session.auth = (self.wiki_username, self.wiki_password)
         
@@ -22,9 +47,9 @@ class WikiDataFetcher:
         retry_strategy = Retry(
             total=3,
             backoff_factor=1,
-            status_forcelist=[500, 502, 503, 504]
+            status_forcelist=[429, 500, 502, 503, 504]
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=max_workers)
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
         
@@ -34,34 +59,107 @@ class WikiDataFetcher:
         except socket.gaierror as e:
             logger.error(f"Failed to resolve {self.wiki_domain}: {str(e)}")
         
-    def fetch_page_and_children(self, page_id: str) -> List[Dict]:
-        """Fetch a page and its children from the wiki."""
-        documents = []
+    def fetch_page_and_children(self, page_id: str) -> Iterator[Dict]:
+        """Crawl a page and all of its descendants, yielding documents as they are fetched."""
+        pages = self.list_pages(page_id)
+        logger.info(f"Found {len(pages)} pages under page {page_id}")
+        yield from self.fetch_pages(page['id'] for page in pages)
+        
+    def list_pages(self, page_id: str) -> List[Dict]:
+        """List a page and all of its descendants with their versions, without fetching bodies.
+        
+        Errors are raised rather than logged, since an incomplete listing would make
+        the incremental sync delete pages that still exist.
+        """
+        url = f"{self.wiki_domain}/rest/api/content/{page_id}"
+        response = self._get(url, params={"expand": "version"})
+        response.raise_for_status()
+        pages = [self._page_info(response.json())]
         
-        # Fetch the main page
-        main_page = self._fetch_page(page_id)
-        if main_page:
-            documents.append(main_page)
-        else:
-            logger.warning(f"Main page {page_id} is empty or failed to fetch, but continuing to fetch child pages.")
+        cql = f"ancestor={page_id} and type=page"
+        pages.extend(self._page_info(item) for item in self._search(cql, expand="version"))
+        return pages
+        
+    def fetch_pages(self, page_ids: Iterable[str]) -> Iterator[Dict]:
+        """Fetch pages concurrently, yielding them in completion order.
+        
+        Pages that are empty or fail to fetch are skipped. At most twice the worker
+        count is in flight, so results never pile up faster than they are consumed.
+        """
+        page_ids = iter(page_ids)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            while True:
+                for page_id in page_ids:
+                    pending.add(executor.submit(self._fetch_page, page_id))
+                    if len(pending) >= self.max_workers * 2:
+                        break
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = future.result()
+                    if page:
+                        yield page
+        
+    def _search(self, cql: str, expand: str) -> Iterator[Dict]:
+        """Run a CQL content search, following pagination until all results are read."""
+        url = f"{self.wiki_domain}/rest/api/content/search"
+        start = 0
+        while True:
+            params = {
+                "cql": cql,
+                "expand": expand,
+                "start": start,
+                "limit": self.page_size
+            }
+            response = self._get(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            results = data.get('results', [])
+            yield from results
+            
+            # 服务端可能会把 limit 截断到更小的值，因此以 next 链接判断是否还有下一页
+            if not results or 'next' not in data.get('_links', {}):
+                return
+            start += len(results)
         
-        # Fetch child pages
-        child_pages = self._fetch_child_pages(page_id)
-        if child_pages:
-            documents.extend(child_pages)
-        else:
-            logger.warning(f"No child pages found for page {page_id}.")
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """GET through the shared session, respecting the configured request rate."""
+        self.rate_limiter.wait()
+        kwargs.setdefault("timeout", 10)
+        return self.session.get(url, **kwargs)
         
-        return documents
+    @staticmethod
+    def _page_info(item: Dict) -> Dict:
+        """Extract the ID, title and version information of a content item."""
+        version = item.get('version', {})
+        return {
+            "id": str(item['id']),
+            "title": item['title'],
+            "version": version.get('number', 0),
+            "last_modified": version.get('when', "")
+        }
         
     def _fetch_page(self, page_id: str) -> Dict:
         """Fetch a single page from the wiki."""
+        page = self._fetch_raw_page(page_id)
+        if page:
+            page["content"] = self._clean_content(page.pop("html"))
+        return page
+        
+    def _fetch_raw_page(self, page_id: str, raise_errors: bool = False) -> Dict:
+        """Fetch a single page with its uncleaned HTML body under 'html'.
+        
+        Returns None for a page without content. Request errors also return None unless
+        raise_errors is set, so callers that must tell the two apart can do so.
+        """
         url = f"{self.wiki_domain}/rest/api/content/{page_id}"
         params = {
-            "expand": "body.storage,body.view"  # 同时获取 storage 和 view 格式的内容
+            "expand": "body.storage,body.view,version"  # 同时获取 storage 和 view 格式的内容
         }
         try:
-            response = self.session.get(url, params=params, timeout=10)
+            response = self._get(url, params=params)
             response.raise_for_status()
             data = response.json()
             
@@ -73,54 +171,18 @@ class WikiDataFetcher:
                 logger.error(f"No content found for page {page_id}")
                 return None
             
-            return {
-                "title": data['title'],
-                "content": self._clean_content(content)
-            }
+            page = self._page_info(data)
+            page["html"] = content
+            return page
         except requests.exceptions.RequestException as e:
+            if raise_errors:
+                raise
             logger.error(f"Failed to fetch page {page_id}: {str(e)}")
             return None
         
-    def _fetch_child_pages(self, page_id: str) -> List[Dict]:
-        """Fetch child pages of a given page."""
-        url = f"{self.wiki_domain}/rest/api/content/search"
-        params = {
-            "cql": f"parent={page_id}",
-            "expand": "body.storage,body.view"
-        }
-        
-        try:
-            response = self.session.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            
-            child_pages = []
-            for item in response.json()['results']:
-                content = item.get('body', {}).get('storage', {}).get('value') or \
-                         item.get('body', {}).get('view', {}).get('value')
-                
-                if content:
-                    child_pages.append({
-                        'title': item['title'],
-                        'content': self._clean_content(content)
-                    })
-            
-            return child_pages
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to fetch child pages: {str(e)}")
-            return []
-
     def _clean_content(self, html_content: str) -> str:
-        """Extract clean text from HTML content"""
-        soup = BeautifulSoup(html_content, 'html.parser')
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        # Get text and clean up whitespace
-        text = soup.get_text()
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        return text
+        """Extract text from HTML content, keeping headings, code blocks and tables as markers"""
+        return extract_text(html_content, self.html_engine)
         
     def _fetch_single_page(self, page_id: str) -> Dict:
         """Fetch a single page by its ID"""
@@ -130,7 +192,7 @@ class WikiDataFetcher:
         }
         
         logger.info(f"Fetching single page: {url}")
-        response = self.session.get(url, params=params)
+        response = self._get(url, params=params)
         if response.status_code != 200:
             logger.error(f"Failed to fetch page {page_id}: {response.status_code}")
             raise Exception(f"Failed to fetch page {page_id}: {response.status_code}\nResponse: {response.text}")
@@ -141,26 +203,3 @@ class WikiDataFetcher:
             'title': item['title'],
             'content': self._clean_content(item['body']['storage']['value'])
         }
-        
-    def _fetch_child_pages(self, page_id: str) -> List[Dict]:
-        """Fetch all child pages of a given page"""
-        url = f"{self.wiki_domain}/rest/api/content/search"
-        params = {
-            "cql": f"parent={page_id}",
-            "expand": "body.storage"
-        }
-        
-        logger.info(f"Fetching child pages for parent_id: {page_id}")
-        response = self.session.get(url, params=params)
-        if response.status_code != 200:
-            logger.error(f"Failed to fetch child pages: {response.status_code}")
-            raise Exception(f"Failed to fetch child pages: {response.status_code}\nResponse: {response.text}")
-            
-        contents = []
-        for item in response.json()['results']:
-            logger.info(f"Found child page: {item['title']}")
-            contents.append({
-                'title': item['title'],
-                'content': self._clean_content(item['body']['storage']['value'])
-            })
-        return contents 
\ No newline at end of file